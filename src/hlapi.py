@@ -3,13 +3,147 @@ from lib.jr import jrfuncs
 from lib.jr import jroptions
 from lib.jr.jrfuncs import jrprint
 from lib.jr.jrfuncs import jrException
+from lib.jr.hlfuzzyindex import FuzzyNameAddressIndex
 
 # python imports
 import csv
 import os
 import pathlib
 import json
-from difflib import SequenceMatcher
+import pickle
+import gc
+import array
+import re
+import math
+import concurrent.futures
+import multiprocessing
+
+
+# bump when the format of the compiled lead cache changes
+leadCacheVersion = 2
+
+# whitespace between json values
+jsonWhitespaceRegex = re.compile(r'[ \t\n\r]*')
+
+
+
+# ---------------------------------------------------------------------------
+class LeadSourceTable:
+    # the leads of one GeoJSON lead file, without keeping the features themselves in memory
+    # we keep only the property columns we search on, plus the byte span of each feature in the file, so the full feature (all properties and geometry) can be read back when it is needed
+    # rows read back are memoized, so asking for the same row twice gives the same dict (callers compare rows by identity)
+    def __init__(self, filePath, sourceKey, relativeFilePath):
+        self.filePath = filePath
+        self.sourceKey = sourceKey
+        # path relative to the leads directory, so a cached table can be pointed back at its file
+        self.relativeFilePath = relativeFilePath
+        # columns, one entry per row
+        self.leadIds = []
+        self.dNames = []
+        self.addresses = []
+        # byte offsets of the start and end of each feature in the file
+        self.featureStarts = array.array('q')
+        self.featureEnds = array.array('q')
+        # rowIndex -> full feature dict, for rows read back so far
+        self.loadedRows = {}
+
+    def __getstate__(self):
+        # rows read back are not part of the compiled cache
+        state = dict(self.__dict__)
+        state['loadedRows'] = {}
+        return state
+
+    def getRowCount(self):
+        return len(self.leadIds)
+
+    def getRow(self, rowIndex):
+        # the full feature dict of a row, exactly as json.load would have given it
+        row = self.loadedRows.get(rowIndex)
+        if (row is None):
+            featureStart = self.featureStarts[rowIndex]
+            with open(self.filePath, 'rb') as jsonFile:
+                jsonFile.seek(featureStart)
+                featureBytes = jsonFile.read(self.featureEnds[rowIndex] - featureStart)
+            row = json.loads(featureBytes.decode('utf-8'))
+            self.loadedRows[rowIndex] = row
+        return row
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def loadFromFile(self):
+        # walk the top level object of the file and decode the features one at a time, keeping only our columns of each
+        # anything else at the top level (type, crs) is decoded and skipped
+        encoding = 'utf-8'
+        # newline='' so that \r\n is not translated and character offsets map to the bytes of the file (see getRow)
+        with open(self.filePath, 'r', encoding=encoding, newline='') as jsonFile:
+            text = jsonFile.read()
+        decoder = json.JSONDecoder()
+        # we track byte offsets as we go; for pure ascii text they are the same as character offsets
+        self.textIsAscii = text.isascii()
+        self.byteScanCharPos = 0
+        self.byteScanBytePos = 0
+        #
+        pos = self.skipJsonWhitespace(text, 0)
+        pos = self.expectJsonCharacter(text, pos, '{')
+        foundFeatures = False
+        while True:
+            pos = self.skipJsonWhitespace(text, pos)
+            if (text.startswith('}', pos)):
+                break
+            [keyName, pos] = decoder.raw_decode(text, pos)
+            pos = self.skipJsonWhitespace(text, pos)
+            pos = self.expectJsonCharacter(text, pos, ':')
+            pos = self.skipJsonWhitespace(text, pos)
+            if (keyName=='features'):
+                pos = self.loadFeatures(text, pos, decoder)
+                foundFeatures = True
+            else:
+                [val, pos] = decoder.raw_decode(text, pos)
+            pos = self.skipJsonWhitespace(text, pos)
+            if (text.startswith(',', pos)):
+                pos += 1
+        del self.textIsAscii, self.byteScanCharPos, self.byteScanBytePos
+        if (not foundFeatures):
+            raise Exception('Lead file "{}" has no "features" list.'.format(self.filePath))
+
+
+    def loadFeatures(self, text, pos, decoder):
+        pos = self.expectJsonCharacter(text, pos, '[')
+        while True:
+            pos = self.skipJsonWhitespace(text, pos)
+            if (text.startswith(']', pos)):
+                return pos+1
+            [feature, endPos] = decoder.raw_decode(text, pos)
+            properties = feature['properties']
+            self.leadIds.append(properties.get('lead'))
+            self.dNames.append(properties.get('dName'))
+            self.addresses.append(properties.get('address'))
+            self.featureStarts.append(self.calcByteOffset(text, pos))
+            self.featureEnds.append(self.calcByteOffset(text, endPos))
+            pos = self.skipJsonWhitespace(text, endPos)
+            if (text.startswith(',', pos)):
+                pos += 1
+
+
+    def calcByteOffset(self, text, charPos):
+        # charPos must not be before the last one we were asked for
+        if (self.textIsAscii):
+            return charPos
+        self.byteScanBytePos += len(text[self.byteScanCharPos:charPos].encode('utf-8'))
+        self.byteScanCharPos = charPos
+        return self.byteScanBytePos
+
+
+    def skipJsonWhitespace(self, text, pos):
+        return jsonWhitespaceRegex.match(text, pos).end()
+
+
+    def expectJsonCharacter(self, text, pos, c):
+        if (not text.startswith(c, pos)):
+            raise Exception('Expected "{}" at character {} of lead file "{}".'.format(c, pos, self.filePath))
+        return pos+1
+# ---------------------------------------------------------------------------
 
 
 
@@ -20,7 +154,14 @@ class HlApi:
         self.options = options
         #
         self.unusedLeads = None
-        self.leads = None
+        # sourceKey -> LeadSourceTable
+        self.leadTables = None
+        # indexes built as leads are loaded; each maps to the [leadTable, rowIndex] of the first row (in load order) that matches, so results are the same as scanning
+        self.leadRowsByLeadId = None
+        self.leadRowsByNameOrAddress = None
+        # fuzzy search index over dName and address, built on the first fuzzy search; entry i is the row at fuzzyIndexRows[i] ([leadTable, rowIndex])
+        self.fuzzyIndex = None
+        self.fuzzyIndexRows = None
 
     def setDataDir(self, dataDir):
         self.dataDir = dataDir
@@ -31,6 +172,9 @@ class HlApi:
     def enableSlowSearch(self):
         return ('disableSlowSearch' not in self.options) or (not self.options['disableSlowSearch'])
 
+    def enableLeadCache(self):
+        return ('disableLeadCache' not in self.options) or (not self.options['disableLeadCache'])
+
 
 
 # ---------------------------------------------------------------------------
@@ -59,48 +203,131 @@ class HlApi:
         if (not self.isEnabled()):
             return False
         
-        self.leads = {}
+        self.leadTables = {}
+        self.leadRowsByLeadId = {}
+        self.leadRowsByNameOrAddress = {}
+        self.fuzzyIndex = None
+        self.fuzzyIndexRows = None
         directoryPath = self.dataDir + '/leads/'
 
+        leadFileList = []
         for (dirPath, dirNames, fileNames) in os.walk(directoryPath):
             for fileName in fileNames:
                 fileNameLower = fileName.lower()
                 if (fileNameLower.endswith('.json')):
                     baseName = pathlib.Path(fileName).stem
                     fileFinishedPath = dirPath + '/' + fileName
-                    self.loadLeadFile(fileFinishedPath, baseName)
+                    leadFileList.append([fileFinishedPath, baseName])
+
+        # scanning the json is slow, so we keep a compiled copy of the tables that we reuse until any of the files change
+        if (len(leadFileList)==0) or (not self.enableLeadCache()):
+            leadCacheStamps = None
+        else:
+            leadCacheStamps = self.calcLeadCacheStamps(leadFileList, directoryPath)
+            if (self.loadCachedLeads(leadCacheStamps)):
+                return True
 
+        for [fileFinishedPath, baseName] in leadFileList:
+            self.loadLeadFile(fileFinishedPath, baseName)
+
+        if (leadCacheStamps is not None):
+            self.saveCachedLeads(leadCacheStamps)
         return True
 
 
     def loadLeadFile(self, filePath, fileSourceLabel):
         #jrprint('Loading leads from "{}" ({})..'.format(fileSourceLabel, filePath))
-        encoding='utf-8'
-        with open(filePath, 'r', encoding=encoding) as jsonFile:
-            jsonRows = json.load(jsonFile)
-            features = jsonRows['features']
-            rows = []
-            for row in features:
-                #thisRow = row['properties']
-                rows.append(row)
+        leadTable = LeadSourceTable(filePath, fileSourceLabel, os.path.relpath(filePath, self.dataDir + '/leads/'))
+        leadTable.loadFromFile()
+        jrprint('Loaded {} leads from "{}" ({})'.format(leadTable.getRowCount(), fileSourceLabel, filePath))
+        self.leadTables[fileSourceLabel] = leadTable
+        self.indexLeadTable(leadTable)
+
+
+    def calcLeadCacheFilePath(self):
+        return self.dataDir + '/.hlcache/leads.pickle'
+
+
+    def calcLeadCacheStamps(self, leadFileList, directoryPath):
+        # the compiled cache is valid as long as we have the same files (relative to the leads directory, so it does not matter how dataDir was given) with the same modification times and sizes
+        stamps = []
+        for [filePath, fileSourceLabel] in leadFileList:
+            fileStat = os.stat(filePath)
+            stamps.append([os.path.relpath(filePath, directoryPath), fileSourceLabel, fileStat.st_mtime_ns, fileStat.st_size])
+        return stamps
+
+
+    def loadCachedLeads(self, leadCacheStamps):
+        # return True if we loaded leads from the compiled cache
+        filePath = self.calcLeadCacheFilePath()
+        if (not jrfuncs.pathExists(filePath)):
+            return False
+        # the cache is a lot of small objects; garbage collection passes while unpickling it only slow us down
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(filePath, 'rb') as cacheFile:
+                cacheData = pickle.load(cacheFile)
+        except Exception as e:
+            jrprint('Ignoring unreadable compiled lead cache "{}": {}'.format(filePath, e))
+            return False
+        finally:
+            if (gcWasEnabled):
+                gc.enable()
+        if (cacheData['leadCacheVersion']!=leadCacheVersion) or (cacheData['stamps']!=leadCacheStamps):
+            return False
+        self.leadTables = cacheData['leadTables']
+        leadCount = 0
+        for sourceKey, leadTable in self.leadTables.items():
+            # the table holds a path as given when it was built; rows are fetched from the file we just stamped
+            leadTable.filePath = self.dataDir + '/leads/' + leadTable.relativeFilePath
+            self.indexLeadTable(leadTable)
+            leadCount += leadTable.getRowCount()
+        jrprint('Loaded {} leads from {} files using compiled cache "{}"'.format(leadCount, len(self.leadTables), filePath))
+        return True
+
+
+    def saveCachedLeads(self, leadCacheStamps):
+        filePath = self.calcLeadCacheFilePath()
+        cacheData = {'leadCacheVersion': leadCacheVersion, 'stamps': leadCacheStamps, 'leadTables': self.leadTables}
+        try:
+            jrfuncs.createDirForFullFilePathIfMissing(filePath)
+            # write to a temp file and move it into place so a reader never sees a partial file
+            tmpFilePath = filePath + '.tmp'
+            with open(tmpFilePath, 'wb') as cacheFile:
+                pickle.dump(cacheData, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpFilePath, filePath)
+        except Exception as e:
+            # not fatal, we will just scan the json again next time
+            jrprint('Could not save compiled lead cache "{}": {}'.format(filePath, e))
 
-            jrprint('Loaded {} leads from "{}" ({})'.format(len(features), fileSourceLabel, filePath))
-            self.leads[fileSourceLabel] = rows
+
+    def indexLeadTable(self, leadTable):
+        # earlier rows (and earlier sources) win, so only add keys we have not seen
+        # indexes hold [leadTable, rowIndex]; the full row is only loaded when it is asked for
+        for rowIndex in range(leadTable.getRowCount()):
+            leadId = leadTable.leadIds[rowIndex]
+            if (leadId is not None) and (leadId not in self.leadRowsByLeadId):
+                self.leadRowsByLeadId[leadId] = [leadTable, rowIndex]
+            # one index for both, since a lookup matches either
+            for nameOrAddress in [leadTable.addresses[rowIndex], leadTable.dNames[rowIndex]]:
+                if (nameOrAddress is not None) and (nameOrAddress not in self.leadRowsByNameOrAddress):
+                    self.leadRowsByNameOrAddress[nameOrAddress] = [leadTable, rowIndex]
 
 
     def findLeadRowByLeadId(self, leadId):
         if (not self.isEnabled()):
             return [None, None]
         
-        if (self.leads is None):
+        if (self.leadTables is None):
             self.loadLeads()
         if (leadId.startswith('#')):
             leadId = leadId[1:]
         #
-        for sourceKey, leadRows in self.leads.items():
-            for row in leadRows:
-                if (row['properties']['lead']==leadId):
-                    return [row, sourceKey]
+        tableAndRowIndex = self.leadRowsByLeadId.get(leadId)
+        if (tableAndRowIndex is not None):
+            [leadTable, rowIndex] = tableAndRowIndex
+            return [leadTable.getRow(rowIndex), leadTable.sourceKey]
         # not found
         return [None, None]
 
@@ -114,46 +341,153 @@ class HlApi:
         if (txt==''):
             return [None, None]
 
-        if (self.leads is None):
+        if (self.leadTables is None):
             self.loadLeads()
-        for sourceKey, leadRows in self.leads.items():
-            for row in leadRows:
-                if (row['properties']['address']==txt) or (row['properties']['dName']==txt):
-                    return [row, sourceKey]
-                dName = row['properties']['dName']
+        tableAndRowIndex = self.leadRowsByNameOrAddress.get(txt)
+        if (tableAndRowIndex is not None):
+            [leadTable, rowIndex] = tableAndRowIndex
+            return [leadTable.getRow(rowIndex), leadTable.sourceKey]
         # not found
         return [None, None]
 
 
     def findLeadRowSimilarByNameOrAddress(self, txt):
-        if (not self.isEnabled()):
+        # return [row, sourceKey, score] of the best fuzzy match (see findLeadRowsSimilarByNameOrAddress)
+        if (not self.isEnabled()) or (not self.enableSlowSearch()):
             return [None, None, 0]
-        if (not self.enableSlowSearch()):
+        matches = self.findLeadRowsSimilarByNameOrAddress(txt, 1)
+        if (len(matches)==0):
+            # not found
             return [None, None, 0]
+        return matches[0]
+
+
+    def findLeadRowsSimilarByNameOrAddress(self, txt, maxCount):
+        # return a list of up to maxCount [row, sourceKey, score], best first, of rows whose dName or address is similar to txt
+        # score is the best difflib similarity ratio of txt to dName or address (plus 0.5 if txt starts with the first few characters of dName)
+        if (not self.isEnabled()) or (not self.enableSlowSearch()):
+            return []
         txt = txt.strip()
         if (txt==''):
-            return [None, None]
+            return []
 
-        if (self.leads is None):
+        if (self.leadTables is None):
             self.loadLeads()
-        # walk ALL and find max
-        txtUpper = txt.upper()
-        startLen = 5 
-        maxDist = 0
-        maxMatchRow = None
-        maxMatchSourceKey = None
-        for sourceKey, leadRows in self.leads.items():
-            for row in leadRows:
-                distName = SequenceMatcher(None, txt, row['properties']['dName']).ratio()
-                distAddr = SequenceMatcher(None, txt, row['properties']['address']).ratio()
-                # kludge for startswith
-                if (txtUpper.startswith(row['properties']['dName'][0:startLen].upper())):
-                    distName += 0.5
-                thisMaxDist = max(distName, distAddr)
-                if (thisMaxDist > maxDist):
-                    maxDist = thisMaxDist
-                    maxMatchRow = row
-                    maxMatchSourceKey = sourceKey
-        # not found
-        return [maxMatchRow, maxMatchSourceKey, maxDist]
+        if (self.fuzzyIndex is None):
+            self.buildFuzzyIndex()
+        matches = []
+        for [entryIndex, score] in self.fuzzyIndex.search(txt, maxCount):
+            [leadTable, rowIndex] = self.fuzzyIndexRows[entryIndex]
+            matches.append([leadTable.getRow(rowIndex), leadTable.sourceKey, score])
+        return matches
+
+
+    def buildFuzzyIndex(self):
+        # entries are added in load order, so ties go to the same row a scan would find first
+        self.fuzzyIndex = FuzzyNameAddressIndex()
+        self.fuzzyIndexRows = []
+        for sourceKey, leadTable in self.leadTables.items():
+            for rowIndex in range(leadTable.getRowCount()):
+                self.fuzzyIndex.add(leadTable.dNames[rowIndex], leadTable.addresses[rowIndex])
+                self.fuzzyIndexRows.append([leadTable, rowIndex])
+
+
+    def calcLeadTableStats(self):
+        # return [rowCount, loadedRowCount] over all lead tables, for reports
+        rowCount = 0
+        loadedRowCount = 0
+        for leadTable in self.leadTables.values():
+            rowCount += leadTable.getRowCount()
+            loadedRowCount += len(leadTable.loadedRows)
+        return [rowCount, loadedRowCount]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def findLeadRowsForLeads(self, leadQueries, jobCount=1):
+        # batch lookup for a list of [leadId, searchText] pairs (see HlParser.databaseDebugLeads); returns a list with one dictionary per pair:
+        #   row, sourceKey: the row with that lead id (as from findLeadRowByLeadId)
+        #   guessRow, guessSourceKey, guessDist: when the lead id is not found and searchText is not None, the row whose name or address is searchText (dist 0),
+        #     or failing that the most similar row (as from findLeadRowSimilarByNameOrAddress); otherwise None, None, 0
+        # exact hits are resolved in one pass over the indexes, and only the misses go to fuzzy search, spread over jobCount worker processes
+        results = [{'row': None, 'sourceKey': None, 'guessRow': None, 'guessSourceKey': None, 'guessDist': 0} for leadQuery in leadQueries]
+        if (not self.isEnabled()):
+            return results
+        if (self.leadTables is None):
+            self.loadLeads()
+        # searchText -> list of results waiting on a fuzzy search
+        fuzzyPending = {}
+        for [result, [leadId, searchText]] in zip(results, leadQueries):
+            if (leadId.startswith('#')):
+                leadId = leadId[1:]
+            tableAndRowIndex = self.leadRowsByLeadId.get(leadId)
+            if (tableAndRowIndex is not None):
+                [leadTable, rowIndex] = tableAndRowIndex
+                result['row'] = leadTable.getRow(rowIndex)
+                result['sourceKey'] = leadTable.sourceKey
+                continue
+            if (searchText is None):
+                continue
+            searchText = searchText.strip()
+            if (searchText==''):
+                continue
+            tableAndRowIndex = self.leadRowsByNameOrAddress.get(searchText)
+            if (tableAndRowIndex is not None):
+                [leadTable, rowIndex] = tableAndRowIndex
+                result['guessRow'] = leadTable.getRow(rowIndex)
+                result['guessSourceKey'] = leadTable.sourceKey
+            elif (self.enableSlowSearch()):
+                if (searchText not in fuzzyPending):
+                    fuzzyPending[searchText] = []
+                fuzzyPending[searchText].append(result)
+        #
+        if (len(fuzzyPending)>0):
+            for [searchText, matches] in self.searchFuzzyIndexBatch(list(fuzzyPending.keys()), jobCount):
+                if (len(matches)==0):
+                    continue
+                [entryIndex, score] = matches[0]
+                [leadTable, rowIndex] = self.fuzzyIndexRows[entryIndex]
+                for result in fuzzyPending[searchText]:
+                    result['guessRow'] = leadTable.getRow(rowIndex)
+                    result['guessSourceKey'] = leadTable.sourceKey
+                    result['guessDist'] = score
+        return results
+
+
+    def searchFuzzyIndexBatch(self, searchTexts, jobCount):
+        # return list of [searchText, [[entryIndex, score]]] with the best fuzzy match (if any) for each
+        # workers are forked after the index is built, so each gets it for free; they return entry indices and we load the rows here, so callers always get our memoized rows
+        if (self.fuzzyIndex is None):
+            self.buildFuzzyIndex()
+        if (jobCount<=1) or (len(searchTexts)<=jobCount) or ('fork' not in multiprocessing.get_all_start_methods()):
+            return self.searchFuzzyIndexForWorker(searchTexts)
+        chunkSize = max(1, math.ceil(len(searchTexts) / (jobCount*4)))
+        chunks = [searchTexts[i:i+chunkSize] for i in range(0, len(searchTexts), chunkSize)]
+        #
+        global fuzzySearchWorkerApi
+        fuzzySearchWorkerApi = self
+        jrfuncs.jrprintFlush()
+        results = []
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobCount, mp_context=multiprocessing.get_context('fork')) as executor:
+                for chunkResults in executor.map(searchFuzzyIndexInWorker, chunks):
+                    results += chunkResults
+        finally:
+            fuzzySearchWorkerApi = None
+        return results
+
+
+    def searchFuzzyIndexForWorker(self, searchTexts):
+        return [[searchText, self.fuzzyIndex.search(searchText, 1)] for searchText in searchTexts]
+# ---------------------------------------------------------------------------
+
+
+
+
+# ---------------------------------------------------------------------------
+# fuzzy search worker (see HlApi.searchFuzzyIndexBatch); set in the parent before forking
+fuzzySearchWorkerApi = None
+
+def searchFuzzyIndexInWorker(searchTexts):
+    return fuzzySearchWorkerApi.searchFuzzyIndexForWorker(searchTexts)
 # ---------------------------------------------------------------------------
@@ -8,6 +8,14 @@ from lib.jr.jrfuncs import jrException
 from lib.jr.hlmarkdown import HlMarkdown
 import hlapi
 from lib.jr import jrmindmap
+from lib.jr.jrsourcefile import JrSourceFile
+from lib.jr import hlblocks
+from lib.jr.hlblocks import Block, HeadBlock, Lead, LeadRegistry
+from lib.jr.hlleadid import LeadId
+from lib.jr.hlleadgraph import LeadGraph
+from lib.jr.hltagregistry import TagRegistry
+from lib.jr.hloptions import OptionsSnapshot, thawOptionValue
+from lib.jr.hltextbuilder import LeadTextBuilder, calcTrailingTextPositionStyle
 
 # for compiling latex
 import pylatex
@@ -28,12 +36,39 @@ from subprocess import PIPE
 import sys
 import errno
 import math
+import concurrent.futures
+import multiprocessing
+import hashlib
+import time
+import io
+import codecs
+import mmap
+import locale
+import tracemalloc
+try:
+    # only used to report peak memory use in the load benchmark; not available on windows
+    import resource
+except ImportError:
+    resource = None
 
 
 
 
 # ---------------------------------------------------------------------------
 buildVersion = '3.0jr'
+# bump when the tokenizer or the format of cached blocks changes, so stale parse cache entries are not used
+parseCacheVersion = 2
+
+# edge cases for the tokenizer differential test (see testTokenizerDifferential), mostly error paths
+tokenizerTestSnippets = [
+    'text before any header', '# lead\nhello } there', '# lead\n/* unterminated', '# lead\n{ unterminated', '# lead\nbad */ comment',
+    '# lead\n#nospace', '# lead\n $tag(x)#x', '# lead\n/* nested /* comment */ still */ text', '# lead\nhttp://example.com\nnext',
+    '# comments\n{not code} $notcode /* gone */ text\n# next\nok', '# lead\n{\n# header in code\n}\n/*\n# header in comment\n*/\n',
+    '# lead // comment {\nx', '# lead\n{ a { b } c }d', '# lead\n$unknownfunc(x)', '# lead\n$golead(', '# lead\n$nofunc text',
+    '# lead\n//*/ hidden\n/*/ still comment */ shown', '# lead\ntext$', '# lead\n  . bullet\n"quoted"',
+    '# lead\nback\\slash \\{ still code } \\$golead(x) \\/* still comment */ \\# not header', '# lead\n“smart” and "plain \\"escaped\\"" quotes',
+    '# lead\n$golead("a)b") {$x("}") } after', '# lead\n{ a /* } */ b }\n/* { */ c', '# lead\n{ a { b { c', '# lead\n/* a /* b', '# lead\n{ a\n# next\nb } c',
+]
 # ---------------------------------------------------------------------------
 
 
@@ -42,12 +77,41 @@ buildVersion = '3.0jr'
 class HlParser:
 
     def __init__(self, optionsDirPath, overrideOptions={}):
+        # remember how we were created so that worker processes can build their own parser
+        self.optionsDirPath = optionsDirPath
+        self.overrideOptions = overrideOptions
         # load options
         self.jroptions = None
         self.jroptionsWorkingDir = None
+        # resolved options, built on first use and rebuilt after options are merged (see getOptionsSnapshot)
+        self.optionsSnapshot = None
         self.storyFileList = []
+        # JrSourceFile for each story file as loaded from disk, by file path
+        self.storySourceFiles = {}
+        # line table for block text positions in error messages (see countLinesInBlockUntilPos)
+        self.blockSourceFile = None
+        # number of worker processes to use when parsing story files (1 = parse in this process)
+        self.storyParseJobCount = 1
+        # number of worker processes to use when evaluating leads (1 = evaluate in this process); see evaluateLeadsParallel
+        self.leadEvaluationJobCount = 1
+        # cache of tokenized story files, keyed by content hash
+        self.parseCacheEnabled = True
+        self.parseCacheStats = {'hits': 0, 'misses': 0, 'bytesRead': 0, 'bytesWritten': 0}
+        # overrides given on the commandline (we need these again when watch mode rebuilds)
+        self.commandlineOverrideOptions = {}
+        # markdown render memo; only used in watch mode, where it is carried from one rebuild to the next
+        self.renderCache = None
+        self.renderCacheUsedKeys = set()
+        self.renderCacheStats = {'hits': 0, 'misses': 0}
+        # link texts are cached per lead (see makeTextLinkToLead)
+        self.linkTextCacheStats = {'hits': 0, 'misses': 0}
         self.headBlocks = []
-        self.leads = []
+        # leads are kept in a registry that indexes them by id and render id; self.leads is its list, in the order added
+        self.leadRegistry = LeadRegistry()
+        self.leads = self.leadRegistry.leads
+        # dependency graph between leads, built when we start processing them (see planLeadEvaluation); leadGraphLeadCount is the number of leads it was built for
+        self.leadGraph = None
+        self.leadGraphLeadCount = 0
         self.leadStats = {}
 
         self.warnings = []
@@ -55,11 +119,7 @@ class HlParser:
         self.leadSections = {}
         #
         # tags
-        self.tagMap = {}
-        #
-        self.tagConditionLabelsAvailable = []
-        self.tagConditionLabelStage = 0
-        self.tagDocumentIndex = 0
+        self.tagRegistry = TagRegistry()
         #
         #
         self.notes = []
@@ -71,6 +131,15 @@ class HlParser:
         #
         self.markBoxesTracker = {}
         #
+        # delimiters the story tokenizer stops at; everything between them is copied as a run (newlines only matter while on a header line)
+        self.storyTokenRegex = re.compile(r'/\*|\*/|//|[{}]|\$(?=[a-z])|#')
+        self.storyHeadTokenRegex = re.compile(r'\n|/\*|\*/|//|[{}]|\$(?=[a-z])|#')
+        # function argument parsing helpers; these are used with pos/endpos on the original text so we never copy substrings
+        self.shortCodeNameRegex = re.compile(r'[a-z][A-Za-z0-9_]*')
+        self.nonSpaceRegex = re.compile(r'\S')
+        self.blockCommentDelimRegex = re.compile(r'/\*|\*/')
+        self.argSpecialCharRegexCache = {}
+        #
         self.argDefs = {
             'header': {
                 'named': ['id', 'label', 'existing', 'ignore', 'section', 'type', 'warning', 'autoid', 'render', 'sort', 'stop', 'map', 'info', 'location', 'labelcontd', 'deadline', 'time'],
@@ -153,6 +222,102 @@ class HlParser:
             'end': {},
         }
         #
+        # code function handlers by name; code blocks are compiled to these (see compileCodeBlock)
+        self.codeFuncHandlers = {
+            'empty': self.evaluateCodeFuncEmpty,
+            'options': self.evaluateCodeFuncOptions,
+            'golead': self.evaluateCodeFuncGoLead,
+            'leadid': self.evaluateCodeFuncGoLead,
+            'returnlead': self.evaluateCodeFuncGoLead,
+            'reflead': self.evaluateCodeFuncGoLead,
+            'goleadback': self.evaluateCodeFuncGoLead,
+            'gofake': self.evaluateCodeFuncGoFake,
+            'gofakebak': self.evaluateCodeFuncGoFake,
+            'returninline': self.evaluateCodeFuncReturnInline,
+            'definetag': self.evaluateCodeFuncDefineTag,
+            'gaintag': self.evaluateCodeFuncGainTag,
+            'hastag': self.evaluateCodeFuncUseTag,
+            'hasalltags': self.evaluateCodeFuncUseTag,
+            'hasanytag': self.evaluateCodeFuncUseTag,
+            'requiretag': self.evaluateCodeFuncUseTag,
+            'requirealltags': self.evaluateCodeFuncUseTag,
+            'requireanytags': self.evaluateCodeFuncUseTag,
+            'missingtag': self.evaluateCodeFuncUseTag,
+            'missinganytags': self.evaluateCodeFuncUseTag,
+            'missingalltags': self.evaluateCodeFuncUseTag,
+            'mentiontags': self.evaluateCodeFuncUseTag,
+            'beforeday': self.evaluateCodeFuncDay,
+            'afterday': self.evaluateCodeFuncDay,
+            'onday': self.evaluateCodeFuncDay,
+            'inline': self.evaluateCodeFuncInline,
+            'inlineback': self.evaluateCodeFuncInline,
+            'inlinehint': self.evaluateCodeFuncInline,
+            'endjump': self.evaluateCodeFuncEndJump,
+            'insertlead': self.evaluateCodeFuncInsertLead,
+            'get': self.evaluateCodeFuncGetVar,
+            'set': self.evaluateCodeFuncSetVar,
+            'mark': self.evaluateCodeFuncMark,
+            'time': self.evaluateCodeFuncTime,
+            'otime': self.evaluateCodeFuncTime,
+            'backdemerit': self.evaluateCodeFuncBackDemerit,
+            'form': self.evaluateCodeFuncForm,
+            'report': self.evaluateCodeFuncReport,
+            'otherwise': self.evaluateCodeFuncOtherwise,
+            'logicmentions': self.evaluateCodeFuncLogicMentions,
+            'logicimplies': self.evaluateCodeFuncLogicMentions,
+            'logicsuggests': self.evaluateCodeFuncLogicMentions,
+            'logicmentionedby': self.evaluateCodeFuncLogicMentionedBy,
+            'logicimpliedby': self.evaluateCodeFuncLogicMentionedBy,
+            'logicsuggestedby': self.evaluateCodeFuncLogicMentionedBy,
+            'logicidea': self.evaluateCodeFuncLogicIdea,
+            'logicab': self.evaluateCodeFuncLogicAb,
+            'logicaba': self.evaluateCodeFuncLogicAb,
+            'logicirrelevant': self.evaluateCodeFuncLogicIrrelevant,
+            'onlyonce': self.evaluateCodeFuncOnlyOnce,
+            'warning': self.evaluateCodeFuncWarning,
+            'remind': self.evaluateCodeFuncRemind,
+            'autohint': self.evaluateCodeFuncAutoHint,
+            'deadlineinfo': self.evaluateCodeFuncDeadlineInfo,
+            'ifcond': self.evaluateCodeFuncIfCond,
+            'include': self.evaluateCodeFuncInclude,
+            'begin': self.evaluateCodeFuncBeginEnd,
+            'end': self.evaluateCodeFuncBeginEnd,
+        }
+        # code functions whose text does not depend on the lead they are evaluated on behalf of, and whose side effects all go through doLeadEffect
+        # a lead using only these can have its $insertlead() evaluation cached and its effects replayed (see evaluateInsertedLead)
+        self.codeFuncsInsertCacheable = set(['empty', 'golead', 'leadid', 'returnlead', 'reflead', 'goleadback', 'gaintag', 'hastag', 'hasalltags', 'hasanytag', 'missingtag', 'missinganytags', 'missingalltags', 'mentiontags',
+            'beforeday', 'afterday', 'onday', 'endjump', 'insertlead', 'mark', 'time', 'otime', 'backdemerit', 'form', 'report', 'otherwise',
+            'logicmentions', 'logicimplies', 'logicsuggests', 'logicmentionedby', 'logicimpliedby', 'logicsuggestedby', 'onlyonce', 'remind', 'ifcond', 'include', 'begin', 'end'])
+        # code functions that return an inline or conditioned action, so that we can find the spans of blocks they cover up front (see calcHeadBlockSpans)
+        self.codeFuncsBlockSpanKinds = {'inline': 'inline', 'requiretag': 'inline', 'requirealltags': 'inline', 'requireanytags': 'inline', 'ifcond': 'conditioned'}
+        #
+        # side effects of code evaluated on behalf of a lead, by name (see doLeadEffect)
+        self.leadEffectHandlers = {
+            'useTag': self.applyLeadEffectUseTag,
+            'gainTag': self.applyLeadEffectGainTag,
+            'markBox': self.applyLeadEffectMarkBox,
+            'noDefaultTime': self.applyLeadEffectNoDefaultTime,
+            'goesToLead': self.applyLeadEffectGoesToLead,
+            'providesTag': self.applyLeadEffectProvidesTag,
+            'checksTag': self.applyLeadEffectChecksTag,
+            'checksDay': self.applyLeadEffectChecksDay,
+            'nodeLink': self.applyLeadEffectNodeLink,
+        }
+        # effects are appended here while evaluating a lead for $insertlead(); None when not recording
+        self.leadEffectLog = None
+        # leadIndex -> [text, reportText, effectLog, renderIdChangeCount] for leads evaluated by $insertlead(), and leadIndex -> True/False for whether they can be cached
+        self.insertedLeadCache = {}
+        self.insertedLeadCacheable = {}
+        # whether we build the annotated (author) report text of leads along with their normal text; set in processLeads (see calcIsReportTextNeeded)
+        self.reportTextEnabled = True
+        # set on the parser that buildDeferredReportTexts() uses to build report text after the fact
+        self.reportTextForced = False
+        # state of the random generator when runAll started, so that a report text pass makes the same random choices (see buildDeferredReportTexts)
+        self.randomStateAtRunStart = None
+        # counts of things that can change the text of evaluated code (see calcLeadEvaluationInputVersion)
+        self.optionsChangeCount = 0
+        self.dynamicLeadIdCount = 0
+        #
         self.doLoadAllOptions(optionsDirPath, overrideOptions)
         #
         renderOptions = self.getOptionValThrowException('renderOptions')
@@ -223,6 +388,9 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def runAll(self):
+        self.randomStateAtRunStart = random.getstate()
+        # forget parsed ids from any earlier run in this process (watch mode)
+        LeadId.clearInternTable()
         self.loadStoryFilesIntoBlocks()
         #
         self.processHeadBlocks()
@@ -252,19 +420,203 @@ class HlParser:
 
         
 
+# ---------------------------------------------------------------------------
+    def runWatch(self):
+        # watch and full rebuild: whenever a story file changes we rebuild everything with a fresh parser, the same as running the build again with a warm parse cache
+        # this is not an incremental rebuild; every lead is evaluated again, since the output of a lead can depend on tags, marks and ids set up by any lead before it, not just on the leads it links to or inserts
+        # what carries over is that unchanged story files come from the parse cache and markdown renders of unchanged text are reused
+        watchInterval = self.getOptionVal('watchInterval', 1.0)
+        renderCache = {}
+        storySignature = None
+        jrprint('Watch mode: watching story files for changes every {} seconds and doing a full rebuild on each change (ctrl+c to stop)..'.format(watchInterval))
+        try:
+            while (True):
+                newStorySignature = self.calcStoryFilesSignature()
+                if (newStorySignature != storySignature):
+                    if (storySignature is not None):
+                        changedFiles = [filePath for filePath in sorted(set(storySignature) | set(newStorySignature)) if (storySignature.get(filePath) != newStorySignature.get(filePath))]
+                        jrprint('Story files changed: {}.'.format(', '.join(changedFiles)))
+                    storySignature = newStorySignature
+                    self.runWatchRebuild(renderCache)
+                time.sleep(watchInterval)
+        except KeyboardInterrupt:
+            jrprint('Watch mode stopped.')
+
+
+    def runWatchRebuild(self, renderCache):
+        startTime = time.time()
+        parser = HlParser(self.optionsDirPath, self.overrideOptions)
+        parser.mergeOverrideOptions(self.commandlineOverrideOptions)
+        parser.storyParseJobCount = self.storyParseJobCount
+        parser.leadEvaluationJobCount = self.leadEvaluationJobCount
+        parser.parseCacheEnabled = self.parseCacheEnabled
+        parser.renderCache = renderCache
+        try:
+            parser.runAll()
+            # forget renders that are no longer used so the memo does not grow forever
+            for key in list(renderCache.keys()):
+                if (key not in parser.renderCacheUsedKeys):
+                    del renderCache[key]
+        except Exception as e:
+            # keep watching; the author will presumably fix the error and save again
+            jrprint('ERROR: Rebuild failed: {}'.format(e))
+        #
+        elapsedSecs = time.time() - startTime
+        jrprint('Full rebuild finished in {:.2f} seconds ({} markdown renders reused, {} rendered); waiting for changes..'.format(elapsedSecs, parser.renderCacheStats['hits'], parser.renderCacheStats['misses']))
+
+
+    def calcStoryFilesSignature(self):
+        # return dict of story file path -> (modification time, size)
+        signature = {}
+        storyDirectoriesList = self.getOptionValThrowException("storyDirectories")
+        for storyDir in storyDirectoriesList:
+            directoryPath = self.resolveTemplateVars(storyDir)
+            for (dirPath, dirNames, fileNames) in os.walk(directoryPath):
+                for fileName in fileNames:
+                    if (fileName.lower().endswith('.txt')):
+                        filePath = dirPath + '/' + fileName
+                        fileStat = os.stat(filePath)
+                        signature[filePath] = (fileStat.st_mtime_ns, fileStat.st_size)
+        return signature
+# ---------------------------------------------------------------------------
+
+
+
+
+# ---------------------------------------------------------------------------
+    def runStoryLoadBenchmark(self):
+        # compare peak memory use (and time) of loading a very large story file whole vs streaming it (see loadStoryFileBlocksStreaming)
+        # the large file is made by repeating the story files of the case; each load runs in a fresh worker process since peak memory use of a process only goes up
+        benchMegabytes = self.getOptionVal('loadBenchmarkMegabytes', 64)
+        storyDirectoriesList = self.getOptionValThrowException("storyDirectories")
+        for storyDir in storyDirectoriesList:
+            self.findStoryFilesFromDir(storyDir)
+        if (len(self.storyFileList)==0):
+            raise Exception('No story files found to build load benchmark file from.')
+        encoding = self.getOptionValThrowException('storyFileEncoding')
+        saveDir = self.getOptionValThrowException('savedir')
+        saveDir = self.resolveTemplateVars(saveDir)
+        benchFilePath = saveDir + '/.hlcache/loadBenchmark.txt'
+        jrfuncs.createDirForFullFilePathIfMissing(benchFilePath)
+        #
+        jrprint('Writing {}mb load benchmark story file: {}'.format(benchMegabytes, benchFilePath))
+        storyText = '\n'.join([jrfuncs.loadTxtFromFile(storyFilePath, True, encoding) for storyFilePath in self.storyFileList]) + '\n'
+        storyTextBytes = storyText.encode(encoding)
+        with open(benchFilePath, 'wb') as outfile:
+            for index in range(max(1, (benchMegabytes*1024*1024) // len(storyTextBytes))):
+                outfile.write(storyTextBytes)
+        #
+        results = {}
+        for loadMethod in ['whole', 'streaming']:
+            jrprint('Loading benchmark file ({})..'.format(loadMethod))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(runStoryLoadBenchmarkInWorker, self.optionsDirPath, self.overrideOptions, self.commandlineOverrideOptions, benchFilePath, loadMethod).result()
+            results[loadMethod] = result
+            jrprint('  {}: {:.2f} seconds; {} head blocks; peak {} {:.1f}mb before load, {:.1f}mb after.'.format(loadMethod, result['elapsedSecs'], result['headBlockCount'], result['memoryLabel'], result['peakMegabytesBefore'], result['peakMegabytesAfter']))
+        #
+        if (results['whole']['digest'] != results['streaming']['digest']):
+            jrprint('ERROR: whole and streaming loads produced different blocks.')
+        else:
+            jrprint('Whole and streaming loads produced identical blocks.')
+        os.remove(benchFilePath)
+
+
+    def runMemoryBenchmark(self):
+        # report memory used by the block and lead structures of a case (e.g. -w cases/wrongBook), and how long it takes to build them
+        self.parseCacheEnabled = False
+        tracemalloc.start()
+        startTime = time.time()
+        self.loadStoryFilesIntoBlocks()
+        loadSecs = time.time() - startTime
+        loadMemory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        startTime = time.time()
+        self.processHeadBlocks()
+        processSecs = time.time() - startTime
+        # load the hl api lead tables here (after options blocks may have changed the data dir) rather than on the first lookup, so we can measure them
+        hlapi = self.getHlApi()
+        if (hlapi.isEnabled()):
+            tracemalloc.start()
+            startTime = time.time()
+            hlapi.loadLeads()
+            leadTableSecs = time.time() - startTime
+            leadTableMemory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        startTime = time.time()
+        self.processLeads()
+        processSecs += time.time() - startTime
+        #
+        # lead rows belong to the hl api data, not to us
+        seenIds = set([id(lead.existingLeadRow) for lead in self.leads if ('existingLeadRow' in lead)])
+        blockCount = self.calcBlockCount(self.headBlocks)
+        blockBytes = self.calcObjectTreeBytes(self.headBlocks, seenIds)
+        leadBytes = self.calcObjectTreeBytes(self.leads, seenIds)
+        jrprint('Memory benchmark:')
+        jrprint('  load: {:.2f} seconds; {:.1f}k allocated.'.format(loadSecs, loadMemory/1024))
+        jrprint('  blocks: {} head blocks / {} blocks / {:.1f}k.'.format(len(self.headBlocks), blockCount, blockBytes/1024))
+        jrprint('  leads: {} leads / {:.1f}k (not counting their blocks).'.format(len(self.leads), leadBytes/1024))
+        if (hlapi.isEnabled()):
+            [leadRowCount, loadedLeadRowCount] = hlapi.calcLeadTableStats()
+            jrprint('  hl api leads: {} rows / {:.2f} seconds; {:.1f}k allocated; {} full rows read back from the lead files.'.format(leadRowCount, leadTableSecs, leadTableMemory/1024, loadedLeadRowCount))
+        jrprint('  processing: {:.2f} seconds.'.format(processSecs))
+
+
+    def calcBlockCount(self, blocks):
+        blockCount = len(blocks)
+        for block in blocks:
+            if ('blocks' in block):
+                blockCount += self.calcBlockCount(block.blocks)
+        return blockCount
+
+
+    def calcObjectTreeBytes(self, obj, seenIds):
+        # approximate memory used by obj and everything it holds; each object is counted once (and objects in seenIds not at all)
+        if (id(obj) in seenIds):
+            return 0
+        seenIds.add(id(obj))
+        byteCount = sys.getsizeof(obj)
+        if (isinstance(obj, dict)) or (isinstance(obj, hlblocks.DictCompatRecord)):
+            for key, val in obj.items():
+                byteCount += self.calcObjectTreeBytes(key, seenIds) + self.calcObjectTreeBytes(val, seenIds)
+        elif (isinstance(obj, list)) or (isinstance(obj, tuple)):
+            for val in obj:
+                byteCount += self.calcObjectTreeBytes(val, seenIds)
+        return byteCount
+# ---------------------------------------------------------------------------
+
+
+
+
+
 # ---------------------------------------------------------------------------
     def processCommandline(self, appName, appInfo):
         parser = argparse.ArgumentParser(prog = appName, description = appInfo)
         parser.add_argument('-c', '--command', required=False)
         parser.add_argument('-w', '--workingdir', required=False)
+        parser.add_argument('-j', '--jobs', type=int, required=False)
+        parser.add_argument('--no-cache', dest='nocache', action='store_true', required=False)
         args = parser.parse_args()
         #
         workingdir = args.workingdir
         if (workingdir):
+            self.commandlineOverrideOptions['workingdir'] = workingdir
             self.mergeOverrideOptions({'workingdir': workingdir})
+        if (args.jobs):
+            self.storyParseJobCount = args.jobs
+            self.leadEvaluationJobCount = args.jobs
+        if (args.nocache):
+            self.parseCacheEnabled = False
         #
         if (args.command == 'reftest'):
             self.testMakeReferenceGuide()
+        elif (args.command == 'tokentest'):
+            self.testTokenizerDifferential()
+        elif (args.command == 'watch'):
+            self.runWatch()
+        elif (args.command == 'loadbench'):
+            self.runStoryLoadBenchmark()
+        elif (args.command == 'memorybench'):
+            self.runMemoryBenchmark()
         else:
             self.runAll()
 # ---------------------------------------------------------------------------
@@ -301,6 +653,7 @@ class HlParser:
 
     def loadOptions(self, optionsDirPath):
         # create jroptions helper
+        self.invalidateOptionsSnapshot()
         self.jroptions = jroptions.JrOptions(optionsDirPath)
         jrprint('Loading options from {}..'.format(optionsDirPath))
         # load basics
@@ -315,10 +668,12 @@ class HlParser:
         if (len(overrideOptions)>0):
             jrprint('Merging options: {}.'.format(overrideOptions))
             self.jroptions.mergeRawDataForKey('options', overrideOptions)
+            self.invalidateOptionsSnapshot()
 
 
     def loadWorkingDirOptions(self, optionsDirPath):
         # create jroptions helper
+        self.invalidateOptionsSnapshot()
         self.jroptionsWorkingDir = jroptions.JrOptions(optionsDirPath)
         if (optionsDirPath==None):
             return
@@ -329,21 +684,21 @@ class HlParser:
 
     def getOptionValThrowException(self, keyName):
         # try to get from working dir options, fall back to base options
-        val = self.getWorkingOptionVal(keyName, None)
-        if (val==None):
-            val = self.getBaseOptionVal(keyName, None)
-        if (val==None):
-            raise Exception('Key "{}" not found in options.'.format(keyName))
-        return val
+        return self.getOptionsSnapshot().getThrowException(keyName)
     
     def getOptionVal(self, keyName, defaultVal):
         # try to get from working dir options, fall back to base options
-        val = self.getWorkingOptionVal(keyName, None)
-        if (val==None):
-            val = self.getBaseOptionVal(keyName, None)
-        if (val==None):
-            val = defaultVal
-        return val
+        return self.getOptionsSnapshot().get(keyName, defaultVal)
+
+    def getOptionsSnapshot(self):
+        if (self.optionsSnapshot is None):
+            workingOptions = self.jroptionsWorkingDir.getAllBlocks().get('options', {})
+            self.optionsSnapshot = OptionsSnapshot(self.jroptions.getKeyBlock('options'), workingOptions)
+        return self.optionsSnapshot
+
+    def invalidateOptionsSnapshot(self):
+        # call after merging options
+        self.optionsSnapshot = None
     #
     def getBaseOptionValThrowException(self, keyName):
         return self.jroptions.getKeyValThrowException('options', keyName)
@@ -365,8 +720,51 @@ class HlParser:
         for storyDir in storyDirectoriesList:
             self.findStoryFilesFromDir(storyDir)
         # ok now with each lead file we found, process it
+        if (self.storyParseJobCount>1) and (len(self.storyFileList)>1):
+            self.loadStoryFilesIntoBlocksParallel(self.storyParseJobCount)
+        else:
+            for storyFilePath in self.storyFileList:
+                self.loadStoryFileIntoBlocks(storyFilePath)
+
+
+    def loadStoryFilesIntoBlocksParallel(self, jobCount):
+        # tokenizing does not depend on any evaluation state, so we can farm the files out to worker processes
+        # results are merged back in the original file order, so that lead overriding (existing=defer, etc.) is unchanged
+        jrprint('Parsing {} story files using {} worker processes..'.format(len(self.storyFileList), jobCount))
+        # very large files are streamed (by the worker, from the file) rather than loaded whole, just as in loadStoryFileIntoBlocks
+        # for the rest we load the text here and send it; files found in the parse cache are not sent to workers
+        streamingMinBytes = self.getOptionVal('storyStreamingLoadMinBytes', 16*1024*1024)
+        storyLoads = []
         for storyFilePath in self.storyFileList:
-            self.loadStoryFileIntoBlocks(storyFilePath)
+            if (os.path.getsize(storyFilePath) >= streamingMinBytes):
+                [cacheKey, sourceLabel, encoding] = self.calcStoryFileStreamingParseCacheKey(storyFilePath)
+                storyLoads.append([cacheKey, sourceLabel, None, encoding])
+            else:
+                [fileText, sourceLabel] = self.loadStoryFileText(storyFilePath)
+                storyLoads.append([self.calcParseCacheKey(fileText, sourceLabel), sourceLabel, fileText, None])
+        cachedHeadBlocksList = [self.loadCachedStoryBlocks(cacheKey, sourceLabel) for [cacheKey, sourceLabel, fileText, encoding] in storyLoads]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobCount, initializer=initStoryParseWorker, initargs=(self.optionsDirPath, self.overrideOptions, self.commandlineOverrideOptions)) as executor:
+            futures = []
+            for index, [cacheKey, sourceLabel, fileText, encoding] in enumerate(storyLoads):
+                if (cachedHeadBlocksList[index] is not None):
+                    futures.append(None)
+                elif (fileText is None):
+                    futures.append(executor.submit(tokenizeStoryFileStreamingInWorker, self.storyFileList[index], sourceLabel, encoding))
+                else:
+                    futures.append(executor.submit(tokenizeStoryTextInWorker, fileText, sourceLabel))
+            # drop our copies of the texts; workers have them now
+            storyLoads = [[cacheKey, sourceLabel] for [cacheKey, sourceLabel, fileText, encoding] in storyLoads]
+            for index, future in enumerate(futures):
+                jrprint('Loading story file: "{}"'.format(self.storyFileList[index]))
+                if (future is None):
+                    headBlocks = cachedHeadBlocksList[index]
+                else:
+                    # this will re-raise any parse exception from the worker
+                    headBlocks = future.result()
+                    [cacheKey, sourceLabel] = storyLoads[index]
+                    self.saveCachedStoryBlocks(cacheKey, sourceLabel, headBlocks)
+                for headBlock in headBlocks:
+                    self.addHeadBlock(headBlock)
 
 
     def findStoryFilesFromDir(self, directoryPathOrig):
@@ -402,33 +800,36 @@ class HlParser:
         if (outFilePath == filePath):
             outFilePath = filePath + '.labeled'
         jrprint('Saving version of storyfile with labels added: {}'.format(outFilePath))
-        # load it
+        # use the text we loaded when parsing (load it if we didn't)
         encoding = self.getOptionValThrowException('storyFileEncoding')
-        fileText = jrfuncs.loadTxtFromFile(filePath, True, encoding)
+        sourceFile = self.storySourceFiles.get(filePath)
+        if (sourceFile is None):
+            sourceFile = JrSourceFile(jrfuncs.loadTxtFromFile(filePath, True, encoding))
+        text = sourceFile.text
         # 
-        leadHeadRegex = re.compile(r'^# ([^:\(\)\/]*[^\s])(\s*\(.*\))?(\s*\/\/.*)?$')
-        # walk it and write it
+        leadHeadRegex = re.compile(r'# ([^:\(\)\/]*[^\s])(\s*\(.*\))?(\s*\/\/.*)?')
+        # only header lines can change, so we just splice new text over their spans
+        replacements = []
+        for [start, end] in sourceFile.getHeaderSpans():
+            matches = leadHeadRegex.fullmatch(text, start, end)
+            if (matches is not None):
+                # got a match - can we find an id?
+                leadId = matches[1].strip()
+                [existingLeadRow, existingRowSourceKey] = self.getHlApi().findLeadRowByLeadId(leadId)
+                if (not existingLeadRow is None):
+                    # found a lead
+                    label = self.calcLeadLabelForLeadRow(existingLeadRow)
+                    if (':' in label) or ('(' in label) or (')' in label):
+                        label = '"{}"'.format(label)
+                    line = '# {}: {}'.format(leadId, label)
+                    if (matches.group(2) is not None):
+                        line += matches.group(2)
+                    if (matches.group(3) is not None):
+                        line += matches.group(3)
+                    replacements.append([start, end, line])
+        # write it
         with open(outFilePath, 'w', encoding=encoding) as outfile:
-            lines = fileText.split('\n')
-            for line in lines:
-                matches = leadHeadRegex.match(line)
-                if (matches is not None):
-                    # got a match - can we find an id?
-                    leadId = matches[1].strip()
-                    [existingLeadRow, existingRowSourceKey] = self.getHlApi().findLeadRowByLeadId(leadId)
-                    if (not existingLeadRow is None):
-                        # found a lead
-                        label = self.calcLeadLabelForLeadRow(existingLeadRow)
-                        if (':' in label) or ('(' in label) or (')' in label):
-                            label = '"{}"'.format(label)
-                        line = '# {}: {}'.format(leadId, label)
-                        if (matches.group(2) is not None):
-                            line += matches.group(2)
-                        if (matches.group(3) is not None):
-                            line += matches.group(3)
-
-                #
-                outfile.write(line+'\n')
+            outfile.write(sourceFile.spliceSpans(replacements) + '\n')
 # ---------------------------------------------------------------------------
 
 
@@ -438,18 +839,427 @@ class HlParser:
 # ---------------------------------------------------------------------------
     def loadStoryFileIntoBlocks(self, filePath):
         jrprint('Loading story file: "{}"'.format(filePath))
-        sourceLabel = 'FILE "{}"'.format(filePath)
+        # very large files are streamed rather than loaded whole
+        streamingMinBytes = self.getOptionVal('storyStreamingLoadMinBytes', 16*1024*1024)
+        if (os.path.getsize(filePath) >= streamingMinBytes):
+            headBlocks = self.loadStoryFileBlocksStreaming(filePath)
+        else:
+            headBlocks = self.loadStoryFileBlocks(filePath)
+        for headBlock in headBlocks:
+            self.addHeadBlock(headBlock)
+
+
+    def loadStoryFileBlocks(self, filePath):
+        [fileText, sourceLabel] = self.loadStoryFileText(filePath)
+        cacheKey = self.calcParseCacheKey(fileText, sourceLabel)
+        headBlocks = self.loadCachedStoryBlocks(cacheKey, sourceLabel)
+        if (headBlocks is None):
+            headBlocks = self.tokenizeStoryText(fileText, sourceLabel)
+            self.saveCachedStoryBlocks(cacheKey, sourceLabel, headBlocks)
+        return headBlocks
+
+
+    def loadStoryFileText(self, filePath):
+        # return [fileText, sourceLabel]
+        sourceLabel = sys.intern('FILE "{}"'.format(filePath))
         encoding = self.getOptionValThrowException('storyFileEncoding')
         fileText = jrfuncs.loadTxtFromFile(filePath, True, encoding)
+        # remember the original text (and its line table) for saveAltStoryFile
+        self.storySourceFiles[filePath] = JrSourceFile(fileText, sourceLabel)
         # parse text file into blocks
         # add head comments to text so we skip all beginning stuff
         fileText = '# comments\n' + fileText
-        #
-        self.parseStoryTextIntoBlocks(fileText, sourceLabel)
+        return [fileText, sourceLabel]
+
+
+    def loadStoryFileBlocksStreaming(self, filePath):
+        # load path for very large story files: the file is memory mapped and decoded a chunk at a time, the early text replacements are done on each chunk, and the chunks are fed straight to the tokenizer
+        # so we never hold a whole decoded copy of the file in memory (just the blocks being built); the cost is a second decoding pass to compute the parse cache key
+        [cacheKey, sourceLabel, encoding] = self.calcStoryFileStreamingParseCacheKey(filePath)
+        headBlocks = self.loadCachedStoryBlocks(cacheKey, sourceLabel)
+        if (headBlocks is None):
+            headBlocks = self.tokenizeStoryFileStreaming(filePath, sourceLabel, encoding)
+            self.saveCachedStoryBlocks(cacheKey, sourceLabel, headBlocks)
+        return headBlocks
+
+
+    def calcStoryFileStreamingParseCacheKey(self, filePath):
+        # return [cacheKey, sourceLabel, encoding] for streaming a story file; encoding is the one the file actually decodes with
+        sourceLabel = sys.intern('FILE "{}"'.format(filePath))
+        encoding = self.getOptionValThrowException('storyFileEncoding')
+        try:
+            cacheKey = self.calcParseCacheKeyStreaming(filePath, encoding, sourceLabel)
+        except UnicodeDecodeError:
+            # same fallback as jrfuncs.loadTxtFromFile
+            encoding = locale.getpreferredencoding(False)
+            cacheKey = self.calcParseCacheKeyStreaming(filePath, encoding, sourceLabel)
+        return [cacheKey, sourceLabel, encoding]
+
+
+    def tokenizeStoryFileStreaming(self, filePath, sourceLabel, encoding):
+        textChunks = self.iteratePreparedStoryTextChunks(self.iterateStoryFileTextChunks(filePath, encoding), sourceLabel)
+        return self.tokenizeStoryTextChunks(textChunks, sourceLabel)
+
+
+    def calcParseCacheKeyStreaming(self, filePath, encoding, sourceLabel):
+        # same key that calcParseCacheKey() would compute from the loaded text
+        hasher = self.makeParseCacheHasher(sourceLabel)
+        for textChunk in self.iterateStoryFileTextChunks(filePath, encoding):
+            hasher.update(textChunk.encode('utf-8'))
+        return hasher.hexdigest()
+
+
+    def iterateStoryFileTextChunks(self, filePath, encoding, chunkSize=1024*1024):
+        # generator yielding the text of a story file (with the '# comments' head that loadStoryFileText adds) in chunks of about chunkSize, decoded from a memory map of the file
+        # newlines are translated just as when reading the file in text mode
+        yield '# comments\n'
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), True)
+        with open(filePath, 'rb') as fileHandle:
+            fileSize = os.fstat(fileHandle.fileno()).st_size
+            if (fileSize>0):
+                with mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ) as fileMap:
+                    for chunkStart in range(0, fileSize, chunkSize):
+                        textChunk = decoder.decode(fileMap[chunkStart:chunkStart+chunkSize])
+                        if (textChunk!=''):
+                            yield textChunk
+        textChunk = decoder.decode(b'', True)
+        if (textChunk!=''):
+            yield textChunk
+
+
+    def iteratePreparedStoryTextChunks(self, textChunks, sourceLabel):
+        # generator turning arbitrary chunks of story text into the line aligned chunks with early replacements done that tokenizeStoryTextChunks() expects
+        # the result is identical to what tokenizeStoryText() does to the whole text, as long as we never cut between an empty line and a following line starting with ". " (the bullet regex can match the newline of the empty line)
+        # pendingText always starts at the beginning of a line, so a line ending at cutPos is empty if it is the first line or the character before its newline is a newline
+        pendingText = ''
+        for textChunk in textChunks:
+            pendingText += textChunk
+            cutPos = pendingText.rfind('\n') + 1
+            while (cutPos>0) and ((cutPos==1) or (pendingText[cutPos-2]=='\n')):
+                cutPos = pendingText.rfind('\n', 0, cutPos-1) + 1
+            if (cutPos>0):
+                yield self.textReplacementsEarlyMarkdown(pendingText[0:cutPos], sourceLabel)
+                pendingText = pendingText[cutPos:]
+        # add newline to text to make sure we handle end of last line
+        yield self.textReplacementsEarlyMarkdown(pendingText, sourceLabel) + '\n'
 
 
 
     def parseStoryTextIntoBlocks(self, text, sourceLabel):
+        headBlocks = self.tokenizeStoryText(text, sourceLabel)
+        for headBlock in headBlocks:
+            self.addHeadBlock(headBlock)
+# ---------------------------------------------------------------------------
+
+
+
+# ---------------------------------------------------------------------------
+    def calcParseCacheKey(self, fileText, sourceLabel):
+        hasher = self.makeParseCacheHasher(sourceLabel)
+        hasher.update(fileText.encode('utf-8'))
+        return hasher.hexdigest()
+
+
+    def makeParseCacheHasher(self, sourceLabel):
+        # blocks carry their sourceLabel, so it is part of the key along with the text, parser version and cache format version
+        # the caller feeds the text to the returned hasher (possibly a chunk at a time)
+        hasher = hashlib.sha256()
+        hasher.update((buildVersion + '\n' + str(parseCacheVersion) + '\n' + sourceLabel + '\n').encode('utf-8'))
+        return hasher
+
+
+    def calcParseCacheFilePath(self, key):
+        saveDir = self.getOptionValThrowException('savedir')
+        saveDir = self.resolveTemplateVars(saveDir)
+        return saveDir + '/.hlcache/blocks/' + key + '.json'
+
+
+    def loadCachedStoryBlocks(self, cacheKey, sourceLabel):
+        # return list of head blocks tokenized on a previous run, or None if not cached
+        if (not self.parseCacheEnabled):
+            return None
+        filePath = self.calcParseCacheFilePath(cacheKey)
+        try:
+            cacheText = jrfuncs.loadTxtFromFile(filePath, False, 'utf-8')
+            if (cacheText is None):
+                self.parseCacheStats['misses'] += 1
+                return None
+            cacheData = json.loads(cacheText)
+            if (cacheData.get('buildVersion')!=buildVersion) or (cacheData.get('parseCacheVersion')!=parseCacheVersion) or (cacheData.get('sourceLabel')!=sourceLabel):
+                self.parseCacheStats['misses'] += 1
+                return None
+            headBlocks = [hlblocks.blockFromDict(headBlockDict) for headBlockDict in cacheData['headBlocks']]
+        except Exception as e:
+            # an unreadable cache file is just a miss (it is replaced when we save the blocks again)
+            jrprint('Ignoring unreadable parse cache file "{}": {}'.format(filePath, e))
+            self.parseCacheStats['misses'] += 1
+            return None
+        self.parseCacheStats['hits'] += 1
+        self.parseCacheStats['bytesRead'] += len(cacheText)
+        return headBlocks
+
+
+    def saveCachedStoryBlocks(self, cacheKey, sourceLabel, headBlocks):
+        if (not self.parseCacheEnabled):
+            return
+        filePath = self.calcParseCacheFilePath(cacheKey)
+        jrfuncs.createDirForFullFilePathIfMissing(filePath)
+        cacheData = {'buildVersion': buildVersion, 'parseCacheVersion': parseCacheVersion, 'sourceLabel': sourceLabel, 'headBlocks': headBlocks}
+        cacheText = json.dumps(cacheData, default=hlblocks.jsonDefault)
+        # write to a temp file and move it into place so that a build interrupted while writing never leaves a partial file; the temp name is per process since story parse workers save in parallel
+        tmpFilePath = '{}.{}.tmp'.format(filePath, os.getpid())
+        try:
+            with open(tmpFilePath, 'w', encoding='utf-8') as cacheFile:
+                cacheFile.write(cacheText)
+            os.replace(tmpFilePath, filePath)
+        finally:
+            if (os.path.exists(tmpFilePath)):
+                os.remove(tmpFilePath)
+        self.parseCacheStats['bytesWritten'] += len(cacheText)
+
+
+    def calcParseCacheStatsString(self):
+        if (not self.parseCacheEnabled):
+            return 'disabled.'
+        stats = self.parseCacheStats
+        return '{} hits / {} misses / {:.2f}k read / {:.2f}k written.'.format(stats['hits'], stats['misses'], stats['bytesRead']/1000, stats['bytesWritten']/1000)
+
+
+
+    def tokenizeStoryText(self, text, sourceLabel):
+        text = self.textReplacementsEarlyMarkdown(text, sourceLabel)
+        # add newline to text to make sure we handle end of last line
+        return self.tokenizeStoryTextChunks([text + '\n'], sourceLabel)
+
+
+    def tokenizeStoryTextChunks(self, textChunks, sourceLabel):
+        # fast tokenizer; rather than walking the text one character at a time, we jump from delimiter to delimiter with a compiled regex and copy the runs between them as slices
+        # it MUST produce exactly the same block tree (and parse errors) as tokenizeStoryTextLegacy(); use the "tokentest" command to diff the two
+        # textChunks is a sequence (or generator) of text that has already had the early replacements done; each chunk must end with a newline, and the last must end with the extra newline added at end of text
+        # since no token spans a line, the tokenizer state simply carries over from one chunk to the next, so the whole text never needs to be in memory at once (see loadStoryFileBlocksStreaming)
+        headBlocks = []
+        headBlock = None
+        curTextBlock = None
+        curText = ''
+        curTextParts = []
+        inSingleLineComment = False
+        inSingleLineHead = False
+        inBlockCommentDepth = 0
+        inCodeBlackDepth = 0
+        inRaw = False
+        codeBlockStartLineNumber = 0
+        #
+        trackEnclosusers = {'comment': [], 'code': []}
+        #
+        # line and character offset of the current chunk within the whole text
+        lineBase = 0
+        textBase = 0
+        text = ''
+        sourceFile = None
+        for chunkText in textChunks:
+            if (sourceFile is not None):
+                lineBase += sourceFile.getLineCount() - 1
+                textBase += len(text)
+            text = chunkText
+            textlen = len(text)
+            # line numbers are looked up in the line start table rather than counted
+            sourceFile = JrSourceFile(text, sourceLabel)
+            #
+            # posOnLine mirrors the legacy tokenizer, which counted loop iterations rather than characters; characters it skipped over (second char of "/*", "*/", "# ", and the body of a shortcode) are tracked in lineSkip
+            skipLineStart = 0
+            lineSkip = 0
+            #
+            pos = 0
+            while (True):
+                tokenRe = self.storyHeadTokenRegex if (inSingleLineHead) else self.storyTokenRegex
+                matches = tokenRe.search(text, pos)
+                if (matches is None):
+                    tokenPos = textlen
+                else:
+                    tokenPos = matches.start()
+
+                # the run of ordinary characters before the delimiter
+                if (tokenPos>pos) and (not inSingleLineComment) and (inBlockCommentDepth==0):
+                    if (inRaw) or ((not inSingleLineHead) and (inCodeBlackDepth==0)):
+                        if (curTextBlock is None):
+                            curTextBlock = self.makeBlockText(sourceLabel, lineBase + sourceFile.calcLineNumberAtPos(pos))
+                            self.addChildBlock(headBlock, curTextBlock)
+                        curTextParts.append(text[pos:tokenPos])
+                    else:
+                        curText += text[pos:tokenPos]
+                if (matches is None):
+                    break
+
+                i = tokenPos
+                c = text[i]
+                cnext = text[i+1] if (i<textlen-1) else ''
+                [lineNumber, posOnLine] = sourceFile.calcLineAndPosAtPos(i)
+                lineNumber += lineBase
+                if (i-posOnLine != skipLineStart):
+                    skipLineStart = i-posOnLine
+                    lineSkip = 0
+                posOnLine -= lineSkip
+                # by default we consume just the one character; anything not handled below is ordinary text
+                pos = i+1
+                isText = True
+
+                if (c=='\n'):
+                    # we only stop at newlines on a header line
+                    # FIRST we need to kick out of single line comment (very imp)
+                    inSingleLineComment = False
+                    if (inSingleLineHead):
+                        # process the single line head
+                        inSingleLineHead = False
+                        curText = curText.strip()
+                        headBlock = self.makeBlockHeader(curText, sourceLabel, lineNumber, 'lead')
+                        headBlocks.append(headBlock)
+                        if ('raw' in headBlock.properties) and (headBlock.properties['raw']==True):
+                            # raw mode grabs EVERYTHING as text until the next header
+                            inRaw = True
+                        # clear current text
+                        curText = ''
+                        isText = False
+                elif (c=='#'):
+                    # warnings
+                    if (not inRaw):
+                        if (cnext==' ') and (posOnLine==0) and ((inCodeBlackDepth>0) ):
+                            jrprint('WARNING: got a header inside a code block; source: {} line: {} pos: {}'.format(sourceLabel, lineNumber, posOnLine))
+                        if (cnext==' ') and (posOnLine==0) and ((inBlockCommentDepth>0) ):
+                            jrprint('WARNING: got a header inside a comment block; source: {} line: {} pos: {}'.format(sourceLabel, lineNumber, posOnLine))
+                        if (cnext!=' ') and (cnext!='#') and (posOnLine<=1):
+                            # probably an error
+                            self.raiseParseException('#LEAD without space encountered at start of line -- this is an error; you must have a space after the #.', textBase+i, posOnLine, lineNumber, text, sourceLabel)
+                    if (cnext==' ') and (posOnLine==0) and (not inSingleLineComment) and (inBlockCommentDepth==0) and (not inSingleLineHead) and (inCodeBlackDepth==0):
+                        # "#" at start of line followed by space means we have a header (this also ends raw mode)
+                        inRaw = False
+                        # skip next char
+                        pos = i+2
+                        lineSkip += 1
+                        inSingleLineHead = True
+                        # clear current text block
+                        curTextBlock = self.finishTextBlock(curTextBlock, curTextParts)
+                        isText = False
+                elif (inSingleLineComment):
+                    # we are on a comment line, nothing else matters until the end of the line
+                    pass
+                elif (c=='/') and (cnext=='*'):
+                    # blockComment start
+                    pos = i+2
+                    lineSkip += 1
+                    inBlockCommentDepth += 1
+                    if (inBlockCommentDepth==1):
+                        # clear current text block
+                        curTextBlock = self.finishTextBlock(curTextBlock, curTextParts)
+                    trackEnclosusers['comment'].append('line {} pos {}'.format(lineNumber,posOnLine))
+                    isText = False
+                elif (c=='*'):
+                    # blockComment end
+                    if (inBlockCommentDepth==0):
+                        self.raiseParseException('End of block comment encountered (*/) without matching start comment block (/*).', textBase+i, posOnLine, lineNumber, text, sourceLabel)
+                    pos = i+2
+                    lineSkip += 1
+                    inBlockCommentDepth -= 1
+                    trackEnclosusers['comment'].pop()
+                    isText = False
+                elif (inBlockCommentDepth>0):
+                    # in multi-line comment, ignore it
+                    pass
+                elif (c=='/'):
+                    # single comment line start; skip straight to the end of the line
+                    # (only a header line cares when the comment ends; elsewhere the newline is just text)
+                    inSingleLineComment = inSingleLineHead
+                    pos = text.find('\n', i)
+                    isText = False
+                elif (inRaw) or (inSingleLineHead):
+                    # braces and shortcodes are plain text here
+                    pass
+                elif (c=='{'):
+                    # code block start
+                    inCodeBlackDepth += 1
+                    trackEnclosusers['code'].append('line {} pos {}'.format(lineNumber,posOnLine))
+                    if (inCodeBlackDepth==1):
+                        # outer code block { does not capture
+                        # clear current text block
+                        curTextBlock = self.finishTextBlock(curTextBlock, curTextParts)
+                        codeBlockStartLineNumber = lineNumber
+                        isText = False
+                elif (c=='}'):
+                    # code block end
+                    if (inCodeBlackDepth<=0):
+                        self.raiseParseException('End of code block "}" found without matching start.', textBase+i, posOnLine, lineNumber, text, sourceLabel)
+                    inCodeBlackDepth -= 1
+                    trackEnclosusers['code'].pop()
+                    if (inCodeBlackDepth==0):
+                        # close of code block
+                        curText = curText.strip()
+                        block = self.makeBlockCode(curText, sourceLabel, codeBlockStartLineNumber, False)
+                        self.addChildBlock(headBlock, block)
+                        # clear current text to prepare for next block section
+                        curText = ''
+                        # out code block } does not capture
+                        isText = False
+                elif (c=='$') and (inCodeBlackDepth==0):
+                    # got a shorthand code line (does not use {} but rather of the form $func(params))
+                    # just consume it all now
+                    [shortCodeText, resumePos] = self.consumeShortCodeFromText(text, sourceLabel, lineNumber, posOnLine, i+1)
+                    if (resumePos!=-1):
+                        # got some shortcode
+                        shortCodeText = shortCodeText.strip()
+                        block = self.makeBlockCode(shortCodeText, sourceLabel, lineNumber, True)
+                        self.addChildBlock(headBlock, block)
+                        # clear current text to prepare for next block section
+                        curText = ''
+                        curTextBlock = self.finishTextBlock(curTextBlock, curTextParts)
+                        pos = resumePos
+                        lineSkip += resumePos - i - 1
+                        isText = False
+
+                if (isText) and (not inSingleLineComment) and (inBlockCommentDepth==0):
+                    # the delimiter character turned out to be ordinary text in this context
+                    if (inRaw) or ((not inSingleLineHead) and (inCodeBlackDepth==0)):
+                        if (curTextBlock is None):
+                            curTextBlock = self.makeBlockText(sourceLabel, lineNumber)
+                            self.addChildBlock(headBlock, curTextBlock)
+                        curTextParts.append(c)
+                    else:
+                        curText += c
+
+        curTextBlock = self.finishTextBlock(curTextBlock, curTextParts)
+        # position of the final newline, as reported by the legacy tokenizer
+        i = textlen
+        [lineNumber, posOnLine] = sourceFile.calcLineAndPosAtPos(textlen-1)
+        lineNumber += lineBase
+        if (textlen-1-posOnLine == skipLineStart):
+            posOnLine -= lineSkip
+
+        # make sure didnt end in comments, etc.
+        if (inSingleLineHead):
+            self.raiseParseException('Unexpected end of text while parsing "#" header.', textBase+i, posOnLine, lineNumber, text, sourceLabel)
+        if (inCodeBlackDepth>0):
+            stackHistoryString = ';'.join(trackEnclosusers['code'])
+            self.raiseParseException('Unexpected end of text while inside code block [stack {}].'.format(stackHistoryString), textBase+i, posOnLine, lineNumber, text, sourceLabel)
+        if (inBlockCommentDepth>0):
+            stackHistoryString = ';'.join(trackEnclosusers['comment'])
+            self.raiseParseException('Unexpected end of text while inside comment block  [stack {}].'.format(stackHistoryString), textBase+i, posOnLine, lineNumber, text, sourceLabel)
+
+        # and eof which can help stop us from following one lead to subsequent one from another file
+        block = self.makeBlockEndFile(sourceLabel, lineNumber)
+        self.addChildBlock(headBlock, block)
+        return headBlocks
+
+
+    def finishTextBlock(self, curTextBlock, curTextParts):
+        # join the accumulated slices of a text block; returns None so caller can clear its current text block
+        if (curTextBlock is not None):
+            curTextBlock.text += ''.join(curTextParts)
+            curTextParts.clear()
+        return None
+
+
+
+    def tokenizeStoryTextLegacy(self, text, sourceLabel):
+        # original character-at-a-time tokenizer; kept as the reference implementation for the "tokentest" command
+        headBlocks = []
         headBlock = None
         curTextBlock = None
         curText = ''
@@ -509,8 +1319,8 @@ class HlParser:
                     inSingleLineHead = False
                     curText = curText.strip()
                     headBlock = self.makeBlockHeader(curText, sourceLabel, lineNumber, 'lead')
-                    self.addHeadBlock(headBlock)
-                    if ('raw' in headBlock['properties']) and (headBlock['properties']['raw']==True):
+                    headBlocks.append(headBlock)
+                    if ('raw' in headBlock.properties) and (headBlock.properties['raw']==True):
                         # raw mode grabs EVERYTHING as text until the next header
                         inRaw = True
                     # clear current text
@@ -580,7 +1390,7 @@ class HlParser:
                         curTextBlock = self.makeBlockText(sourceLabel, lineNumber)
                         self.addChildBlock(headBlock, curTextBlock)
                     # add character to textblock
-                    curTextBlock['text'] += c
+                    curTextBlock.text += c
                     continue
 
             # comments after this
@@ -601,9 +1411,9 @@ class HlParser:
             if (c=='}') and (not inSingleLineHead):
                 # code block end
                 inCodeBlackDepth -= 1
-                trackEnclosusers['code'].pop()
                 if (inCodeBlackDepth<0):
                     self.raiseParseException('End of code block "}" found without matching start.', i, posOnLine, lineNumber, text, sourceLabel)
+                trackEnclosusers['code'].pop()
                 if (inCodeBlackDepth==0):
                     # close of code block
                     curText = curText.strip()
@@ -648,7 +1458,7 @@ class HlParser:
                     curTextBlock = self.makeBlockText(sourceLabel, lineNumber)
                     self.addChildBlock(headBlock, curTextBlock)
                 # add character to textblock
-                curTextBlock['text'] += c
+                curTextBlock.text += c
             else:
                 # accumulating text for later block use
                 # add c to current text (be in codeblock, or text, or header)
@@ -667,6 +1477,7 @@ class HlParser:
         # and eof which can help stop us from following one lead to subsequent one from another file
         block = self.makeBlockEndFile(sourceLabel, lineNumber)
         self.addChildBlock(headBlock, block)
+        return headBlocks
 # ---------------------------------------------------------------------------
 
 
@@ -749,12 +1560,12 @@ class HlParser:
 
     def addChildBlock(self, headBlock, block):
         if (headBlock is None):
-            self.raiseBlockException(block, 0, 'Child block ({}) specified but no previous parent headblock found.'.format(block['type']))
+            self.raiseBlockException(block, 0, 'Child block ({}) specified but no previous parent headblock found.'.format(block.type))
 
         # add as child block
-        if ('blocks' not in headBlock):
-            headBlock['blocks'] = []
-        headBlock['blocks'].append(block)
+        if (not hasattr(headBlock, 'blocks')):
+            headBlock.blocks = []
+        headBlock.blocks.append(block)
 # ---------------------------------------------------------------------------
 
 
@@ -770,20 +1581,15 @@ class HlParser:
 
     def makeBlockCode(self, codeText, sourceLabel, lineNumber, embeddedShortCode):
         block = self.makeBlock(sourceLabel, lineNumber, 'code')
-        block['text'] = codeText
-        block['properties']['embeddedShortCode'] = embeddedShortCode
+        block.text = codeText
+        block.properties['embeddedShortCode'] = embeddedShortCode
         return block
 
     def makeBlock(self, sourceLabel, lineNumber, blockType):
-        # create it
-        block = {}
-        block['sourceLabel'] = sourceLabel
-        block['lineNumber'] = lineNumber
-        block['type'] = blockType
-        block['text'] = ''
-        block['properties'] = {}
-        # return it
-        return block
+        # header blocks hold child blocks
+        if (blockType=='header'):
+            return HeadBlock(sourceLabel, lineNumber, blockType)
+        return Block(sourceLabel, lineNumber, blockType)
 # ---------------------------------------------------------------------------
     
 
@@ -808,16 +1614,11 @@ class HlParser:
             [label, pos, nextc] = self.parseConsumeFunctionCallArgNext(block, headerText, pos+1, ['(', ''])
         else:
             label = None
-        if (nextc=='('):
-            argString = headerText[pos:]
-        else:
-            argString = ''
-
         
         linePos = 0
         # args first taken from any explicit ly passed
-        if (argString!=''):
-            [properties, pos] = self.parseFuncArgs('header', argString, sourceLabel, lineNumber, linePos)
+        if (nextc=='(') and (pos<len(headerText)):
+            [properties, pos] = self.parseFuncArgs('header', headerText, sourceLabel, lineNumber, linePos, pos, len(headerText))
         else:
             properties = {}
 
@@ -845,7 +1646,7 @@ class HlParser:
 
 
         # store properties
-        block['properties'] = properties
+        block.properties = properties
 
         return block
 # ---------------------------------------------------------------------------
@@ -893,42 +1694,45 @@ class HlParser:
 # ---------------------------------------------------------------------------
     def consumeShortCodeFromText(self, text, sourceLabel, lineNumber, posOnLine, textPos):
         # return [shortCodeText, resumePos]
-        remainderText = text[textPos:]
-        matches = re.match(r'^([a-z][A-Za-z0-9_]*)(\(.*)$', remainderText, re.MULTILINE)
+        # we work directly on offsets into text; a shortcode (and its args) cannot extend past the end of its line
+        matches = self.shortCodeNameRegex.match(text, textPos)
         if (matches is None):
+            # not a shortcode
+            return ['',-1]
+        funcName = matches.group(0)
+        argPos = matches.end()
+        if (argPos>=len(text)) or (text[argPos]!='('):
             # not a shortcode
             # let's see if we want to ERROR or warn
-            matches = re.match(r'^([a-z][A-Za-z0-9_]*)([^A-Za-z0-9_].*)$', remainderText, re.MULTILINE)
-            if (matches is None):
-                matches = re.match(r'^([a-z][A-Za-z0-9_]*)(\b.*)$', remainderText, re.MULTILINE)
-            if (matches is not None):
-                # warning error
-                word = matches.group(1)
-                msg = 'Looks like we found a shortcode function "{}" that should have a () at end but is something else.'.format(word)
-                if (word in self.argDefs):
-                    # certainly an error
+            word = funcName
+            msg = 'Looks like we found a shortcode function "{}" that should have a () at end but is something else.'.format(word)
+            if (word in self.argDefs):
+                # certainly an error
+                self.raiseParseException(msg, textPos, posOnLine, lineNumber, text, sourceLabel)
+                pass
+            else:
+                # probably an error
+                if (True):
                     self.raiseParseException(msg, textPos, posOnLine, lineNumber, text, sourceLabel)
-                    pass
                 else:
-                    # probably an error
-                    if (True):
-                        self.raiseParseException(msg, textPos, posOnLine, lineNumber, text, sourceLabel)
-                    else:
-                        self.addParseWarning(msg, textPos, posOnLine, lineNumber, text, sourceLabel)
+                    self.addParseWarning(msg, textPos, posOnLine, lineNumber, text, sourceLabel)
             return ['',-1]
-        funcName = matches[1]
-        argText = matches[2]
-        [argVals, afterPos] = self.parseFuncArgs(funcName, argText, sourceLabel, lineNumber, posOnLine)
-        parsedParamLen = afterPos+1
-        codeFullText = funcName + argText[0:parsedParamLen-1]
-        returnPos = textPos + len(funcName) + parsedParamLen - 1
+        endPos = text.find('\n', argPos)
+        if (endPos==-1):
+            endPos = len(text)
+        [argVals, afterPos] = self.parseFuncArgs(funcName, text, sourceLabel, lineNumber, posOnLine, argPos, endPos)
+        codeFullText = text[textPos:afterPos]
+        returnPos = afterPos
         return [codeFullText, returnPos]
 # ---------------------------------------------------------------------------
 
 
 # ---------------------------------------------------------------------------
-    def parseFuncArgs(self, funcName, text, sourceLabel, lineNumber, posOnLine):
+    def parseFuncArgs(self, funcName, text, sourceLabel, lineNumber, posOnLine, startPos=0, endPos=None):
         # expect comma separated list of possibly named arguments
+        # we parse text[startPos:endPos] in place; error positions are reported relative to startPos
+        if (endPos is None):
+            endPos = len(text)
         argVals = {}
 
         # now grab inside ()
@@ -947,9 +1751,9 @@ class HlParser:
 
 
         # confirm we start with ()
-        pos = 0
+        pos = startPos
         if (text[pos]!='('):
-            self.raiseBlockExceptionAtPos(block, pos, 'Expected function name')
+            self.raiseBlockExceptionAtPos(block, pos-startPos, 'Expected function name')
             return False 
 
         # iterate through all comma separated params
@@ -958,7 +1762,7 @@ class HlParser:
         pos += 1
         while (not isDone):
             ePos = pos
-            [key, val, pos, isDone] = self.parseConsumeFunctionCallArgPairNext(block, text, pos)
+            [key, val, pos, isDone] = self.parseConsumeFunctionCallArgPairNext(block, text, pos, endPos)
             # ATTN: 12/26/23 new to add code here to ensure its legal parameter (positional or named)
             # parsed a paramPair val
             # add it
@@ -966,19 +1770,19 @@ class HlParser:
             if (val=='') and (key is None):
                 # no arg available
                 if (not isDone):
-                    self.raiseBlockExceptionAtPos(block, posOnLine+ePos, 'Got blank arg but not done with args ({}) passed to function {}.'.format(argIndex, funcName))
+                    self.raiseBlockExceptionAtPos(block, posOnLine+ePos-startPos, 'Got blank arg but not done with args ({}) passed to function {}.'.format(argIndex, funcName))
                     return False 
             elif (key is None):
                 # its positional; convert to argdef defined prop name
                 if (len(positionalArgs)<=argIndex):
-                    self.raiseBlockExceptionAtPos(block, posOnLine+ePos, 'Too many args ({}) passed to function {}.'.format(argIndex, funcName))
+                    self.raiseBlockExceptionAtPos(block, posOnLine+ePos-startPos, 'Too many args ({}) passed to function {}.'.format(argIndex, funcName))
                     return False 
                 propName = positionalArgs[argIndex]
                 argVals[propName] = val
             else:
                 # use the key
                 if (key not in namedArgs):
-                    self.raiseBlockExceptionAtPos(block, posOnLine+ePos, 'Unknown named parameter ({}) passed to function {}.'.format(key, funcName))
+                    self.raiseBlockExceptionAtPos(block, posOnLine+ePos-startPos, 'Unknown named parameter ({}) passed to function {}.'.format(key, funcName))
                     return False 
                 argVals[key] = val
 
@@ -996,14 +1800,14 @@ class HlParser:
 
 
 # ---------------------------------------------------------------------------
-    def parseConsumeFunctionCallArgPairNext(self, block, blockText, startPos):
+    def parseConsumeFunctionCallArgPairNext(self, block, blockText, startPos, endPos=None):
         key = None
         pos =  startPos
         stopCharList = [',' , '=' , ')']
         #
 
         # get first val
-        [val, pos, nextc] = self.parseConsumeFunctionCallArgNext(block, blockText, pos, stopCharList)
+        [val, pos, nextc] = self.parseConsumeFunctionCallArgNext(block, blockText, pos, stopCharList, endPos)
 
         #c = blockText[pos]
         c = nextc
@@ -1011,7 +1815,7 @@ class HlParser:
             # we have a named param
             key = val
             pos += 1
-            [val, pos, nextc] = self.parseConsumeFunctionCallArgNext(block, blockText, pos, stopCharList)
+            [val, pos, nextc] = self.parseConsumeFunctionCallArgNext(block, blockText, pos, stopCharList, endPos)
             #c = blockText[pos]
             c = nextc
         if (c==')'):
@@ -1028,7 +1832,7 @@ class HlParser:
 
         # advance following whitespace? i dont think we want to
         if (False):
-            textlen = len(blockText)
+            textlen = len(blockText) if (endPos is None) else endPos
             while (pos<textlen) and (blockText[pos].isspace()):
                 pos += 1
         # return
@@ -1036,44 +1840,43 @@ class HlParser:
 
 
 
-    def parseConsumeFunctionCallArgNext(self, block, blockText, startPos, stopCharList):
+    def parseConsumeFunctionCallArgNext(self, block, blockText, startPos, stopCharList, endPos=None):
         # parse next comma separate val or var=val
+        # we scan blockText[startPos:endPos] in place, jumping over runs of ordinary characters and copying them as slices
         wrapperCharList = ['"', "'", '{', '“', '”']
-        textlen = len(blockText)
+        textlen = len(blockText) if (endPos is None) else endPos
 
         # go to first non-space character
-        pos = startPos
-        while (blockText[pos].isspace()) and (pos<textlen):
-            pos += 1
+        matches = self.nonSpaceRegex.search(blockText, startPos, textlen)
+        pos = matches.start() if (matches is not None) else textlen
         if (pos>=textlen):
             self.raiseBlockExceptionAtPos(block, startPos, 'Unexpected end inside function call parameters')
             return False 
 
         # skip comments
-        pos = self.skipComments(block, blockText, pos)
-        extractedText = ''
+        pos = self.skipComments(block, blockText, pos, textlen)
+        extractedParts = []
 
         # ok now see if we have an ENCLOSING character
-        c = blockText[pos]
+        c = blockText[pos] if (pos<textlen) else ''
         openingChar = ''
         keepFinalClose = False
-        if (c in wrapperCharList):
+        if (c in wrapperCharList) and (c!=''):
             # yes we have an enclosing
             if (c=='{'):
                 openingChar = '{'
                 closingChar = '}'
                 keepFinalClose = True
-                extractedText = c
+                extractedParts.append(c)
             elif (c=='“'):
                 openingChar = '“'
                 closingChar = '”'
                 keepFinalClose = False
-                extractedText = ''
             elif (c=='('):
                 openingChar = '('
                 closingChar = ')'
                 keepFinalClose = True
-                extractedText = c
+                extractedParts.append(c)
             else:
                 openingChar = ''
                 closingChar = c
@@ -1085,66 +1888,83 @@ class HlParser:
             closingChar = None
             wrapperDepth = 0
 
+        # the characters we have to stop and look at; anything else is copied through as a run
+        specialCharRegex = self.calcArgSpecialCharRegex(stopCharList, openingChar, closingChar)
+
         # loop
         wasWrapped = (wrapperDepth>0)
         startContentPos = pos
         inEscapeNextChar = False
         expectingEnd = False
         while (pos<textlen):
-            # skip comments
-            c = blockText[pos]
             if (inEscapeNextChar):
                 # this character is escaped
-                extractedText += jrfuncs.escapedCharacterConvert(c)
+                extractedParts.append(jrfuncs.escapedCharacterConvert(blockText[pos]))
                 inEscapeNextChar = False
+                pos += 1
+                continue
+
+            # run of ordinary characters
+            matches = specialCharRegex.search(blockText, pos, textlen)
+            runEndPos = matches.start() if (matches is not None) else textlen
+            if (runEndPos>pos):
+                if (wrapperDepth==0) and (expectingEnd) and (self.nonSpaceRegex.search(blockText, pos, runEndPos) is not None):
+                    # error since we thought we were done
+                    self.raiseBlockExceptionAtPos(block, startContentPos, 'Syntax error while parsing function call parameters; expecting end but there was something else')
+                    return False 
+                extractedParts.append(blockText[pos:runEndPos])
+                pos = runEndPos
+                if (pos>=textlen):
+                    break
+
+            # skip comments
+            # do we want to do this even if in wrapper? YES for now (note this is different from most programming languages)
+            pos = self.skipComments(block, blockText, pos, textlen)
+            if (pos>=textlen):
+                break
+            c = blockText[pos]
+
+            if (wrapperDepth>0):
+                # inside wrapper the only thing we care about is close of wrapper
+                if (c=='\\'):
+                    # escape
+                    inEscapeNextChar = True
+                    pass
+                elif (c==closingChar):
+                    # got close of wrapper
+                    wrapperDepth -= 1
+                    if (wrapperDepth==0):
+                        expectingEnd = True
+                    if (keepFinalClose) or (wrapperDepth>0):
+                        extractedParts.append(c)
+                    if (wrapperDepth<0):
+                        self.raiseBlockExceptionAtPos(block, startContentPos, 'Syntax error while parsing function call parameters; unexpected unbalanced wrapper close symbol')
+                        return False 
+                elif (c==openingChar):
+                    wrapperDepth += 1
+                    extractedParts.append(c)
+                else:
+                    # stay in wrapper
+                    extractedParts.append(c)
+                    pass
             else:
-                # skip comments
-                if (wrapperDepth==0) or (True):
-                    # do we want to do this even if in wrapper? YES for now (note this is different from most programming languages)
-                    pos = self.skipComments(block, blockText, pos)
-                    c = blockText[pos]
-
-                if (wrapperDepth>0):
-                    # inside wrapper the only thing we care about is close of wrapper
-                    if (c=='\\'):
-                        # escape
-                        inEscapeNextChar = True
-                        pass
-                    elif (c==closingChar):
-                        # got close of wrapper
-                        wrapperDepth -= 1
-                        if (wrapperDepth==0):
-                            expectingEnd = True
-                        if (keepFinalClose) or (wrapperDepth>0):
-                            extractedText += c
-                        if (wrapperDepth<0):
-                            self.raiseBlockExceptionAtPos(block, startContentPos, 'Syntax error while parsing function call parameters; unexpected unbalanced wrapper close symbol')
-                            return False 
-                    elif (c==openingChar):
-                        wrapperDepth += 1
-                        extractedText += c
-                    else:
-                        # stay in wrapper
-                        extractedText += c
-                        pass
+                # not in wrapper
+                #
+                if (c in stopCharList):
+                    # this ends our parse since we are not in wrapper
+                    break
+                elif (expectingEnd) and (not c.isspace()):
+                    # error since we thought we were done
+                    self.raiseBlockExceptionAtPos(block, startContentPos, 'Syntax error while parsing function call parameters; expecting end but there was something else')
+                    return False 
+                # characters allowed
+                elif (c=='\\'):
+                    # escape
+                    inEscapeNextChar = True
+                    pass
                 else:
-                    # not in wrapper
-                    #
-                    if (c in stopCharList):
-                        # this ends our parse since we are not in wrapper
-                        break
-                    elif (expectingEnd) and (not c.isspace()):
-                        # error since we thought we were done
-                        self.raiseBlockExceptionAtPos(block, startContentPos, 'Syntax error while parsing function call parameters; expecting end but there was something else')
-                        return False 
-                    # characters allowed
-                    elif (c=='\\'):
-                        # escape
-                        inEscapeNextChar = True
-                        pass
-                    else:
-                        # just a normal character
-                        extractedText += c
+                    # just a normal character
+                    extractedParts.append(c)
             # advance to next char
             pos += 1
 
@@ -1163,11 +1983,23 @@ class HlParser:
                 # last char '' to mean end of string
                 c = ''
 
+        extractedText = ''.join(extractedParts)
         if (not wasWrapped):
             # trim spaces front and back if not in wrapper
             extractedText = extractedText.strip()
         #    
         return [extractedText, pos, c]
+
+
+    def calcArgSpecialCharRegex(self, stopCharList, openingChar, closingChar):
+        # compiled (and cached) character class of everything parseConsumeFunctionCallArgNext needs to look at individually
+        specialChars = ['\\', '/'] + stopCharList + [openingChar, closingChar]
+        key = ''.join(sorted(set([c for c in specialChars if (c)])))
+        specialCharRegex = self.argSpecialCharRegexCache.get(key)
+        if (specialCharRegex is None):
+            specialCharRegex = re.compile('[' + ''.join([re.escape(c) for c in key]) + ']')
+            self.argSpecialCharRegexCache[key] = specialCharRegex
+        return specialCharRegex
 # ---------------------------------------------------------------------------
 
 
@@ -1175,8 +2007,8 @@ class HlParser:
 # ---------------------------------------------------------------------------
     def parseFunctionCallAndArgs(self, block, text):
         # 
-        sourceLabel = block['sourceLabel']
-        lineNumber = block['lineNumber']
+        sourceLabel = block.sourceLabel
+        lineNumber = block.lineNumber
         linePos = 0
         pos = 0
         #
@@ -1186,14 +2018,10 @@ class HlParser:
             return ['empty', {}, 0]
 
         [funcName, pos, nextc] = self.parseConsumeFunctionCallArgNext(block, text, pos, ['(', ''])
-        if (nextc=='('):
-            argString = text[pos:]
-        else:
-            argString = ''
 
         # args first taken from any explicit ly passed
-        if (argString!=''):
-            [properties, pos] = self.parseFuncArgs(funcName, argString, sourceLabel, lineNumber, linePos)
+        if (nextc=='(') and (pos<len(text)):
+            [properties, pos] = self.parseFuncArgs(funcName, text, sourceLabel, lineNumber, linePos, pos, len(text))
         else:
             properties = {}
 
@@ -1203,36 +2031,33 @@ class HlParser:
 
 
 # ---------------------------------------------------------------------------
-    def skipComments(self, block, text, pos):
+    def skipComments(self, block, text, pos, endPos=None):
         startPos = pos
-        textlen = len(text)
+        textlen = len(text) if (endPos is None) else endPos
         blockCommentDepth = 0
 
-        while (pos<textlen):
+        while (pos<textlen-1):
             if (text[pos]=='/') and (text[pos+1]=='/'):
                 # skip till end of line
-                pos += 2
-                while (pos<textlen) and (text[pos-1]!='\n'):
-                    pos += 1
+                pos = text.find('\n', pos+2, textlen)
+                pos = textlen if (pos==-1) else pos+1
             elif (text[pos]=='/') and (text[pos+1]=='*'):
                 blockCommentDepth += 1
                 pos += 2
-                while (pos<textlen-1):
-                    if (text[pos]=='*') and (text[pos+1]=='/'):
+                while (True):
+                    matches = self.blockCommentDelimRegex.search(text, pos, textlen)
+                    if (matches is None):
+                        # unterminated
+                        pos = textlen
+                        break
+                    pos = matches.end()
+                    if (matches.group(0)=='*/'):
                         blockCommentDepth -= 1
-                        pos += 2
                         if (blockCommentDepth==0):
                             break
-                        if (blockCommentDepth<0):
-                            self.raiseBlockExceptionAtPos(block, pos-2, 'Syntax error close block comment without start */ unterminated.')
-                            return False
-                    elif (text[pos]=='/') and (text[pos+1]=='*'):
+                    else:
                         # nested block comment
                         blockCommentDepth += 1
-                        pos += 2
-                    else:
-                        # still in block continue
-                        pos += 1
             else:
                 break
 
@@ -1299,17 +2124,28 @@ class HlParser:
     def processLeads(self):
         # now process leads
         jrprint('Processing {} leads..'.format(len(self.leads)))
+        # only build report text if we are going to render it
+        self.reportTextEnabled = self.calcIsReportTextNeeded()
         # note we have to get keys as list here and then iterate because self.leads changes
         leadCount = len(self.leads)
         for i in range(0,leadCount):
             lead = self.leads[i]
             self.processLeadStage1(lead,i)
         
-        # we now do a second stage walking through leads fixing up BLANK ones that should copy the ones below them
-        leadCount = len(self.leads)
-        for i in range(0, leadCount):
+        # we now do a second stage evaluating leads (fixing up BLANK ones that should copy the ones below them), in dependency order
+        evaluationOrder = self.planLeadEvaluation()
+        if (self.leadEvaluationJobCount>1):
+            parallelResults = self.evaluateLeadsParallel(evaluationOrder, self.leadEvaluationJobCount)
+        else:
+            parallelResults = {}
+        for i in evaluationOrder:
             lead = self.leads[i]
-            self.processLeadStage2(lead,i)
+            self.processLeadStage2(lead,i, parallelResults.get(i))
+        if (not self.reportTextEnabled):
+            # no report text was built (see calcIsReportTextNeeded), so leave the field unset and it is left out of leadsout.json, rather than saved as an empty text that looks real
+            for lead in self.leads:
+                if ('reportText' in lead):
+                    del lead['reportText']
 
         leadStats = self.calcLeadStats()
         jrprint('FINISHED PROCESSING; SUMMARY STATS: ' + leadStats['summaryString'])
@@ -1318,11 +2154,26 @@ class HlParser:
 
     def databaseDebugLeads(self):
         jrprint('Database debugging {} leads..'.format(len(self.leads)))
-        # note we have to get keys as list here and then iterate because self.leads changes
+        # note we take the leads as a list here because self.leads changes
         leadCount = len(self.leads)
+        leads = self.leads[0:leadCount]
+        # look up all leads in the hl data at once; we only want a guess at the row (by label) for leads that are expected to be in the database
+        leadQueries = []
+        for lead in leads:
+            searchText = None
+            if (self.isDatabaseDebugLeadExpected(lead)):
+                label = self.calcDatabaseDebugLabel(lead)
+                searchText = label if (label!='') else lead.id
+            leadQueries.append([lead.id, searchText])
+        lookupResults = self.getHlApi().findLeadRowsForLeads(leadQueries, self.leadEvaluationJobCount)
+        hlapiPrev = self.getHlApiPrev()
+        if (hlapiPrev is not None):
+            lookupResultsPrev = hlapiPrev.findLeadRowsForLeads([[lead.id, None] for lead in leads], self.leadEvaluationJobCount)
+        else:
+            lookupResultsPrev = [None] * leadCount
+        #
         for i in range(0,leadCount):
-            lead = self.leads[i]
-            self.databaseDebugLead(lead)
+            self.databaseDebugLead(leads[i], lookupResults[i], lookupResultsPrev[i])
 
 
     def calcLeadStats(self):
@@ -1332,8 +2183,8 @@ class HlParser:
         textLength = 0
         wordCount = 0
         for lead in self.leads:
-            textLength += len(lead['text'])
-            wordCount += len(lead['text'].split(' '))
+            textLength += len(lead.text)
+            wordCount += len(lead.text.split(' '))
         self.leadStats['textLength'] = textLength
         self.leadStats['count'] = len(self.leads)
         self.leadStats['wordCount'] = wordCount
@@ -1350,7 +2201,7 @@ class HlParser:
         #jrprint('Processing a block..')
 
         # now post-process it based on type
-        properties = block['properties']
+        properties = block.properties
         blockType = properties['type']
         if (blockType is None):
             self.raiseBlockException(block, 0, 'Block encountered but of unknown type.')
@@ -1364,7 +2215,7 @@ class HlParser:
                 errorMsg = None
                 # already have a lead of with this id
                 existingBehaviorNew = properties['existing'] if ('existing' in properties) else None
-                propertiesPrior = existingLead['properties']
+                propertiesPrior = existingLead.properties
                 existingBehaviorPrior = propertiesPrior['existing'] if ('existing' in propertiesPrior) else None
                 # ok now throw an error if we get conflicting instructions
                 if (existingBehaviorNew is None) and (existingBehaviorPrior is None):
@@ -1392,12 +2243,12 @@ class HlParser:
                 #
                 if (errorMsg is not None):
                     # we have a conflict error
-                    errorMsg += ' Prior lead with same id found in {} around line #{}'.format(existingLead['sourceLabel'], existingLead['lineNumber'])
+                    errorMsg += ' Prior lead with same id found in {} around line #{}'.format(existingLead.sourceLabel, existingLead.lineNumber)
                     self.raiseBlockException(block, 0, errorMsg)
                 #
                 if (existingBehaviorNew == 'defer'):
                     # there is an existing lead with this id and we are set to defer, so we dont add
-                    warningMsg = 'WARNING: New lead with duplicate id({}) is being ignored because lead directive set to existing=defer; Prior lead with same id found in {} around line #{}.'.format(id, existingLead['sourceLabel'], existingLead['lineNumber'])
+                    warningMsg = 'WARNING: New lead with duplicate id({}) is being ignored because lead directive set to existing=defer; Prior lead with same id found in {} around line #{}.'.format(id, existingLead.sourceLabel, existingLead.lineNumber)
                     jrprint('WARNING: ' + warningMsg)
                     return
             else:
@@ -1406,7 +2257,7 @@ class HlParser:
 
             ignoreFlag = jrfuncs.getDictValueFromTrueFalse(properties, 'ignore', False)
             if (ignoreFlag):
-                warningMsg = 'WARNING: Lead with id="{}" is being ignored because ignore=true in lead directive; lead is from {} around line #{}'.format(id, block['sourceLabel'], block['lineNumber'])
+                warningMsg = 'WARNING: Lead with id="{}" is being ignored because ignore=true in lead directive; lead is from {} around line #{}'.format(id, block.sourceLabel, block.lineNumber)
                 jrprint('WARNING: ' + warningMsg)
                 return
 
@@ -1434,9 +2285,12 @@ class HlParser:
             properties['mtype'] = blockType
 
             # ok ADD the new lead by copying values from block
-            lead = {'id': self.canonicalLeadId(id), 'block': block, 'properties': properties, 'text': blockText, 'sourceLabel': block['sourceLabel'], 'lineNumber': block['lineNumber']}
+            lead = self.makeLead(id, block, properties, blockText)
             leadIndex = self.addLead(lead)
 
+            # compile its code now, so code errors are reported at parse time
+            self.compileHeadBlockCode(block)
+
             # auto define document tags
             #matches = re.match(r'^doc\.(.*)$', id)
             #if (matches is not None):
@@ -1458,7 +2312,7 @@ class HlParser:
 
         elif (blockType=='ignore'):
             # just a way to say ignore this block, comments, etc
-            warningMsg = 'WARNING: Block is being ignored because blocktype={}; from {} around line #{}'.format(blockType, block['sourceLabel'], block['lineNumber'])
+            warningMsg = 'WARNING: Block is being ignored because blocktype={}; from {} around line #{}'.format(blockType, block.sourceLabel, block.lineNumber)
             jrprint('WARNING: ' + warningMsg)
             return
         else:
@@ -1472,6 +2326,7 @@ class HlParser:
         jsonOptions = json.loads(jsonOptionString)
         # set the WORKINGDIR options
         self.jroptionsWorkingDir.mergeRawDataForKey('options', jsonOptions)
+        self.invalidateOptionsSnapshot()
         #
         # Change api version
         self.updateHlApiDirs()
@@ -1483,7 +2338,7 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def makeSectionNameForHeadBlock(self, block, id, renderId):
-        properties = block['properties']
+        properties = block.properties
         if ('section' in properties):
             # explicit section 
             return properties['section']
@@ -1495,7 +2350,7 @@ class HlParser:
         elif (blockType == 'hint'):
             sectionName = 'Hints'
         elif (blockType == 'lead'):
-            sectionName = 'Main.' + self.calcIdSection(renderId)
+            sectionName = 'Main.' + LeadId.get(renderId).section
         else:
             sectionName = blockType
         #
@@ -1560,9 +2415,9 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def calcDoesLeadHaveContent(self, lead):
-        headBlock = lead['block']
+        headBlock = lead.block
         if ('blocks' in headBlock):
-            childBlocks = headBlock['blocks']
+            childBlocks = headBlock.blocks
             if (len(childBlocks)>0):
                 # it has children of some sort so nothing to do even if it has no text
                 return True
@@ -1572,6 +2427,231 @@ class HlParser:
 
 
 
+# ---------------------------------------------------------------------------
+    def planLeadEvaluation(self):
+        # build the lead dependency graph and return the list of lead indices in the order they should be evaluated
+        # only labelcontd constrains the order (a label made from another must wait until that one is final); inherited and inserted content
+        # is evaluated from the blocks of the other lead rather than from its results, so those leads are otherwise kept in file order
+        # (which matters since evaluation assigns dynamic lead ids)
+        self.leadGraph = self.buildLeadGraph()
+        self.leadGraphLeadCount = len(self.leads)
+        #
+        # an insert cycle would recurse forever, and a labelcontd cycle has no order
+        for kind in ['inserts', 'labelcontd']:
+            cycle = self.leadGraph.findCycle([kind])
+            if (cycle is not None):
+                cycleLeadIds = [self.leads[leadIndex].id for leadIndex in cycle]
+                self.raiseLeadException(self.leads[cycle[0]], 0, 'Cycle found in lead dependencies ({}): {}'.format(kind, ' -> '.join(cycleLeadIds)))
+        #
+        return self.leadGraph.calcEvaluationOrder(range(0, self.leadGraphLeadCount), ['labelcontd'])
+
+
+    def buildLeadGraph(self):
+        leadGraph = LeadGraph()
+        leadCount = len(self.leads)
+        # blank leads take their content from the next lead that has some; find these in one reverse pass
+        nextContentLeadIndex = None
+        for i in range(leadCount-1, -1, -1):
+            leadGraph.addLead(i)
+            if (self.calcDoesLeadHaveContent(self.leads[i])):
+                nextContentLeadIndex = i
+            elif (nextContentLeadIndex is not None):
+                leadGraph.addEdge(i, nextContentLeadIndex, 'inherits')
+        #
+        for i in range(0, leadCount):
+            lead = self.leads[i]
+            # inserts; unknown leads are reported when evaluated
+            headBlock = lead.block
+            childBlocks = headBlock.blocks if ('blocks' in headBlock) else []
+            for block in childBlocks:
+                if (block.type!='code'):
+                    continue
+                compiledCode = block.compiledCode
+                if (compiledCode is None):
+                    compiledCode = self.compileCodeBlock(block)
+                [handler, funcName, args] = compiledCode
+                if (funcName=='insertlead'):
+                    insertedLead = self.findLeadById(args['leadId'], False)
+                    if (insertedLead is not None):
+                        leadGraph.addEdge(i, insertedLead.leadIndex, 'inserts')
+            # labelcontd
+            labelcontd = lead.properties['labelcontd'] if ('labelcontd' in lead.properties) else None
+            if (labelcontd is not None):
+                labelcontdLead = self.findLeadById(labelcontd, True)
+                if (labelcontdLead is not None):
+                    leadGraph.addEdge(i, labelcontdLead.leadIndex, 'labelcontd')
+        return leadGraph
+
+
+    def findInheritedContentLead(self, index):
+        # a blank lead takes its content from the next lead that has some
+        # the lead graph has this for the leads it was built for, so we only have to scan leads added since (inline leads)
+        scanStartIndex = index+1
+        if (index < self.leadGraphLeadCount):
+            inheritedIndices = self.leadGraph.getDependencies(index, 'inherits')
+            if (len(inheritedIndices)>0):
+                return self.leads[inheritedIndices[0]]
+            scanStartIndex = max(scanStartIndex, self.leadGraphLeadCount)
+        for i in range(scanStartIndex, len(self.leads)):
+            nextLead = self.leads[i]
+            if (self.calcDoesLeadHaveContent(nextLead)):
+                return nextLead
+        return None
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def evaluateLeadsParallel(self, evaluationOrder, jobCount):
+        # evaluate leads in worker processes; return dictionary leadIndex -> [inputVersion, text, reportText, effects, printedTexts, error]
+        # workers are forked, so each gets a read only snapshot of the parser as it is now; they return the text of each lead plus the log of its
+        # lead effects (see doLeadEffect), which processLeadStage2 replays on this parser in the usual evaluation order, so output is identical to a serial build
+        # only leads whose code is all in self.codeFuncsInsertCacheable are sent to workers; others (which can assign dynamic lead ids, define tags, create leads, etc.)
+        # are evaluated here in order as usual, and a worker result is discarded if anything it depends on has changed by the time we get to it
+        if ('fork' not in multiprocessing.get_all_start_methods()):
+            return {}
+        candidateIndices = [leadIndex for leadIndex in evaluationOrder if (self.isLeadParallelEvaluable(leadIndex))]
+        if (len(candidateIndices)==0):
+            return {}
+        jrprint('Evaluating {} of {} leads using {} worker processes..'.format(len(candidateIndices), len(evaluationOrder), jobCount))
+        chunkSize = max(1, math.ceil(len(candidateIndices) / (jobCount*4)))
+        chunks = [candidateIndices[i:i+chunkSize] for i in range(0, len(candidateIndices), chunkSize)]
+        inputVersion = self.calcLeadEvaluationInputVersion()
+        #
+        global leadEvaluationWorkerParser
+        leadEvaluationWorkerParser = self
+        jrfuncs.jrprintFlush()
+        parallelResults = {}
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobCount, mp_context=multiprocessing.get_context('fork')) as executor:
+                for [chunkResults, chunkLinkTextCacheStats] in executor.map(evaluateLeadsInWorker, chunks):
+                    for statName in chunkLinkTextCacheStats:
+                        self.linkTextCacheStats[statName] += chunkLinkTextCacheStats[statName]
+                    for [leadIndex, normalText, reportText, effects, printedTexts, error] in chunkResults:
+                        parallelResults[leadIndex] = [inputVersion, normalText, reportText, effects, printedTexts, error]
+        finally:
+            leadEvaluationWorkerParser = None
+        return parallelResults
+
+
+    def isLeadParallelEvaluable(self, index):
+        lead = self.leads[index]
+        if (self.calcDoesLeadHaveContent(lead)):
+            evaluationLead = lead
+        else:
+            inheritedIndices = self.leadGraph.getDependencies(index, 'inherits')
+            if (len(inheritedIndices)==0):
+                return False
+            evaluationLead = self.leads[inheritedIndices[0]]
+        return self.isLeadInsertCacheable(evaluationLead)
+
+
+    def calcLeadEvaluationInputVersion(self):
+        # changes whenever something that the text of (parallel evaluable) code depends on changes
+        return [self.leadRegistry.renderIdChangeCount, self.optionsChangeCount]
+
+
+    def calcLeadEvaluationStateVersion(self):
+        # changes whenever evaluation changes state in some way other than a lead effect; a worker result is only usable if this does not change
+        return [len(self.leads), self.tagRegistry.getCount(), len(self.warnings), len(self.notes), len(self.userVars), self.dynamicLeadIdCount, self.leadRegistry.renderIdChangeCount, self.optionsChangeCount]
+
+
+    def evaluateLeadsForWorker(self, leadIndices):
+        # runs in a worker process; return [results, linkTextCacheStats], where results is a list of [leadIndex, text, reportText, effects, printedTexts, error] for the leads that we could evaluate
+        # a lead whose evaluation raised an exception comes back with error = [message, stateVersion], which is raised when its turn comes (see isParallelLeadResultUsable)
+        # also returns the link text cache hits and misses of these leads, since a worker process evaluates several chunks
+        linkTextCacheStatsStart = dict(self.linkTextCacheStats)
+        results = []
+        for leadIndex in leadIndices:
+            lead = self.leads[leadIndex]
+            if (self.calcDoesLeadHaveContent(lead)):
+                evaluationLead = lead
+            else:
+                evaluationLead = self.findInheritedContentLead(leadIndex)
+            stateVersion = self.calcLeadEvaluationStateVersion()
+            self.leadEffectLog = []
+            errorText = None
+            jrfuncs.jrprintCaptureStart()
+            try:
+                [normalText, reportText] = self.evaluateHeadBlockTextCode(evaluationLead, lead, {})
+            except Exception as e:
+                errorText = str(e)
+            finally:
+                leadEffectLog = self.leadEffectLog
+                self.leadEffectLog = None
+                printedTexts = jrfuncs.jrprintCaptureEnd()
+            if (errorText is not None):
+                results.append([leadIndex, None, None, [], printedTexts, [errorText, stateVersion]])
+                continue
+            if (self.calcLeadEvaluationStateVersion()!=stateVersion):
+                continue
+            try:
+                effects = [self.makeLeadEffectPortable(effect) for effect in leadEffectLog]
+            except Exception as e:
+                # an effect we can't pass back; let the parent evaluate the lead itself
+                continue
+            results.append([leadIndex, normalText, reportText, effects, printedTexts, None])
+        linkTextCacheStats = {statName: self.linkTextCacheStats[statName] - linkTextCacheStatsStart[statName] for statName in self.linkTextCacheStats}
+        return [results, linkTextCacheStats]
+
+
+    def makeLeadEffectPortable(self, effect):
+        # effects hold references to leads, blocks and tags, which we replace with [type, ...] references that can be passed back from a worker
+        [effectName, sourceLead, effectArgs] = effect
+        portableArgs = []
+        for effectArg in effectArgs:
+            if (isinstance(effectArg, Lead)):
+                effectArg = ('lead', effectArg.leadIndex)
+            elif (isinstance(effectArg, Block)):
+                childIndices = [childIndex for childIndex, childBlock in enumerate(sourceLead.block.blocks) if (childBlock is effectArg)]
+                if (len(childIndices)!=1):
+                    raise Exception('Lead effect refers to a block that is not a child of its source lead.')
+                effectArg = ('block', childIndices[0])
+            elif (isinstance(effectArg, dict)):
+                if (self.tagRegistry.findById(effectArg.get('idExtended')) is not effectArg):
+                    raise Exception('Lead effect refers to an unknown dictionary.')
+                effectArg = ('tag', effectArg['idExtended'])
+            elif (effectArg is not None) and (type(effectArg) not in [str, int, float, bool]):
+                raise Exception('Lead effect argument of unsupported type {}.'.format(type(effectArg).__name__))
+            portableArgs.append(effectArg)
+        return [effectName, sourceLead.leadIndex, portableArgs]
+
+
+    def applyParallelLeadResult(self, lead, parallelResult):
+        # replay the output and effects of a lead evaluated in a worker, and return [text, reportText]; if its evaluation failed, raise the error here, in lead order, as a serial build would
+        [inputVersion, normalText, reportText, effects, printedTexts, error] = parallelResult
+        for printedText in printedTexts:
+            jrprint(printedText, end='')
+        if (error is not None):
+            raise Exception(error[0])
+        for [effectName, sourceLeadIndex, portableArgs] in effects:
+            sourceLead = self.leads[sourceLeadIndex]
+            effectArgs = []
+            for effectArg in portableArgs:
+                if (type(effectArg) is tuple):
+                    if (effectArg[0]=='lead'):
+                        effectArg = self.leads[effectArg[1]]
+                    elif (effectArg[0]=='block'):
+                        effectArg = sourceLead.block.blocks[effectArg[1]]
+                    else:
+                        effectArg = self.tagRegistry.findById(effectArg[1])
+                effectArgs.append(effectArg)
+            self.doLeadEffect(effectName, sourceLead, lead, effectArgs)
+        return [normalText, reportText]
+
+
+    def isParallelLeadResultUsable(self, parallelResult):
+        # a worker result is usable if nothing it depends on has changed since the workers were forked
+        # an error may instead come from state that earlier leads had not set up yet in the worker (a tag they define, say), so it is only trusted if no state has changed at all;
+        # otherwise the lead is evaluated again here, which raises the error in lead order if it is real
+        if (parallelResult[0]!=self.calcLeadEvaluationInputVersion()):
+            return False
+        error = parallelResult[5]
+        if (error is not None) and (error[1]!=self.calcLeadEvaluationStateVersion()):
+            return False
+        return True
+# ---------------------------------------------------------------------------
+
+
 # ---------------------------------------------------------------------------
     def processLeadBothStages(self, lead, index):
         self.processLeadStage1(lead,index)
@@ -1599,11 +2679,11 @@ class HlParser:
 
 
 # ---------------------------------------------------------------------------
-    def processLeadStage2(self, lead, index):
+    def processLeadStage2(self, lead, index, parallelResult=None):
         # first render the text for the lead
         # normal full text contents of the lead; note the second time lead is passed it is the behalfLead; for normal building of text this is the case; if the lead is built to embed elsewhere this will be different
-        leadId = lead['id']
-        leadProprties = lead['properties']
+        leadId = lead.id
+        leadProprties = lead.properties
         debugInfo = leadProprties['label']
         jrprint('Stage 2: Processing lead {:.<20}... {}'.format(leadId, debugInfo))
 
@@ -1620,17 +2700,10 @@ class HlParser:
             evaluationLead = lead
         else:
             # try to copy from subsequent lead
-            leadCount = len(self.leads)
-            for i in range(index+1, leadCount):
-                nextLead = self.leads[i]
-                if (not self.calcDoesLeadHaveContent(nextLead)):
-                    continue
-                # ok we found one to copy from
-                # we USED to just copy the text
-                # but this is no longer good enough, we have to make copies of the blocks so we can evaluate them
-                # NOTE this basically functions like an insertLead() to the last last
-                evaluationLead = nextLead
-                break
+            # we USED to just copy the text
+            # but this is no longer good enough, we have to make copies of the blocks so we can evaluate them
+            # NOTE this basically functions like an insertLead() to the last last
+            evaluationLead = self.findInheritedContentLead(index)
 
         # dynamic fix up of labels that depend on all labels being created
         # label from labelcontd.
@@ -1641,18 +2714,22 @@ class HlParser:
                 msg = 'Failed to find lead referenced in labelcontd setting.'
                 self.raiseLeadException(lead,0,msg)
             labelcontdLeadLink = self.makeTextLinkToLead(labelcontdLead, None, False, True)
-            lead['properties']['label'] = '{} ({}) contd.'.format(labelcontdLead['properties']['label'], labelcontdLeadLink)
+            lead.properties['label'] = '{} ({}) contd.'.format(labelcontdLead.properties['label'], labelcontdLeadLink)
 
         if (evaluationLead is None):
             self.addWarning('Could not find subsequent content to use for lead {}.'.format(leadId))
-            lead['text'] = '***BLANK***'
-            lead['reportText'] = '***BLANK***'
+            lead.text = '***BLANK***'
+            lead.reportText = '***BLANK***'
             return
 
         # AFTER we copy can we evaluate code?
-        [normalText, reportText] = self.evaluateHeadBlockTextCode(evaluationLead, lead, {})
-        lead['text'] = normalText
-        lead['reportText'] = reportText
+        if (parallelResult is not None) and (self.isParallelLeadResultUsable(parallelResult)):
+            # already evaluated by a worker (see evaluateLeadsParallel), and nothing it depends on has changed since
+            [normalText, reportText] = self.applyParallelLeadResult(lead, parallelResult)
+        else:
+            [normalText, reportText] = self.evaluateHeadBlockTextCode(evaluationLead, lead, {})
+        lead.text = normalText
+        lead.reportText = reportText
 # ---------------------------------------------------------------------------
 
 
@@ -1708,70 +2785,29 @@ class HlParser:
             # already a lead?
             return leadId
         
-        leadId = self.canonicalLeadId(leadId)
-
-        for lead in self.leads:
-            propLeadId = lead['id']
-            if (propLeadId == leadId):
-                return lead
-            if (flagCheckRenderId):
-                if (lead['properties']['renderId']==leadId):
-                    return lead
+        leadId = LeadId.get(leadId).canonical
+        return self.leadRegistry.findById(leadId, flagCheckRenderId)
 
-        return None
+    def makeLead(self, leadId, headBlock, properties, text):
+        return Lead(LeadId.get(leadId).canonical, headBlock, properties, text, headBlock.sourceLabel, headBlock.lineNumber)
 
     def addLead(self, lead):
         #jrprint('Storing lead: {}.'.format(leadId))
 
-        duplcateLead = self.findLeadById(lead['id'], False)
+        duplcateLead = self.findLeadById(lead.id, False)
         if (duplcateLead is not None):
-            duplicateLeadBlock = duplcateLead['block']
-            self.raiseLeadException(lead, 0, 'Duplicate lead id (matching lead at location {}, line #{})'.format(duplcateLead['sourceLabel'], duplcateLead['lineNumber']))
-
-        leadIndex = len(self.leads)
-        lead['leadIndex'] = leadIndex
-        self.leads.append(lead)
-        mapStyle = jrfuncs.getDictValueOrDefault(lead['properties'],'map','')
-        propType = jrfuncs.getDictValueOrDefault(lead['properties'],'type','')
+            duplicateLeadBlock = duplcateLead.block
+            self.raiseLeadException(lead, 0, 'Duplicate lead id (matching lead at location {}, line #{})'.format(duplcateLead.sourceLabel, duplcateLead.lineNumber))
+
+        leadIndex = self.leadRegistry.add(lead)
+        mapStyle = jrfuncs.getDictValueOrDefault(lead.properties,'map','')
+        propType = jrfuncs.getDictValueOrDefault(lead.properties,'type','')
         if (propType=='doc_REN'):
             mapStyle = 'false'
         # add mind map
         if (mapStyle!='false'):
             self.createMindMapLead(lead, mapStyle)
         return leadIndex
-
-    def canonicalLeadId(self, id):
-        # uppercase
-        #id = id.upper()
-        # no spaces
-        id = id.replace(' ','')
-        # add space between letters and numbers (SHCD stye) - NO THIS CAUSES PROBLEMS; instead do this on display
-        if (False):
-            matches = re.match(r'^([A-Za-z]+)\s*\-?\s*([0-9]+)$', id)
-            if (matches is not None):
-                id = matches[1] + ' ' + matches[2]
-        #
-        return id
-
-    def calcIdSection(self, id):
-        matches = re.match(r'^([A-Za-z0-9][A-Za-z0-9\.]+)\.(.*)$', id)
-        if (matches is not None):
-            # HL style id
-            return matches[1].upper()
-        matches = re.match(r'^([A-Za-z0-9\.]+)\s*\-\s*(.*)$', id)
-        if (matches is not None):
-            # HL style id
-            return matches[1].upper()
-        matches = re.match(r'^([A-Za-z]+)\s*\-?\s*([0-9]+)$', id)
-        if (matches is not None):
-            # shcd style id
-            return matches[1].upper()
-        matches = re.match(r'^([0-9]+)\s*\-?\s*([A-Za-z]+)$', id)
-        if (matches is not None):
-            # shcd style id reverse
-            return matches[2].upper()
-        # unknown
-        return ''
 # ---------------------------------------------------------------------------
 
 
@@ -1789,7 +2825,7 @@ class HlParser:
         jrprint('Saving leads to: {}'.format(outFilePath))
         encoding = self.getOptionValThrowException('storyFileEncoding')
         with open(outFilePath, 'w', encoding=encoding) as outfile:
-            leadsJson = json.dumps(self.rootSection, indent=2)
+            leadsJson = json.dumps(self.rootSection, indent=2, default=hlblocks.jsonDefault)
             outfile.write(leadsJson)
 # ---------------------------------------------------------------------------
 
@@ -1803,7 +2839,7 @@ class HlParser:
         self.rootSection = {}
         # ATTN: TODO - seed with some initial sections?
         optionSections = self.getOptionVal('sections', self.getDefaultSections())
-        self.rootSection['sections'] = jrfuncs.deepCopyListDict(optionSections)
+        self.rootSection['sections'] = thawOptionValue(optionSections)
         #self.createRootChildSection('Front', 'Front', '010')
         #self.createRootChildSection('Leads', 'Leads', '020')
         #self.createRootChildSection('Back', 'Back', '030')
@@ -1812,7 +2848,7 @@ class HlParser:
 
         #
         for lead in self.leads:
-            leadId = lead['id']
+            leadId = lead.id
             section = self.calcSectionForLead(lead)
             if ('leads' not in section):
                 section['leads'] = {}
@@ -1900,7 +2936,7 @@ class HlParser:
 
     def calcSectionForLead(self, lead):
         # return the child section for this lead, creating the path to it if needed
-        properties = lead['properties']
+        properties = lead.properties
         sectionName = properties['sectionName']
         # split it into dot separated chain
         sectionNameParts = sectionName.split('.')
@@ -1961,7 +2997,7 @@ class HlParser:
         jrprint('Working dir options: {}'.format(self.jroptionsWorkingDir.getAllBlocks()))
         jrprint('Scan found {} lead files: {}.'.format(len(self.storyFileList), self.storyFileList))
         jrprint('\nTag map:')
-        jrprint(self.tagMap)
+        jrprint(self.tagRegistry.getTags())
         if (False):
             jrprint('Headblocks:\n')
             for block in self.headBlocks:
@@ -1978,7 +3014,7 @@ class HlParser:
         if (optionSummarizeChildBlocks):
             if ('blocks' in tempBlock):
                 tempBlock['blocks'] = len(tempBlock['blocks'])
-        debugText = json.dumps(tempBlock, indent=2)
+        debugText = json.dumps(tempBlock, indent=2, default=hlblocks.jsonDefault)
         return debugText
 
 
@@ -2008,6 +3044,16 @@ class HlParser:
     def reportSummary(self):
         leadStats = self.calcLeadStats()
         jrprint('SUMMARY STATS: ' + leadStats['summaryString'])
+        jrprint('PARSE CACHE STATS: ' + self.calcParseCacheStatsString())
+        jrprint('LINK TEXT CACHE STATS: ' + self.calcLinkTextCacheStatsString())
+
+
+    def calcLinkTextCacheStatsString(self):
+        # link texts made in lead evaluation workers are counted too (see evaluateLeadsParallel), and each worker has its own cache, so these counts depend on the job count; keep them out of rendered output
+        stats = self.linkTextCacheStats
+        linkTextCount = stats['hits'] + stats['misses']
+        linkTextHitPercent = (100.0 * stats['hits'] / linkTextCount) if (linkTextCount>0) else 0
+        return '{} hits / {} misses ({:.1f}% reused).'.format(stats['hits'], stats['misses'], linkTextHitPercent)
 # ---------------------------------------------------------------------------
 
 
@@ -2029,16 +3075,14 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def resolveTemplateVars(self, text):
-        text = text.replace('$workingdir', self.getBaseOptionVal('workingdir', ''))
-        text = text.replace('$basedir', self.getBaseOptionVal('basedir', ''))
-        return text
+        return self.getOptionsSnapshot().resolveTemplateVars(text)
 # ---------------------------------------------------------------------------
 
 
 
 # ---------------------------------------------------------------------------
     def raiseLeadException(self, lead, lineNumber, message):
-        self.raiseBlockException(lead['block'], lineNumber, message + '; in lead {}'.format(lead['id']))
+        self.raiseBlockException(lead.block, lineNumber, message + '; in lead {}'.format(lead.id))
 
     def raiseBlockException(self, block, lineNumber, message):
         if ('id' in block):
@@ -2064,14 +3108,10 @@ class HlParser:
 
 
     def countLinesInBlockUntilPos(self, text, pos):
-        lineNumber = 0
-        linePos = 0
-        for i in range(0,pos):
-            c = text[i]
-            if (c=='\n'):
-                linePos = 0
-                lineNumber += 1
-        return [lineNumber, linePos]
+        # return [lineNumber, linePos] of pos within text; the line table is kept for the last text we were asked about
+        if (self.blockSourceFile is None) or (self.blockSourceFile.text is not text):
+            self.blockSourceFile = JrSourceFile(text)
+        return self.blockSourceFile.calcLineAndPosAtPos(pos)
 # ---------------------------------------------------------------------------
 
 
@@ -2084,21 +3124,22 @@ class HlParser:
 # ---------------------------------------------------------------------------
     def formatLeadIdForSorting(self, idStr, lead, leadSort):
         
-        properties = lead['properties']
+        properties = lead.properties
         if ('sort' in properties) and (properties['sort']!=''):
             val = properties['sort']
             if (val=='index'):
-                val = str(lead['leadIndex'])
+                val = str(lead.leadIndex)
         else:
             # if there are numbers at start or end then we will sort by id
             if (leadSort=='index'):
                 # no digits at start or end, so use ADD order
-                val = str(lead['leadIndex'])
+                val = str(lead.leadIndex)
             elif (leadSort=='') or (leadSort=='alpha'):
                 #val = idStr
-                val = properties['renderId']
+                # the padded sort key of an id is computed once
+                return LeadId.get(properties['renderId']).sortKey
             else:
-                raise Exception('Unknown sort value: {} near {} line {}.'.format(leadSort, lead['sourceLabel'], lead['lineNumber']))
+                raise Exception('Unknown sort value: {} near {} line {}.'.format(leadSort, lead.sourceLabel, lead.lineNumber))
         digitlen = 6
         return jrfuncs.zeroPadNumbersAnywhereInStringAll(val, digitlen)
         numericalLeadRegex = re.compile(r'^(\d+)\-(.*)$')
@@ -2132,11 +3173,12 @@ class HlParser:
         renderId = self.consumeUnusedLeadId()
         oldLead = self.findLeadById(renderId, True)
         if (oldLead is not None):
-            self.raiseBlockException(block, 0, 'ERROR: unused lead returned an id ({}) that already exists in lead table ({} at {}) for DYNAMIC lead id "{}"'.format(renderId, oldLead['sourceLabel'], oldLead['lineNumber'], id))
+            self.raiseBlockException(block, 0, 'ERROR: unused lead returned an id ({}) that already exists in lead table ({} at {}) for DYNAMIC lead id "{}"'.format(renderId, oldLead.sourceLabel, oldLead.lineNumber, id))
         self.dynamicLeadMap[id] = renderId
         return renderId
     
     def consumeUnusedLeadId(self):
+        self.dynamicLeadIdCount += 1
         unusedLeadRow = self.getHlApi().popAvailableLead()
         if (unusedLeadRow is None):
             # not found, unavailable from list.
@@ -2206,13 +3248,13 @@ class HlParser:
         # ATTN: test 12/30/23 just combine all text lines
         # ATTN: TODO handle code blocks and conditionals
         txt = ''
-        childBlocks = headBlock['blocks']
+        childBlocks = headBlock.blocks
         for block in childBlocks:
-            blockType = block['type']
+            blockType = block.type
             if (blockType=='text'):
-                txt += block['text']
+                txt += block.text
             elif (blockType=='code'):
-                txt += block['text']
+                txt += block.text
             else:
                 self.raiseBlockException(block, 0, 'Unknown block type "{}"'.format(blockType))
 
@@ -2231,36 +3273,31 @@ class HlParser:
 # ---------------------------------------------------------------------------
 # ok here is our new code to evaluate blocks
     def evaluateHeadBlockTextCode(self, lead, behalfLead, evaluationOptions):
-        # this now returns the tupe [normalText, reportText]
-        headBlock = lead['block']
+        # this now returns the tupe [normalText, reportText]; reportText is None if not self.reportTextEnabled
+        headBlock = lead.block
         if ('blocks' not in headBlock):
-            return ['', '']
+            return ['', ''] if (self.reportTextEnabled) else ['', None]
         
         # assemble
-        text = ''
-        reportText = ''
+        textBuilder = LeadTextBuilder(self.reportTextEnabled)
         context = {}
         #
-        childBlocks = headBlock['blocks']
-        movedBlockIdList = headBlock['movedBlocks'] if ('movedBlocks' in headBlock) else []
+        childBlocks = headBlock.blocks
         #
         blockIndex = -1
         while (blockIndex<len(childBlocks)-1):
             blockIndex += 1
-            if (blockIndex in movedBlockIdList):
-                continue
             block = childBlocks[blockIndex]
-            blockType = block['type']
+            blockType = block.type
             if (blockType=='text'):
-                text += block['text']
-                reportText += block['text']
+                textBuilder.add(block.text)
             elif (blockType=='code'):
-                textPositionStyle = self.calcTextPositionStyle(text)
+                textPositionStyle = textBuilder.getTextPositionStyle()
                 codeResult = self.evaluateCodeBlock(block, lead, textPositionStyle, behalfLead, evaluationOptions, context)
                 if ('text' in codeResult):
-                    text += codeResult['text']
+                    textBuilder.addText(codeResult['text'])
                 if ('reportText' in codeResult):
-                    reportText += codeResult['reportText']
+                    textBuilder.addReportText(codeResult['reportText'])
                 #
                 if ('action' in codeResult):
                     action = codeResult['action']
@@ -2276,10 +3313,10 @@ class HlParser:
                         if (label is None):
                             if (False):
                                 # this is for inline labeling of a lead, but using the id seems odd when we are linking to it in parens
-                                oLeadLabel = behalfLead['properties']['label'] if (behalfLead['properties']['label'] != '') and (behalfLead['properties']['label'] is not None) else behalfLead['id']
+                                oLeadLabel = behalfLead.properties['label'] if (behalfLead.properties['label'] != '') and (behalfLead.properties['label'] is not None) else behalfLead.id
                             else:
                                 # this leaves it blank if there is no label
-                                oLeadLabel = behalfLead['properties']['label'] if (behalfLead['properties']['label'] != '') and (behalfLead['properties']['label'] is not None) else ''
+                                oLeadLabel = behalfLead.properties['label'] if (behalfLead.properties['label'] != '') and (behalfLead.properties['label'] is not None) else ''
                             labelContd = '({}) contd.'.format(self.makeTextLinkToLead(behalfLead, None, False, True))
                             if (oLeadLabel==''):
                                 label = labelContd
@@ -2294,9 +3331,8 @@ class HlParser:
                         forcedLeadId = ''
                         # ugly kludge to handle when one lead is executing on behalf of another
                         [newLead, addTextSuffix] = self.inlineChildBlocksToNewLead(behalfLead, headBlock, label, block, blockIndex, forcedLeadId, preText, postText, args)
-                        # update this list
-                        movedBlockIdList = headBlock['movedBlocks'] if ('movedBlocks' in headBlock) else []
-                        # resume from this blockindex afterwards
+                        # resume after the blocks that were moved
+                        blockIndex = self.getBlockSpan(headBlock, blockIndex, 'inline')[0] - 1
                         linkText = self.makeTextLinkToLead(newLead, None, False, True)
                         baseText = self.getText('goto') + ' ' + linkText
                         if (afterText is not None) and (afterText!=''):
@@ -2307,20 +3343,19 @@ class HlParser:
                         else:
                             baseText += '.'
                         #
-                        textPositionStyle = self.calcTextPositionStyle(text)
+                        textPositionStyle = textBuilder.getTextPositionStyle()
                         #baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, '', True, True, False)
                         # since this is INSIDE the inline, it should always be start of line
                         #baseText = self.modifyTextToSuitTextPositionStyle(baseText, 'linestart', '', True, True, False)
 
                         baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, '* ', True, False, False)
                         baseText += addTextSuffix
-                        text += baseText
-                        reportText += baseText
+                        textBuilder.add(baseText)
                         # mindmap
                         self.createMindMapLinkLeadGoesToLead(block, behalfLead, newLead, context, mindMapLinkLabel, True)
                         # now we also record that this LEAD HAS an inline chaild
-                        lead['properties']['hasInline'] = True
-                        lead['properties']['defaultTime'] = False
+                        lead.properties['hasInline'] = True
+                        lead.properties['defaultTime'] = False
 
                     elif (action in ['conditioned']):
                         args = codeResult['args']
@@ -2329,28 +3364,8 @@ class HlParser:
                             # add in the next block
                             pass
                         else:
-                            # skip the next block
-                            inlineDepth = 0
-                            while (blockIndex<len(childBlocks)-1):
-                                blockIndex += 1
-                                block = childBlocks[blockIndex]
-                                if (block['type']=='code'):
-                                    codeText = block['text']
-                                    if (codeText.startswith('begin(')):
-                                        inlineDepth += 1
-                                    elif (codeText.startswith('end(')):
-                                        inlineDepth -= 1
-                                        #if (inlineDepth<0):
-                                        # we allow an $end() without a $begin to mark end of an $inline
-                                        if (inlineDepth<-1):
-                                            # error
-                                            raise Exception('inlineDepth<-1 in action conditioned')
-                                        if (inlineDepth==0):
-                                            # only when not in ntest do we allow code to break us out otherwise we migrate it
-                                            break
-                                    continue
-                                else:
-                                    break
+                            # skip the next block (or $begin()...$end() group)
+                            blockIndex = self.getBlockSpan(headBlock, blockIndex, 'conditioned')[0] - 1
             elif (blockType=='eof'):
                 # nothing to do
                 pass
@@ -2358,42 +3373,19 @@ class HlParser:
                 self.raiseBlockException(block, 0, 'Unknown block type "{}"'.format(blockType))
 
         # trim
-        text = text.strip()
-        reportText = reportText.strip()
-
-        return [text, reportText]
+        return textBuilder.calcTexts()
 # ---------------------------------------------------------------------------
 
 
 # ---------------------------------------------------------------------------
     def calcTextPositionStyle(self, text):
-        # return one of: ['linestart', 'sentence', 'midsentence']
-        # linestart: next text starts a line
-        # sentence: next text starts a sentence (could be after a : for example
-        # midstentence: should start with lowercase
-        spaceCharacters = [' ']
-        sentenceCharacters = [':', '.', '@', '$', '&', '*', '%']
-        linestartCararacters = ['\n', '\t']
-        quoteCharacters = ['"', "'"]
-        #
-        if (len(text)==0):
+        # return one of: ['linestart', 'sentence', 'midsentence']; see calcTrailingTextPositionStyle
+        # (when building text from fragments use a LeadTextBuilder, which tracks this as it goes)
+        textPositionStyle = calcTrailingTextPositionStyle(text)
+        if (textPositionStyle is None):
+            # at start of line
             return 'linestart'
-        pos = len(text)-1
-        while (pos>=0):
-            c = text[pos]
-            pos -= 1
-            if (c in spaceCharacters):
-                continue
-            if (c in quoteCharacters):
-                continue
-            if (c in sentenceCharacters):
-                return 'sentence'
-            if (c in linestartCararacters):
-                return 'linestart'
-            # something else
-            return 'midsentence'
-        # at start of line
-        return 'linestart'
+        return textPositionStyle
 
 
     def modifyTextToSuitTextPositionStyle(self, text, textPositionStyle, linestartPrefix, flagCapIfStartSentence, flagBorderIfStandalone, flagPeriodIfStandalone):
@@ -2440,22 +3432,22 @@ class HlParser:
         #
         oldLead = self.findLeadById(leadId, True)
         if (oldLead is not None):
-            self.raiseBlockException(block, 0, 'ERROR: inlining dynamic lead returned an id ({}) that already exists in lead table ({} at {}) for DYNAMIC lead id "{}"'.format(leadId, oldLead['sourceLabel'], oldLead['lineNumber'], id))
+            self.raiseBlockException(block, 0, 'ERROR: inlining dynamic lead returned an id ({}) that already exists in lead table ({} at {}) for DYNAMIC lead id "{}"'.format(leadId, oldLead.sourceLabel, oldLead.lineNumber, id))
 
         # create a new head block with stats from this block
         if (label!=''):
             headerString ='{}: "{}"'.format(leadId, label)
         else:
             headerString = leadId
-        newHeadBlock = self.makeBlockHeader(headerString, block['sourceLabel'], block['lineNumber'], 'lead')
+        newHeadBlock = self.makeBlockHeader(headerString, block.sourceLabel, block.lineNumber, 'lead')
         self.addHeadBlock(newHeadBlock)
 
-        properties = newHeadBlock['properties']
+        properties = newHeadBlock.properties
         properties['renderId'] = leadId
         properties['sectionName'] = self.makeSectionNameForHeadBlock(newHeadBlock, leadId, leadId)
         properties['autoid'] = autoid
         properties['inline'] = True
-        properties['inlineSourceLeadId'] = sourceLead['id']
+        properties['inlineSourceLeadId'] = sourceLead.id
 
         # copy over any additional args of import
         if ('time' in inlineArgs):
@@ -2464,79 +3456,44 @@ class HlParser:
             properties['defaultTime'] = inlineArgs['defaultTime']
 
         # mtype is a trail from original lead plus inline
-        properties['mtype'] = sourceLead['properties']['mtype'] + '.inline'
+        properties['mtype'] = sourceLead.properties['mtype'] + '.inline'
 
         # ok ADD the new lead by copying values from block
-        lead = {'id': self.canonicalLeadId(leadId), 'block': newHeadBlock, 'properties': properties, 'text': '', 'sourceLabel': newHeadBlock['sourceLabel'], 'lineNumber': newHeadBlock['lineNumber']}
+        lead = self.makeLead(leadId, newHeadBlock, properties, '')
         leadIndex = self.addLead(lead)
+        if (self.leadGraph is not None):
+            self.leadGraph.addEdge(leadIndex, sourceLead.leadIndex, 'inline')
 
         # now migrate children
         # THIS *MOVES* text blocks to their new incline child block
-        childBlocks = headBlock['blocks']
-        inlineDepth = 0
-        while (blockIndex<len(childBlocks)-1):
-            blockIndex += 1
-            block = childBlocks[blockIndex]
-            if (block['type']=='code'):
-                codeText = block['text']
-                if (codeText.startswith('begin(')):
-                    inlineDepth += 1
-                elif (codeText.startswith('end(')):
-                    inlineDepth -= 1
-                    #if (inlineDepth<0):
-                    # we allow an $end() without a $begin to mark end of an $inline
-                    if (inlineDepth<-1):
-                        # error
-                        self.raiseBlockException(block, 0, 'ERROR: inlining lead too many $end() without matching $begin() lead returned an id ({}) that already exists in lead table ({} at {}) for DYNAMIC lead id "{}"'.format(leadId, oldLead['sourceLabel'], oldLead['lineNumber'], id))
-
-                #
-                if (inlineDepth<=0):
-                    # only when not in ntest do we allow code to break us out otherwise we migrate it
-
-                    #
-                    properties = block['properties']
-                    if ('embeddedShortCode' not in properties) or (properties['embeddedShortCode']==False):
-                        # we encountered a full code block so we are done
-                        break
-                    # ATTN: normally $functions are kept with the text and would be CAPTURED inside an $inline() operation that captures subsequent text
-                    # so if you want to STOP the inlining and start some new text you COULD put {} on a line of its own
-                    # but this is a bit annoying and error prone, and a very commmon thing to want to do is have an "Otherwise..." text that separates inline blocks
-                    # so here we allow the use of a $otherwise function which just inserts the text "otherwise" and specially treat this as something that STOPS the globbing of inline blocks
-                    # but as a kludge we have to tell our caller than an extra linebreak is needed.
-
-                    if (codeText.startswith('otherwise')):
-                        # kludge to handle lack of linebreak
-                        addTextSuffix = '\n'
-                        # stop inline globbing
-                        break
-
-
+        [endIndex, flagOtherwise] = self.getBlockSpan(headBlock, blockIndex, 'inline')
+        if (flagOtherwise):
+            # kludge to handle lack of linebreak
+            addTextSuffix = '\n'
+        childBlocks = headBlock.blocks
+        for movedIndex in range(blockIndex+1, endIndex):
             # move this bock
-            self.addChildBlock(newHeadBlock, block)
-            # this causes problems when we need to evaluate a lead on behalf of another lead, since it loses its child contents
-            # what would be nice is if we could mark that the children are MOVED and not to be evaluates
-            if (True):
-                # new attempt, ugly kludge
-                if ('movedBlocks' not in headBlock):
-                    headBlock['movedBlocks'] = [blockIndex]
-                else:
-                    if (blockIndex not in headBlock['movedBlocks']):
-                        headBlock['movedBlocks'].append(blockIndex)
-            else:
-                # old way, delete
-                del headBlock['blocks'][blockIndex]
-                blockIndex -= 1
+            self.addChildBlock(newHeadBlock, childBlocks[movedIndex])
+        # this causes problems when we need to evaluate a lead on behalf of another lead, since it loses its child contents
+        # so rather than deleting them we mark that the children are MOVED (evaluateHeadBlockTextCode jumps over the span)
+        if ('movedBlocks' not in headBlock):
+            headBlock.movedBlocks = list(range(blockIndex+1, endIndex))
+        else:
+            movedBlockIdSet = set(headBlock.movedBlocks)
+            headBlock.movedBlocks += [movedIndex for movedIndex in range(blockIndex+1, endIndex) if (movedIndex not in movedBlockIdSet)]
 
         # now process it (it will not be processed in main loop since it is added after)
         self.processLeadBothStages(lead, leadIndex)
 
         #
         if (preText != ''):
-            lead['text'] = preText + '\n' + lead['text']
-            lead['reportText'] = preText + '\n' + lead['reportText']
+            lead.text = preText + '\n' + lead.text
+            if (lead.reportText is not None):
+                lead.reportText = preText + '\n' + lead.reportText
         if (postText != ''):
-            lead['text'] += '\n' + postText
-            lead['reportText'] += '\n' + postText
+            lead.text += '\n' + postText
+            if (lead.reportText is not None):
+                lead.reportText += '\n' + postText
 
         return [lead, addTextSuffix]
 # ---------------------------------------------------------------------------
@@ -2547,8 +3504,7 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def isRenderTextSyntaxMarkdown(self):
-        renderOptions = self.getOptionValThrowException('renderOptions')
-        renderTextSyntax = renderOptions['textSyntax']
+        renderTextSyntax = self.getOptionsSnapshot().getRenderTextSyntax()
         if (renderTextSyntax=='markdown'):
             return True
         return False
@@ -2557,21 +3513,31 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def makeTextLinkToLead(self, lead, customText, flagVerboseLabel, flagPageNumber):
-        properties = lead['properties']
-        leadId = lead['id']
-        leadLabel = properties['label']
+        properties = lead.properties
+        leadId = lead.id
         renderId = properties['renderId']
         linkLabel = customText if (customText is not None) else renderId
-        return self.makeTextLinkToLeadId(leadId, renderId, linkLabel, flagVerboseLabel, flagPageNumber)
+        return self.makeCachedTextLinkToLead(lead, (customText, flagVerboseLabel, flagPageNumber), renderId, linkLabel, flagVerboseLabel, flagPageNumber)
+
+
+    def makeCachedTextLinkToLead(self, lead, cacheKey, renderId, linkLabel, flagVerboseLabel, flagPageNumber):
+        # link texts only depend on the render id and label of the lead (and the text syntax), so we keep them on the lead and check those are unchanged before reusing one
+        # this means there is nothing to invalidate when a lead gets a new render id or label (for example from a tag, or labelcontd)
+        isMarkdown = self.isRenderTextSyntaxMarkdown()
+        cacheEntry = lead.linkTextCache.get(cacheKey)
+        if (cacheEntry is not None) and (cacheEntry[0]==renderId) and (cacheEntry[1]==linkLabel) and (cacheEntry[2]==isMarkdown):
+            self.linkTextCacheStats['hits'] += 1
+            return cacheEntry[3]
+        self.linkTextCacheStats['misses'] += 1
+        text = self.makeTextLinkToLeadId(lead.id, renderId, linkLabel, flagVerboseLabel, flagPageNumber)
+        lead.linkTextCache[cacheKey] = [renderId, linkLabel, isMarkdown, text]
+        return text
 
 
     def makeTextLinkToLeadId(self, leadId, renderId, linkLabel, flagVerboseLabel, flagPageNumber):
-        if (renderId[0].isdigit()):
-            prefix='#'
-        else:
-            prefix = ''
-        #
-        linkId = self.safeMarkdownId(renderId)
+        renderLeadId = LeadId.get(renderId)
+        prefix = renderLeadId.linkPrefix
+        linkId = renderLeadId.markdownId
         #
         if (linkLabel is not None):
             label = linkLabel
@@ -2605,19 +3571,13 @@ class HlParser:
         if (type(lead) is str):
             lead = self.findLeadById(lead, True)
         #
-        properties = lead['properties']
-        leadId = lead['id']
+        properties = lead.properties
+        leadId = lead.id
         leadLabel = properties['label']
         renderId = properties['renderId']
         #linkLabel = renderId
         linkLabel = leadLabel
-        return self.makeTextLinkToLeadId(leadId, renderId, linkLabel, flagVerboseLabel, True)
-
-
-
-    def safeMarkdownId(self, idStr):
-        idStr = idStr.replace(' ','_')
-        return idStr
+        return self.makeCachedTextLinkToLead(lead, ('flex', flagVerboseLabel), renderId, linkLabel, flagVerboseLabel, True)
 # ---------------------------------------------------------------------------
 
 
@@ -2655,14 +3615,14 @@ class HlParser:
         self.notes.append(noteDict)
 
     def makeDualNote(self, text, leadInfoText, leadInfoMText, block):
-        plainText = text + ' in {} from {} near line {}.'.format(leadInfoText, block['sourceLabel'], block['lineNumber'])
-        mText = text + ' in {} from {} near line {}.'.format(leadInfoMText, block['sourceLabel'], block['lineNumber'])
+        plainText = text + ' in {} from {} near line {}.'.format(leadInfoText, block.sourceLabel, block.lineNumber)
+        mText = text + ' in {} from {} near line {}.'.format(leadInfoMText, block.sourceLabel, block.lineNumber)
         return {'text': plainText, 'mtext': mText}
 
     def appendWarningLead(self, text, lead):
-        headBlock = lead['block']
-        plainText = text + '; in lead {} from {} around line {}.'.format(lead['id'], headBlock['sourceLabel'], headBlock['lineNumber'])
-        mText = text + '; in lead {} from {} around line {}.'.format(self.makeTextLinkToLead(lead, None, True, True), headBlock['sourceLabel'], headBlock['lineNumber'])
+        headBlock = lead.block
+        plainText = text + '; in lead {} from {} around line {}.'.format(lead.id, headBlock.sourceLabel, headBlock.lineNumber)
+        mText = text + '; in lead {} from {} around line {}.'.format(self.makeTextLinkToLead(lead, None, True, True), headBlock.sourceLabel, headBlock.lineNumber)
         noteDict = {'text': plainText, 'mtext': mText}
         self.warnings.append(noteDict)
 
@@ -2678,10 +3638,10 @@ class HlParser:
         self.markBoxesTracker[boxType]['useCount'] += 1
         self.markBoxesTracker[boxType]['sumAmounts'] += amount
         #
-        headBlock = lead['block']
+        headBlock = lead.block
         text = 'Marking {} {} boxes'.format(amount, boxType)
-        plainText = text + '; in lead {} from {} around line {}.'.format(lead['id'], headBlock['sourceLabel'], headBlock['lineNumber'])
-        mText = text + '; in lead {} from {} around line {}.'.format(self.makeTextLinkToLead(lead, None, True, True), headBlock['sourceLabel'], headBlock['lineNumber'])
+        plainText = text + '; in lead {} from {} around line {}.'.format(lead.id, headBlock.sourceLabel, headBlock.lineNumber)
+        mText = text + '; in lead {} from {} around line {}.'.format(self.makeTextLinkToLead(lead, None, True, True), headBlock.sourceLabel, headBlock.lineNumber)
         noteDict = {'text': plainText, 'mtext': mText} 
         self.markBoxesTracker[boxType]['useNotes'].append(noteDict)
 # ---------------------------------------------------------------------------
@@ -2698,590 +3658,794 @@ class HlParser:
         # note that now behalfLead is the lead that should be credited with any debug stats, and if it is None then do not count such stats
         # this is used so that we can regenerate leads in a debug mode and similar things without effecting such stats
 
-        # options
-        optionConditionTagsAsLetters = self.getConditionTagsAsLetters()
+        # code is compiled once into [handler, funcName, args]; normally that happens when the lead is added, but compile now if it has not been
+        compiledCode = block.compiledCode
+        if (compiledCode is None):
+            compiledCode = self.compileCodeBlock(block)
+        [handler, funcName, args] = compiledCode
 
-        # initial values; the None for reportText says to copy from resultText
+        # the handler returns [resultText, reportText]; the None for reportText says to copy from resultText
         codeResult = {}
-        resultText = ''
-        reportText = None
-        behalfLeadId = behalfLead['id']
-        behalfLeadProperties = behalfLead['properties']
+        [resultText, reportText] = handler(funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult)
 
-        # parse code
-        codeText = block['text']
-        [funcName, args, pos] = self.parseFunctionCallAndArgs(block, codeText)
+        # store results
+        codeResult['text'] = resultText
+        if (self.reportTextEnabled):
+            if (reportText is None):
+                reportText = resultText
+            codeResult['reportText'] = reportText
+
+        return codeResult
 
 
+    def compileCodeBlock(self, block):
+        # parse the code text of a block ONCE into [handler, funcName, args], with the handler looked up in self.codeFuncHandlers by function name
+        # so syntax errors, unknown functions and bad args are reported here, and evaluation (which can happen many times for the same block) never reparses
+        # note that handlers must not modify args since they are shared by all evaluations of the block
+        codeText = block.text
+        [funcName, args, pos] = self.parseFunctionCallAndArgs(block, codeText)
+
         #flagDisableDemeritHours = True
         #if (flagDisableDemeritHours):
         #    funcNameFix = {'demerithours': 'demerits', 'inlinedemerithours': 'inlinedemerit'}
         #    if (funcName in funcNameFix):
         #        funcName = funcNameFix[funcName]
 
-        if (sourceLead==behalfLead) or (behalfLead is None):
-            leadInfoText = 'lead "{}"'.format(sourceLead['id'])
-            leadInfoMText = 'lead "{}"'.format(self.makeTextLinkToLead(sourceLead, None, True, True))
-        else:
-            leadInfoText = 'lead "{}" [copied from "{}"]'.format(behalfLead['id'], sourceLead['id'])
-            leadInfoMText = 'lead "{}" [copied from "{}"]'.format(self.makeTextLinkToLead(behalfLead, None, True, True), self.makeTextLinkToLead(sourceLead, None, True, True))
-
-        if (funcName=='empty'):
-            # just placeholder
-            pass
-        
-        elif (funcName=='options'):
-            # merge in options
-            jsonOptionString = args['json']
-            jsonOptions = json.loads(jsonOptionString)
-            # set the WORKINGDIR options
-            self.jroptionsWorkingDir.mergeRawDataForKey('options', jsonOptions)
-
-        elif (funcName in ['golead','leadid', 'returnlead', 'reflead', 'goleadback']):
-            # replace with a lead's rendered id
-            leadId = args['leadId']
-            mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
-            comeBack = jrfuncs.getDictValueFromTrueFalse(args,'comeback',False)
-            #
-            existingLead = self.findLeadById(leadId, False)
-            if (existingLead is None):
-                self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
-            #
-            if (funcName == 'golead'):
-                linkText = self.makeTextLinkToLead(existingLead, None, False, True)
-                baseText = self.getText('goto') + ' ' + linkText
-            elif (funcName == 'goleadback'):
-                linkText = self.makeTextLinkToLead(existingLead, None, False, True)
-                baseText = self.getText('goto') + ' ' + linkText
-                baseText += ' then return here afterwards.'
-            elif (funcName == 'returnlead'):
-                linkText = self.makeTextLinkToLead(existingLead, None, False, True)
-                baseText = self.getText('returnto') + ' ' + linkText
-            elif (funcName == 'reflead'):
-                linkText = self.makeTextLinkToLead(existingLead, None, False, True)
-                baseText = linkText
-            else:
-                linkText = self.makeTextLinkToLead(existingLead, None, False, False)
-                baseText = linkText
-            #
-            if (comeBack):
-                baseText += ' and then return'
-
-            if (funcName=='returnlead'):
-                flagBoxIt = True
-                #fullLineText = self.getFullLineReturnToMd(False)
-                fullLineText = ''
-            else:
-                flagBoxIt = True
-                fullLineText =  '* '
-                fullLineText = ''
-            baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, fullLineText, True, flagBoxIt, False)
-            resultText = baseText
-            # mindmap
-            self.createMindMapLinkLeadGoesToLead(block, behalfLead, existingLead, context, mindMapLinkLabel, False)
-            # default no autotime on leads that go somewhere
-            behalfLeadProperties['defaultTime'] = False
+        handler = self.codeFuncHandlers.get(funcName)
+        if (handler is None):
+            # debug
+            dbgObj = {'funcName': funcName, 'args': args, 'pos': pos}
+            text = json.dumps(dbgObj)
+            msg = 'Syntax error; code function not understood: {}'.format(text)
+            self.raiseBlockException(block, 0, msg)
 
-        elif (funcName in ['gofake', 'gofakebak']):
-            leadId = self.consumeUnusedLeadId()
-            if (funcName == 'gofake'):
-                linkText = self.makeTextLinkToLeadId(leadId, leadId, None, False, False)
-                baseText = self.getText('goto') + ' ' + linkText
-            elif (funcName == 'gofakeback'):
-                linkText = self.makeTextLinkToLeadId(leadId, leadId, None, False, False)
-                baseText = self.getText('goto') + ' ' + linkText
-                baseText += ' then return here afterwards.'
-            fullLineText =  '* '
-            baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, fullLineText, True, False, False)
-            resultText = baseText
-
-
-        elif (funcName in ['returninline']):
-            # replace with a lead's rendered id
-            leadId = jrfuncs.getDictValueOrDefault(behalfLeadProperties,'inlineSourceLeadId',None)
-            if (leadId is None):
-                self.raiseBlockException(block, 0, 'The $returninline() function can only be used inside an inline lead; otherwise use $returnlead()')
-            mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
-            #
-            existingLead = self.findLeadById(leadId, False)
-            if (existingLead is None):
-                self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
-            #
-            linkText = self.makeTextLinkToLead(existingLead, None, False, True)
-            baseText = self.getText('returnto') + ' ' + linkText
-            #baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, self.getFullLineReturnToMd(False), True, False, False)
-            baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, '', True, True, False)
-            resultText = baseText
-            # mindmap
-            self.createMindMapLinkLeadGoesToLead(block, behalfLead, existingLead, context, mindMapLinkLabel, False)
+        block.compiledCode = [handler, funcName, args]
+        return block.compiledCode
 
 
+    def compileHeadBlockCode(self, headBlock):
+        # compile all code blocks of a lead up front
+        if ('blocks' not in headBlock):
+            return
+        for block in headBlock.blocks:
+            if (block.type=='code') and (block.compiledCode is None):
+                self.compileCodeBlock(block)
+        self.calcHeadBlockSpans(headBlock)
+
+
+    def calcHeadBlockSpans(self, headBlock):
+        # find the spans of blocks covered by inline and conditional code blocks, so evaluation can jump over them
+        headBlock.blockSpans = {'inline': {}, 'conditioned': {}}
+        for blockIndex, block in enumerate(headBlock.blocks):
+            if (block.type=='code') and (block.compiledCode is not None):
+                spanKind = self.codeFuncsBlockSpanKinds.get(block.compiledCode[1])
+                if (spanKind is not None):
+                    self.getBlockSpan(headBlock, blockIndex, spanKind)
+
+
+    def getBlockSpan(self, headBlock, blockIndex, spanKind):
+        # return [endIndex, flagOtherwise] for the code block at blockIndex; the blocks from blockIndex+1 up to (not including) endIndex are:
+        #  inline: moved into the new inline lead; flagOtherwise is True if it was ended by an $otherwise()
+        #  conditioned: skipped when the condition is false (the next block, or a $begin()...$end() group)
+        # spans only depend on the blocks, so they are cached on the head block
+        if (headBlock.blockSpans is None):
+            headBlock.blockSpans = {'inline': {}, 'conditioned': {}}
+        spans = headBlock.blockSpans[spanKind]
+        span = spans.get(blockIndex)
+        if (span is None):
+            if (spanKind=='inline'):
+                span = self.calcInlineBlockSpan(headBlock, blockIndex)
+            else:
+                span = self.calcConditionedBlockSpan(headBlock, blockIndex)
+            spans[blockIndex] = span
+        [endIndex, flagOtherwise, errorBlock] = span
+        if (errorBlock is not None):
+            if (spanKind=='inline'):
+                self.raiseBlockException(errorBlock, 0, 'ERROR: inlining lead found too many $end() without matching $begin()')
+            raise Exception('inlineDepth<-1 in action conditioned')
+        return [endIndex, flagOtherwise]
+
+
+    def calcInlineBlockSpan(self, headBlock, blockIndex):
+        # return [endIndex, flagOtherwise, errorBlock]
+        childBlocks = headBlock.blocks
+        inlineDepth = 0
+        while (blockIndex<len(childBlocks)-1):
+            blockIndex += 1
+            block = childBlocks[blockIndex]
+            if (block.type=='code'):
+                codeText = block.text
+                if (codeText.startswith('begin(')):
+                    inlineDepth += 1
+                elif (codeText.startswith('end(')):
+                    inlineDepth -= 1
+                    # we allow an $end() without a $begin to mark end of an $inline
+                    if (inlineDepth<-1):
+                        # error
+                        return [blockIndex, False, block]
+                #
+                if (inlineDepth<=0):
+                    # only when not in ntest do we allow code to break us out otherwise we migrate it
+                    properties = block.properties
+                    if ('embeddedShortCode' not in properties) or (properties['embeddedShortCode']==False):
+                        # we encountered a full code block so we are done
+                        return [blockIndex, False, None]
+                    # ATTN: normally $functions are kept with the text and would be CAPTURED inside an $inline() operation that captures subsequent text
+                    # so if you want to STOP the inlining and start some new text you COULD put {} on a line of its own
+                    # but this is a bit annoying and error prone, and a very commmon thing to want to do is have an "Otherwise..." text that separates inline blocks
+                    # so here we allow the use of a $otherwise function which just inserts the text "otherwise" and specially treat this as something that STOPS the globbing of inline blocks
+                    # but as a kludge we have to tell our caller than an extra linebreak is needed.
+                    if (codeText.startswith('otherwise')):
+                        # stop inline globbing
+                        return [blockIndex, True, None]
+        return [len(childBlocks), False, None]
 
 
+    def calcConditionedBlockSpan(self, headBlock, blockIndex):
+        # return [endIndex, False, errorBlock]
+        childBlocks = headBlock.blocks
+        inlineDepth = 0
+        while (blockIndex<len(childBlocks)-1):
+            blockIndex += 1
+            block = childBlocks[blockIndex]
+            if (block.type=='code'):
+                codeText = block.text
+                if (codeText.startswith('begin(')):
+                    inlineDepth += 1
+                elif (codeText.startswith('end(')):
+                    inlineDepth -= 1
+                    # we allow an $end() without a $begin to mark end of an $inline
+                    if (inlineDepth<-1):
+                        # error
+                        return [blockIndex+1, False, block]
+                    if (inlineDepth==0):
+                        # only when not in ntest do we allow code to break us out otherwise we migrate it
+                        break
+                continue
+            else:
+                break
+        return [blockIndex+1, False, None]
 
 
+    def calcCodeLeadInfoTexts(self, sourceLead, behalfLead):
+        # return [leadInfoText, leadInfoMText] describing the lead for tag use notes
+        if (sourceLead==behalfLead) or (behalfLead is None):
+            leadInfoText = 'lead "{}"'.format(sourceLead.id)
+            leadInfoMText = 'lead "{}"'.format(self.makeTextLinkToLead(sourceLead, None, True, True))
+        else:
+            leadInfoText = 'lead "{}" [copied from "{}"]'.format(behalfLead.id, sourceLead.id)
+            leadInfoMText = 'lead "{}" [copied from "{}"]'.format(self.makeTextLinkToLead(behalfLead, None, True, True), self.makeTextLinkToLead(sourceLead, None, True, True))
+        return [leadInfoText, leadInfoMText]
+# ---------------------------------------------------------------------------
 
 
+# ---------------------------------------------------------------------------
+    def evaluateInsertedLead(self, lead, behalfLead, evaluationOptions):
+        # evaluate a lead for $insertlead() on behalf of another lead; return [text, reportText]
+        # boilerplate leads can be inserted in many places, so when the text of a lead cannot depend on the lead it is inserted into, we evaluate it once
+        # and record its lead effects (tag use notes, mark boxes, mindmap links); later inserts reuse the text and replay the effects for their own behalf lead
+        if (not self.isLeadInsertCacheable(lead)):
+            return self.evaluateHeadBlockTextCode(lead, behalfLead, evaluationOptions)
+        #
+        cacheKey = lead.leadIndex
+        renderIdChangeCount = self.leadRegistry.renderIdChangeCount
+        cacheEntry = self.insertedLeadCache.get(cacheKey)
+        if (cacheEntry is not None) and (cacheEntry[3]==renderIdChangeCount):
+            # replay effects on behalf of this lead (this also logs them, if we are recording for an outer insert)
+            [text, reportText, effectLog, renderIdChangeCount] = cacheEntry
+            for [effectName, sourceLead, effectArgs] in effectLog:
+                self.doLeadEffect(effectName, sourceLead, behalfLead, effectArgs)
+            return [text, reportText]
+
+        # evaluate while recording effects
+        outerLeadEffectLog = self.leadEffectLog
+        effectLog = []
+        self.leadEffectLog = effectLog
+        try:
+            [text, reportText] = self.evaluateHeadBlockTextCode(lead, behalfLead, evaluationOptions)
+        finally:
+            self.leadEffectLog = outerLeadEffectLog
+        if (outerLeadEffectLog is not None):
+            outerLeadEffectLog.extend(effectLog)
+        # links in the text go stale if any render id changed while evaluating
+        if (self.leadRegistry.renderIdChangeCount==renderIdChangeCount):
+            self.insertedLeadCache[cacheKey] = [text, reportText, effectLog, renderIdChangeCount]
+        return [text, reportText]
 
 
+    def isLeadInsertCacheable(self, lead):
+        # true if all code of the lead (and of any leads it inserts) is in self.codeFuncsInsertCacheable
+        leadIndex = lead.leadIndex
+        if (leadIndex in self.insertedLeadCacheable):
+            return self.insertedLeadCacheable[leadIndex]
+        # not cacheable while checking, in case of a (broken) insert loop
+        self.insertedLeadCacheable[leadIndex] = False
+        isCacheable = True
+        headBlock = lead.block
+        childBlocks = headBlock.blocks if ('blocks' in headBlock) else []
+        for block in childBlocks:
+            if (block.type!='code'):
+                continue
+            compiledCode = block.compiledCode
+            if (compiledCode is None):
+                compiledCode = self.compileCodeBlock(block)
+            [handler, funcName, args] = compiledCode
+            if (funcName not in self.codeFuncsInsertCacheable):
+                isCacheable = False
+                break
+            if (funcName=='insertlead'):
+                insertedLead = self.findLeadById(args['leadId'], False)
+                if (insertedLead is None) or (not self.isLeadInsertCacheable(insertedLead)):
+                    isCacheable = False
+                    break
+        self.insertedLeadCacheable[leadIndex] = isCacheable
+        return isCacheable
+# ---------------------------------------------------------------------------
 
 
+# ---------------------------------------------------------------------------
+    def doLeadEffect(self, effectName, sourceLead, behalfLead, effectArgs):
+        # side effects of evaluating code from sourceLead on behalf of behalfLead go through here, by name (see self.leadEffectHandlers)
+        # so that while evaluating for $insertlead() they can be logged, and replayed later on behalf of another lead
+        if (self.leadEffectLog is not None):
+            self.leadEffectLog.append([effectName, sourceLead, effectArgs])
+        self.leadEffectHandlers[effectName](sourceLead, behalfLead, effectArgs)
 
 
+    def applyLeadEffectUseTag(self, sourceLead, behalfLead, effectArgs):
+        [tagDict, msg, block] = effectArgs
+        [leadInfoText, leadInfoMText] = self.calcCodeLeadInfoTexts(sourceLead, behalfLead)
+        tagDict['useCount'] += 1
+        self.appendUseNoteToTagDict(tagDict, msg, leadInfoText, leadInfoMText, block)
 
+    def applyLeadEffectGainTag(self, sourceLead, behalfLead, effectArgs):
+        [tagDict, msg, block] = effectArgs
+        self.applyLeadEffectUseTag(sourceLead, behalfLead, effectArgs)
+        self.tagRegistry.addGainLead(tagDict, behalfLead)
 
+    def applyLeadEffectMarkBox(self, sourceLead, behalfLead, effectArgs):
+        [boxType, amount] = effectArgs
+        self.updateMarkBoxTracker(boxType, amount, behalfLead)
 
+    def applyLeadEffectNoDefaultTime(self, sourceLead, behalfLead, effectArgs):
+        behalfLead.properties['defaultTime'] = False
 
+    def applyLeadEffectGoesToLead(self, sourceLead, behalfLead, effectArgs):
+        [toLead, label, flagInline] = effectArgs
+        self.createMindMapLinkLeadToLead(behalfLead, toLead, label, flagInline)
 
+    def applyLeadEffectProvidesTag(self, sourceLead, behalfLead, effectArgs):
+        [tagDict] = effectArgs
+        self.createMindMapLinkLeadProvidesTag(behalfLead, tagDict)
 
+    def applyLeadEffectChecksTag(self, sourceLead, behalfLead, effectArgs):
+        [tagDict] = effectArgs
+        self.createMindMapLinkLeadChecksTag(behalfLead, tagDict)
 
+    def applyLeadEffectChecksDay(self, sourceLead, behalfLead, effectArgs):
+        [targetId] = effectArgs
+        self.createMindMapLinkLeadChecksDay(behalfLead, targetId)
 
+    def applyLeadEffectNodeLink(self, sourceLead, behalfLead, effectArgs):
+        [flagDirectionFromLead, targetId, linkType, linkLabel, creationMtype, flagCreate] = effectArgs
+        self.createMindMapLinkLeadToFromNode(behalfLead, flagDirectionFromLead, targetId, linkType, linkLabel, creationMtype, flagCreate)
+# ---------------------------------------------------------------------------
 
 
-        # tag use
-        elif (funcName=='definetag'):
-            # we now require pre defining tags before use to catch errors better
-            self.doDefineTag('', args, behalfLead, None, block)
-            resultText = ''
 
+# ---------------------------------------------------------------------------
+    def evaluateCodeFuncEmpty(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # just placeholder
+        return ['', None]
 
-        elif (funcName=='gaintag'):
-            # show someone text that they get a tag
-            [resultText, reportText] = self.doGainTag(args, behalfLead, block, leadInfoText, leadInfoMText, textPositionStyle)
 
-        elif (funcName in ['hastag', 'hasalltags', 'hasanytag', 'requiretag', 'requirealltags', 'requireanytags', 'missingtag','missinganytags','missingalltags', 'mentiontags']):
-            # show someone text that checking a tag
-            [resultText, reportText] = self.doUseTag(args, behalfLead, funcName, codeResult, context, block, leadInfoText, leadInfoMText, textPositionStyle)
+    def evaluateCodeFuncOptions(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # merge in options
+        jsonOptionString = args['json']
+        jsonOptions = json.loads(jsonOptionString)
+        # set the WORKINGDIR options
+        self.jroptionsWorkingDir.mergeRawDataForKey('options', jsonOptions)
+        self.invalidateOptionsSnapshot()
+        # cached $insertlead() text may depend on options
+        self.insertedLeadCache = {}
+        self.optionsChangeCount += 1
+        return ['', None]
+
+
+    def evaluateCodeFuncGoLead(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # replace with a lead's rendered id
+        leadId = args['leadId']
+        mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
+        comeBack = jrfuncs.getDictValueFromTrueFalse(args,'comeback',False)
+        #
+        existingLead = self.findLeadById(leadId, False)
+        if (existingLead is None):
+            self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
+        #
+        if (funcName == 'golead'):
+            linkText = self.makeTextLinkToLead(existingLead, None, False, True)
+            baseText = self.getText('goto') + ' ' + linkText
+        elif (funcName == 'goleadback'):
+            linkText = self.makeTextLinkToLead(existingLead, None, False, True)
+            baseText = self.getText('goto') + ' ' + linkText
+            baseText += ' then return here afterwards.'
+        elif (funcName == 'returnlead'):
+            linkText = self.makeTextLinkToLead(existingLead, None, False, True)
+            baseText = self.getText('returnto') + ' ' + linkText
+        elif (funcName == 'reflead'):
+            linkText = self.makeTextLinkToLead(existingLead, None, False, True)
+            baseText = linkText
+        else:
+            linkText = self.makeTextLinkToLead(existingLead, None, False, False)
+            baseText = linkText
+        #
+        if (comeBack):
+            baseText += ' and then return'
 
+        if (funcName=='returnlead'):
+            flagBoxIt = True
+            #fullLineText = self.getFullLineReturnToMd(False)
+            fullLineText = ''
+        else:
+            flagBoxIt = True
+            fullLineText =  '* '
+            fullLineText = ''
+        baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, fullLineText, True, flagBoxIt, False)
+        resultText = baseText
+        # mindmap
+        mindMapLinkLabel = self.calcMindMapLinkLabelGoesToLead(block, context, mindMapLinkLabel, False)
+        self.doLeadEffect('goesToLead', sourceLead, behalfLead, [existingLead, mindMapLinkLabel, False])
+        # default no autotime on leads that go somewhere
+        self.doLeadEffect('noDefaultTime', sourceLead, behalfLead, [])
+        return [resultText, None]
 
 
+    def evaluateCodeFuncGoFake(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        leadId = self.consumeUnusedLeadId()
+        if (funcName == 'gofake'):
+            linkText = self.makeTextLinkToLeadId(leadId, leadId, None, False, False)
+            baseText = self.getText('goto') + ' ' + linkText
+        elif (funcName == 'gofakeback'):
+            linkText = self.makeTextLinkToLeadId(leadId, leadId, None, False, False)
+            baseText = self.getText('goto') + ' ' + linkText
+            baseText += ' then return here afterwards.'
+        fullLineText =  '* '
+        baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, fullLineText, True, False, False)
+        return [baseText, None]
+
+
+    def evaluateCodeFuncReturnInline(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        behalfLeadProperties = behalfLead.properties
+        # replace with a lead's rendered id
+        leadId = jrfuncs.getDictValueOrDefault(behalfLeadProperties,'inlineSourceLeadId',None)
+        if (leadId is None):
+            self.raiseBlockException(block, 0, 'The $returninline() function can only be used inside an inline lead; otherwise use $returnlead()')
+        mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
+        #
+        existingLead = self.findLeadById(leadId, False)
+        if (existingLead is None):
+            self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
+        #
+        linkText = self.makeTextLinkToLead(existingLead, None, False, True)
+        baseText = self.getText('returnto') + ' ' + linkText
+        #baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, self.getFullLineReturnToMd(False), True, False, False)
+        baseText = self.modifyTextToSuitTextPositionStyle(baseText, textPositionStyle, '', True, True, False)
+        resultText = baseText
+        # mindmap
+        self.createMindMapLinkLeadGoesToLead(block, behalfLead, existingLead, context, mindMapLinkLabel, False)
+        return [resultText, None]
 
 
+    def evaluateCodeFuncDefineTag(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # we now require pre defining tags before use to catch errors better
+        self.doDefineTag('', args, behalfLead, None, block)
+        return ['', None]
 
 
+    def evaluateCodeFuncGainTag(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # show someone text that they get a tag
+        return self.doGainTag(args, sourceLead, behalfLead, block, textPositionStyle)
 
 
+    def evaluateCodeFuncUseTag(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # show someone text that checking a tag
+        return self.doUseTag(args, sourceLead, behalfLead, funcName, codeResult, context, block, textPositionStyle)
 
 
+    def evaluateCodeFuncDay(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # kludge to make condition tag a bit nicer
+        #
+        day = int(args['day'])
+        #
+        # we make it a TAG soley for mindmap graphing and keeping track of use
+        virtualTagNameMap = {'beforeday': 'preday', 'afterday': 'postday', 'onday': 'day'}
+        virtualTagId = 'day.{}_{}'.format(virtualTagNameMap[funcName], day)
+        #
+        # look up tag, do NOT convert to letter
+        tagDict = self.findTag(virtualTagId, behalfLead, block, False, False)
+        if (tagDict is None):
+            # day tags do not have to exist ahead of time, we create them on the fly
+            tagArgs = {'id': virtualTagId, 'relation': funcName, 'day': day}
+            tagDict = self.doDefineTag('', tagArgs, behalfLead, None, block)
+        #
+        # track use
+        if (behalfLead is not None):
+            msg = 'Checking if it is {} {}'.format(funcName, day)
+            self.doLeadEffect('useTag', sourceLead, behalfLead, [tagDict, msg, block])
 
+        # remember tags for a future mindmap
+        context['lastTest'] = {'block': block, 'text': virtualTagId}
 
+        # build output
+        resultText = tagDict['testText']
+        resultText = self.modifyTextToSuitTextPositionStyle(resultText, textPositionStyle, '* ', True, False, False)
 
+        # mindmap
+        self.doLeadEffect('checksDay', sourceLead, behalfLead, [tagDict['id']])
+        return [resultText, None]
 
 
+    def evaluateCodeFuncInline(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        behalfLeadProperties = behalfLead.properties
+        # tricky one, this moves the subsqeuent text blocks into a new dynamically assigned lead and returns the lead #
+        # it is handled by caller not by use
+        #
+        codeResult['action'] = 'inline'
+        codeResult['args'] = jrfuncs.deepCopyListDict(args)
+        #
+        leadTagType = jrfuncs.getDictValueOrDefault(behalfLeadProperties, 'leadTagType','')
+        if (leadTagType=='hint'):
+            # inlines derived from hints to not take up time by default
+            codeResult['args']['defaultTime'] = False
+        #
+        # shortcut
+        if (funcName in ['inlineback', 'inlinehint']):
+            optionDefaultBack = True
+        else:
+            optionDefaultBack = False
+        #
+        back = jrfuncs.getDictValueFromTrueFalse(args, 'back', optionDefaultBack)
+        resume = jrfuncs.getDictValueFromTrueFalse(args, 'resume', False)
+        unless = jrfuncs.getDictValueOrDefault(args, 'unless', None)
+        optionDisableDemeritHours = True
+        demerits = jrfuncs.getDictValueOrDefault(args, 'demerits', None)
+        demeritHours = jrfuncs.getDictValueOrDefault(args, 'demeritHours', None)
+        if (demeritHours is not None) and (demerits is None) and optionDisableDemeritHours:
+            demerits = demeritHours
+            demeritHours = None
+        #
 
+        returnLink = self.makeTextLinkToLead(behalfLead, None, False, True)
+        returnText = ''
+        codeResult['args']['after'] = ''
+        codeResult['inlinePostText'] = ''
+        simplePost = True
 
-        elif (funcName in ['beforeday', 'afterday', 'onday']):
-            # kludge to make condition tag a bit nicer
-            #
-            day = int(args['day'])
+        if (resume):
+            returnText = 'resume searching for leads'
+            codeResult['args']['after'] = 'then resume searching for leads'
+            codeResult['inlinePostText'] = 'resume searching for leads'
+        #
+        if (back):
+            linkText = returnLink
+            if (returnText != ''):
+                returnText += ', then '
+            if (codeResult['args']['after'] != ''):
+                codeResult['args']['after'] += ', '
+            returnText += self.getText('returnto') + ' ' + linkText + '.'
+            codeResult['args']['after'] += 'then return here afterwards.'
+            codeResult['inlinePostText'] += returnText
+
+
+        if (demerits is not None):
+            simplePost = False
+            amount = int(args['demerits'])
+            markType = 'demerit'
             #
-            # we make it a TAG soley for mindmap graphing and keeping track of use
-            virtualTagNameMap = {'beforeday': 'preday', 'afterday': 'postday', 'onday': 'day'}
-            virtualTagId = 'day.{}_{}'.format(virtualTagNameMap[funcName], day)
+            self.updateMarkBoxTracker(markType, amount, behalfLead)
+            markText = self.calcMarkInstructions(markType, amount)
+            if (unless is not None):
+                markText += ' (unless {})'.format(unless)
+            #postMessage = '\n---\n' + jrfuncs.uppercaseFirstLetter(markText)
+            postMessage = jrfuncs.uppercaseFirstLetter(markText)
+            if (codeResult['inlinePostText']!=''):
+                postMessage += ', then '
+            codeResult['inlinePostText'] = postMessage + codeResult['inlinePostText']
+        elif (demeritHours is not None):
+            simplePost = False
+            amount = int(args['demerits'])
+            markType = 'demerit'
             #
-            # look up tag, do NOT convert to letter
-            tagDict = self.findTag(virtualTagId, behalfLead, block, False, False)
-            if (tagDict is None):
-                # day tags do not have to exist ahead of time, we create them on the fly
-                tagArgs = {'id': virtualTagId, 'relation': funcName, 'day': day}
-                tagDict = self.doDefineTag('', tagArgs, behalfLead, None, block)
+            maxDemerits = 12 / amount
+            self.updateMarkBoxTracker(markType, maxDemerits, behalfLead)
+            markText = self.calcMarkHourInstructions(markType, amount)
+            if (unless is not None):
+                markText += ' (unless {})'.format(unless)
+            #postMessage = '\n---\n' + jrfuncs.uppercaseFirstLetter(markText)
+            postMessage = jrfuncs.uppercaseFirstLetter(markText)
+            if (codeResult['inlinePostText']!=''):
+                postMessage += ', then '
+            else:
+                postMessage += '.'
             #
-            # track use
-            if (behalfLead is not None):
-                tagDict['useCount'] += 1
-                msg = 'Checking if it is {} {}'.format(funcName, day)
-                self.appendUseNoteToTagDict(tagDict, msg, leadInfoText, leadInfoMText, block)
+            codeResult['inlinePostText'] = postMessage + codeResult['inlinePostText']
 
-            # remember tags for a future mindmap
-            context['lastTest'] = {'block': block, 'text': virtualTagId}
+        #
+        if (simplePost) and (codeResult['inlinePostText']!=''):
+            #codeResult['inlinePostText'] = self.getFullLineReturnToMd(False) + 'Now '+ codeResult['inlinePostText']
+            codeResult['inlinePostText'] = 'Now '+ codeResult['inlinePostText']
 
-            # build output
-            resultText = tagDict['testText']
-            resultText = self.modifyTextToSuitTextPositionStyle(resultText, textPositionStyle, '* ', True, False, False)
+        # put inlinePostText in box?
+        if (codeResult['inlinePostText']!='') and True:
+            codeResult['inlinePostText'] = r'%boxstartred% ' + codeResult['inlinePostText'] + r' %boxend%' + '\n'
+        return ['', None]
 
-            # mindmap
-            self.createMindMapLinkLeadChecksDay(behalfLead, tagDict['id'])
 
+    def evaluateCodeFuncEndJump(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # tricky one, this moves the subsqeuent text blocks into a new dynamically assigned lead and returns the lead #
+        return ['', None]
 
 
+    def evaluateCodeFuncInsertLead(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # embed contents of a lead here
+        leadId = args['leadId']
+        existingLead = self.findLeadById(leadId, False)
+        if (existingLead is None):
+            self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
+        # this evaluates the lead text on behalf of THIS lead (rather than using its pre-evaluated text, since a lead may be INSERTED before it is evaluated)
+        # so that debug statistics (tag use notes, mark boxes, mindmap links) are credited to this lead; see evaluateInsertedLead for how repeat inserts are cached
+        return self.evaluateInsertedLead(existingLead, behalfLead, evaluationOptions)
 
 
+    def evaluateCodeFuncGetVar(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # insert contents of a lead here
+        varName = args['varName']
+        return self.getUserVariableTuple(varName)
 
 
+    def evaluateCodeFuncSetVar(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # insert contents of a lead here
+        varName = args['varName']
+        varVal = args['value']
+        self.setUserVariable(varName, varVal)
+        return ['', None]
 
 
+    def evaluateCodeFuncMark(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        if (funcName == 'demerits'):
+            markType = 'demerit'
+        else:
+            markType = args['type']
+        if (markType=='demerits'):
+            markType = 'demerit'
+        #if (markType=='demerit'):
+        #    jrprint('DEBUG STOP')
 
+        # insert contents of a lead here
+        amount = int(args['amount']) if ('amount' in args) else 1
+        self.doLeadEffect('markBox', sourceLead, behalfLead, [markType, amount])
+        text = self.calcMarkInstructions(markType, amount)
+        text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '', True, True, True)
+        return [text, None]
 
 
+    def evaluateCodeFuncTime(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        if (funcName == 'otime') or (self.getOptionClockMode()==True):
+            amount = float(args['amount']) if ('amount' in args) else 1
+            text = self.calcTimeAdvanceInstructions(amount, sourceLead, behalfLead, True)
+            text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '', True, True, True)
+        else:
+            text = ''
+        return [text, None]
 
 
-        # ATTN: new attempt to unify as 'inline'
-        #elif (funcName in ['inline', 'inlinedemerit', 'inlineback', 'inlinebacks', 'inlinehint']):
-        elif (funcName in ['inline', 'inlineback', 'inlinehint']):
-            # tricky one, this moves the subsqeuent text blocks into a new dynamically assigned lead and returns the lead #
-            # it is handled by caller not by use
-            #
-            codeResult['action'] = 'inline'
-            codeResult['args'] = jrfuncs.deepCopyListDict(args)
-            #
-            leadTagType = jrfuncs.getDictValueOrDefault(behalfLeadProperties, 'leadTagType','')
-            if (leadTagType=='hint'):
-                # inlines derived from hints to not take up time by default
-                codeResult['args']['defaultTime'] = False
-            #
-            # shortcut
-            if (funcName in ['inlineback', 'inlinehint']):
-                optionDefaultBack = True
+    def evaluateCodeFuncBackDemerit(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # insert contents of a lead here
+        amount = int(args['demerits']) if ('demerits' in args) else 1
+        gotoQuestion = args['goto'] if ('goto' in args) else ''
+        leadId = args['lead'] if ('lead' in args) else None
+        markType = 'demerit'
+        if (leadId is None):
+            goText = 'return to searching for leads'
+        else:
+            goLead = self.findLeadById(leadId, True)
+            if (goLead is None):
+                self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
+            linkText = self.makeTextLinkToLead(goLead, None, False, True)
+            goText = self.getText('goto') + ' ' + linkText
+        #
+        if (amount>0):
+            if (gotoQuestion==''):
+                text = self.calcMarkInstructions(markType, amount) + ' and {}; then resume the questionnaire after you finish.'.format(goText)
             else:
-                optionDefaultBack = False
-            #
-            back = jrfuncs.getDictValueFromTrueFalse(args, 'back', optionDefaultBack)
-            resume = jrfuncs.getDictValueFromTrueFalse(args, 'resume', False)
-            unless = jrfuncs.getDictValueOrDefault(args, 'unless', None)
-            optionDisableDemeritHours = True
-            demerits = jrfuncs.getDictValueOrDefault(args, 'demerits', None)
-            demeritHours = jrfuncs.getDictValueOrDefault(args, 'demeritHours', None)
-            if (demeritHours is not None) and (demerits is None) and optionDisableDemeritHours:
-                demerits = demeritHours
-                demeritHours = None
-            #
-
-            returnLink = self.makeTextLinkToLead(behalfLead, None, False, True)
-            returnText = ''
-            codeResult['args']['after'] = ''
-            codeResult['inlinePostText'] = ''
-            simplePost = True
+                text = self.calcMarkInstructions(markType, amount) + ' and {}, then resume at question "{}" if you can accomplish this; if you need more help continue reading.'.format(goText, gotoQuestion)                
+        else:
+            text = goText
+        #
+        text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '* If not, ', False, False, False)
+        self.doLeadEffect('markBox', sourceLead, behalfLead, [markType, amount])
+        return [text, None]
+
+
+    def evaluateCodeFuncForm(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # insert contents of a lead here
+        typeStr = args['type']
+        shortInputText = '>`____________________________`'
+        if (typeStr=='short'):
+            text = shortInputText
+        elif (typeStr in ['mini', 'score']):
+            text = '_____'
+        elif (typeStr=='long'):
+            text = '>`__________________________________________________`\n'
+        elif (typeStr=='multiline'):
+            oneLine = '>`__________________________________________________`\n'
+            #text = ('    ' + oneLine ) * 6
+            text = oneLine * 6
+        elif (typeStr=='choice'):
+            choices = args['choices'].split(';')
+            text = ''
+            for i,choiceVal in enumerate(choices):
+                choiceVal = choiceVal.strip()
+                text += ' {}. {}\n'.format(i,choiceVal)
+        else:
+            self.raiseBlockException(block, 0, 'Unknown form type: "{}"'.format(typeStr))
+        return [text, None]
 
-            if (resume):
-                returnText = 'resume searching for leads'
-                codeResult['args']['after'] = 'then resume searching for leads'
-                codeResult['inlinePostText'] = 'resume searching for leads'
-            #
-            if (back):
-                linkText = returnLink
-                if (returnText != ''):
-                    returnText += ', then '
-                if (codeResult['args']['after'] != ''):
-                    codeResult['args']['after'] += ', '
-                returnText += self.getText('returnto') + ' ' + linkText + '.'
-                codeResult['args']['after'] += 'then return here afterwards.'
-                codeResult['inlinePostText'] += returnText
-
-
-            if (demerits is not None):
-                simplePost = False
-                amount = int(args['demerits'])
-                markType = 'demerit'
-                #
-                self.updateMarkBoxTracker(markType, amount, behalfLead)
-                markText = self.calcMarkInstructions(markType, amount)
-                if (unless is not None):
-                    markText += ' (unless {})'.format(unless)
-                #postMessage = '\n---\n' + jrfuncs.uppercaseFirstLetter(markText)
-                postMessage = jrfuncs.uppercaseFirstLetter(markText)
-                if (codeResult['inlinePostText']!=''):
-                    postMessage += ', then '
-                codeResult['inlinePostText'] = postMessage + codeResult['inlinePostText']
-            elif (demeritHours is not None):
-                simplePost = False
-                amount = int(args['demerits'])
-                markType = 'demerit'
-                #
-                maxDemerits = 12 / amount
-                self.updateMarkBoxTracker(markType, maxDemerits, behalfLead)
-                markText = self.calcMarkHourInstructions(markType, amount)
-                if (unless is not None):
-                    markText += ' (unless {})'.format(unless)
-                #postMessage = '\n---\n' + jrfuncs.uppercaseFirstLetter(markText)
-                postMessage = jrfuncs.uppercaseFirstLetter(markText)
-                if (codeResult['inlinePostText']!=''):
-                    postMessage += ', then '
-                else:
-                    postMessage += '.'
-                #
-                codeResult['inlinePostText'] = postMessage + codeResult['inlinePostText']
 
-            #
-            if (simplePost) and (codeResult['inlinePostText']!=''):
-                #codeResult['inlinePostText'] = self.getFullLineReturnToMd(False) + 'Now '+ codeResult['inlinePostText']
-                codeResult['inlinePostText'] = 'Now '+ codeResult['inlinePostText']
+    def evaluateCodeFuncReport(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # just a comment to show in the report only
+        return ['', '**REPORT NOTE**: {}'.format(args['comment'])]
 
-            # put inlinePostText in box?
-            if (codeResult['inlinePostText']!='') and True:
-                codeResult['inlinePostText'] = r'%boxstartred% ' + codeResult['inlinePostText'] + r' %boxend%' + '\n'
 
+    def evaluateCodeFuncOtherwise(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        text = 'Otherwise'
 
+        # remember tags for a future mindmap
+        context['lastTest'] = {'block': block, 'text': 'otherwise'}
 
-        elif (funcName=='endjump'):
-            # tricky one, this moves the subsqeuent text blocks into a new dynamically assigned lead and returns the lead #
-            pass
+        text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '* ', True, False, False)
+        return [text, None]
 
-        elif (funcName=='insertlead'):
-            # embed contents of a lead here
-            leadId = args['leadId']
-            existingLead = self.findLeadById(leadId, False)
-            if (existingLead is None):
-                self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
-            # ATTN: this RE-EVALUATES the lead text, but it would probably be better to use pre-evaluated text; the only problem is if a lead is INSERTED before it is defined
-            # we COULD throw an error in this case (bad), or instead defer evaluation until later by doing this in two passes?
-            # the one thing that could get messed up by this is any debug statistics and reporting that may get confused by us calling this on behalf of another lead
-            # for example, our stats of recording when a tag is used will be confused into thinking the inserted lead used a tag twice instead of THIS lea
-            [resultText, reportText] = self.evaluateHeadBlockTextCode(existingLead, behalfLead, evaluationOptions)
-
-        elif (funcName=='get'):
-            # insert contents of a lead here
-            varName = args['varName']
-            [resultText, reportText] = self.getUserVariableTuple(varName)
-
-        elif (funcName=='set'):
-            # insert contents of a lead here
-            varName = args['varName']
-            varVal = args['value']
-            self.setUserVariable(varName, varVal)
-
-        elif (funcName in ['mark']):
-            if (funcName == 'demerits'):
-                markType = 'demerit'
-            else:
-                markType = args['type']
-            if (markType=='demerits'):
-                markType = 'demerit'
-            #if (markType=='demerit'):
-            #    jrprint('DEBUG STOP')
 
-            # insert contents of a lead here
-            amount = int(args['amount']) if ('amount' in args) else 1
-            self.updateMarkBoxTracker(markType, amount, behalfLead)
-            text = self.calcMarkInstructions(markType, amount)
-            text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '', True, True, True)
-            resultText = text
+    def evaluateCodeFuncLogicMentions(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        target = args['target']
+        # mindmap
+        mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
+        linkType = funcName
+        linkType = linkType.replace('logic','')
+        self.doLeadEffect('nodeLink', sourceLead, behalfLead, [True, target, linkType, mindMapLinkLabel, None, False])
+        return ['', None]
 
 
-        elif (funcName in ['time','otime']):
-            if (funcName == 'otime') or (self.getOptionClockMode()==True):
-                amount = float(args['amount']) if ('amount' in args) else 1
-                text = self.calcTimeAdvanceInstructions(amount, behalfLead, True)
-                text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '', True, True, True)
-            else:
-                text = ''
-            resultText = text
+    def evaluateCodeFuncLogicMentionedBy(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        target = args['target']
+        # mindmap
+        mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
+        linkType = funcName
+        if (linkType=='logicimpliedby'):
+            linkType = 'implies'
+        else:
+            linkType = linkType.replace('logic','')
+            linkType = linkType.replace('edby','s')
+        self.doLeadEffect('nodeLink', sourceLead, behalfLead, [False, target, linkType, mindMapLinkLabel, None, False])
+        return ['', None]
 
 
-        elif (funcName=='backdemerit'):
-            # insert contents of a lead here
-            amount = int(args['demerits']) if ('demerits' in args) else 1
-            gotoQuestion = args['goto'] if ('goto' in args) else ''
-            leadId = args['lead'] if ('lead' in args) else None
-            markType = 'demerit'
-            if (leadId is None):
-                goText = 'return to searching for leads'
-            else:
-                goLead = self.findLeadById(leadId, True)
-                if (goLead is None):
-                    self.raiseBlockException(block, 0, 'Unknown lead reference: "{}"'.format(leadId))
-                linkText = self.makeTextLinkToLead(goLead, None, False, True)
-                goText = self.getText('goto') + ' ' + linkText
-            #
-            if (amount>0):
-                if (gotoQuestion==''):
-                    text = self.calcMarkInstructions(markType, amount) + ' and {}; then resume the questionnaire after you finish.'.format(goText)
-                else:
-                    text = self.calcMarkInstructions(markType, amount) + ' and {}, then resume at question "{}" if you can accomplish this; if you need more help continue reading.'.format(goText, gotoQuestion)                
-            else:
-                text = goText
-            #
-            text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '* If not, ', False, False, False)
-            self.updateMarkBoxTracker(markType, amount, behalfLead)
-            resultText = text
-
-
-
-
-        elif (funcName=='form'):
-            # insert contents of a lead here
-            typeStr = args['type']
-            shortInputText = '>`____________________________`'
-            if (typeStr=='short'):
-                text = shortInputText
-            elif (typeStr in ['mini', 'score']):
-                text = '_____'
-            elif (typeStr=='long'):
-                text = '>`__________________________________________________`\n'
-            elif (typeStr=='multiline'):
-                oneLine = '>`__________________________________________________`\n'
-                #text = ('    ' + oneLine ) * 6
-                text = oneLine * 6
-            elif (typeStr=='choice'):
-                choices = args['choices'].split(';')
-                text = ''
-                for i,choiceVal in enumerate(choices):
-                    choiceVal = choiceVal.strip()
-                    text += ' {}. {}\n'.format(i,choiceVal)
-            else:
-                self.raiseBlockException(block, 0, 'Unknown form type: "{}"'.format(typeStr))
-            resultText = text
+    def evaluateCodeFuncLogicIdea(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        name = args['name']
+        # mindmap
+        mindMapNodeLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
+        self.createMindMapNode(name, 'idea', mindMapNodeLabel, True, behalfLead)
+        return ['', None]
 
-        elif (funcName=='report'):
-            # just a comment to show in the report only
-            reportText = '**REPORT NOTE**: {}'.format(args['comment'])
 
-        elif (funcName=='otherwise'):
-            text = 'Otherwise'
+    def evaluateCodeFuncLogicAb(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        behalfLeadId = behalfLead.id
+        a = args['a']
+        b = jrfuncs.getDictValueOrDefault(args,'b',None)
+        if (b is None):
+            b = behalfLeadId
+        # mindmap
+        mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
+        if (funcName=='logicaba'):
+            self.createMindMapLinkFromBidirectionNodesNodeGeneric(a, b, mindMapLinkLabel, behalfLead)
+        else:
+            self.createMindMapLinkFromNodeToNodeNodeGeneric(a, b, mindMapLinkLabel, behalfLead)
+        return ['', None]
 
-            # remember tags for a future mindmap
-            context['lastTest'] = {'block': block, 'text': 'otherwise'}
 
-            text = self.modifyTextToSuitTextPositionStyle(text, textPositionStyle, '* ', True, False, False)
-            resultText = text
+    def evaluateCodeFuncLogicIrrelevant(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # mindmap
+        self.annotateMindMapLeadNode(behalfLead, {'relevance': -1})
+        return ['', None]
 
 
-        # logic funcs
+    def evaluateCodeFuncOnlyOnce(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        return ['**NOTE:** You may only visit this lead once; you may not return here to take a different path.', None]
 
-        elif (funcName in ['logicmentions', 'logicimplies', 'logicsuggests']):
-            target = args['target']
-            # mindmap
-            mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
-            linkType = funcName
-            linkType = linkType.replace('logic','')
-            self.createMindMapLinkLeadToNodeGeneric(behalfLead, target, linkType, mindMapLinkLabel)
-            resultText = ''
 
-        elif (funcName in ['logicmentionedby', 'logicimpliedby', 'logicsuggestedby']):
-            target = args['target']
-            # mindmap
-            mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
-            linkType = funcName
-            if (linkType=='logicimpliedby'):
-                linkType = 'implies'
-            else:
-                linkType = linkType.replace('logic','')
-                linkType = linkType.replace('edby','s')
-            self.createMindMapLinkLeadFromNodeGeneric(behalfLead, target, linkType, mindMapLinkLabel)
-            resultText = ''
+    def evaluateCodeFuncWarning(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        msg = args['msg']
+        plainText = msg + '; in lead {} from {} around line {}.'.format(behalfLead.id, block.sourceLabel, block.lineNumber)
+        self.addWarning(plainText)
+        return ['', None]
 
-        elif (funcName == 'logicidea'):
-            name = args['name']
-            # mindmap
-            mindMapNodeLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
-            self.createMindMapNode(name, 'idea', mindMapNodeLabel, True, behalfLead)
-            resultText = ''
-
-        elif (funcName in ['logicab', 'logicaba']):
-            a = args['a']
-            b = jrfuncs.getDictValueOrDefault(args,'b',None)
-            if (b is None):
-                b = behalfLeadId
-            # mindmap
-            mindMapLinkLabel = jrfuncs.getDictValueOrDefault(args,'link',None)
-            if (funcName=='logicaba'):
-                self.createMindMapLinkFromBidirectionNodesNodeGeneric(a, b, mindMapLinkLabel, behalfLead)
-            else:
-                self.createMindMapLinkFromNodeToNodeNodeGeneric(a, b, mindMapLinkLabel, behalfLead)
-            resultText = ''
 
-        elif (funcName == 'logicirrelevant'):
-            # mindmap
-            self.annotateMindMapLeadNode(behalfLead, {'relevance': -1})
-            resultText = ''
-
-        elif (funcName == 'onlyonce'):
-            resultText = '**NOTE:** You may only visit this lead once; you may not return here to take a different path.'
-
-        elif (funcName == 'warning'):
-            msg = args['msg']
-            plainText = msg + '; in lead {} from {} around line {}.'.format(behalfLead['id'], block['sourceLabel'], block['lineNumber'])
-            self.addWarning(plainText)
-
-        elif (funcName == 'remind'):
-            reminderType = args['type']
-            if (reminderType=='turnPageSolo'):
-                if False and (self.isLeadContextSectionStyleSolo(behalfLead, context)):
-                    text = '*Turn the page...*\n'
-                    text += '%pagebreak%\n'
-                else:
-                    text = ''
-            elif (reminderType=='restBreak'):
-                text = self.getText('restbreak') + '\n'
+    def evaluateCodeFuncRemind(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        reminderType = args['type']
+        if (reminderType=='turnPageSolo'):
+            if False and (self.isLeadContextSectionStyleSolo(behalfLead, context)):
+                text = '*Turn the page...*\n'
                 text += '%pagebreak%\n'
-            elif (reminderType in ['allyHelp', 'allyHelp3pm']):
-                text = "\n%Symbol.Hand%Note: There are specific hints available for each of the the day's required items (see index).  However, if you need guidance on where to focus your efforts on any given day, you can drop by your old police precinct in the Financial District for some advice"
-                if (reminderType == 'allyHelp3pm'):
-                    text += ' (if you arrive between 3pm-4pm you can catch the chief on his break and get his advice for free).\n'
-                else:
-                    text += '.\n'
-
-            elif (reminderType=='overtimeScore'):
-                isClockModeEnabled = self.getOptionClockMode()
-                if (isClockModeEnabled):
-                    text = 'Subtract **3** points for every day you went into overtime'
-                else:
-                    text = 'Subtract **1** point for every 10 overtime you accumulated (rounded down)'
             else:
-                self.raiseBlockException(block, 0, 'Unknown reminder type in $remind(type=?)')
-            resultText = text
-
-        elif (funcName == 'autohint'):
-            # this assume we are in a hint lead, and we want to 
-            # autohint is used within a hint, to auto link as a last resort to the lead(s) where the hint is assigned
-            hintLeadList = self.buildHintLeadListForTag(behalfLead, block)          
-            if (len(hintLeadList)==0):
-                resultText = 'There are no more hints available for this item.\n'
+                text = ''
+        elif (reminderType=='restBreak'):
+            text = self.getText('restbreak') + '\n'
+            text += '%pagebreak%\n'
+        elif (reminderType in ['allyHelp', 'allyHelp3pm']):
+            text = "\n%Symbol.Hand%Note: There are specific hints available for each of the the day's required items (see index).  However, if you need guidance on where to focus your efforts on any given day, you can drop by your old police precinct in the Financial District for some advice"
+            if (reminderType == 'allyHelp3pm'):
+                text += ' (if you arrive between 3pm-4pm you can catch the chief on his break and get his advice for free).\n'
             else:
-                amount = int(args['amount']) if ('amount' in args) else 3
-                markType = 'demerit'
-                self.updateMarkBoxTracker(markType, amount, behalfLead)
-                markText = self.calcMarkInstructions(markType, amount)
-                #
-                if (len(hintLeadList)==1):
-                    resultText = '%solo.VerticalSpace%\n---\nAs a last resort, if you cannot figure out how to find it, ' + markText + ', then visit ' + hintLeadList[0] + '\n'
-                else:
-                    resultText = '%solo.VerticalSpace%\n---\nAs a last resort, if you cannot figure out how to find it, ' + markText + ', then visit one more more of the following:\n'
-                    for line in hintLeadList:
-                        resultText += ' * ' + line + '\n'
-                # for link
-                context['lastTest'] = {'block': block, 'text': 'autohint'}
+                text += '.\n'
+
+        elif (reminderType=='overtimeScore'):
+            isClockModeEnabled = self.getOptionClockMode()
+            if (isClockModeEnabled):
+                text = 'Subtract **3** points for every day you went into overtime'
+            else:
+                text = 'Subtract **1** point for every 10 overtime you accumulated (rounded down)'
+        else:
+            self.raiseBlockException(block, 0, 'Unknown reminder type in $remind(type=?)')
+        return [text, None]
 
-        elif (funcName == 'deadlineinfo'):
-            # this assume we are in a hint lead, and we want to 
-            [resultText, reportText] = self.doDeadlineInfo(args)
 
+    def evaluateCodeFuncAutoHint(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # this assume we are in a hint lead, and we want to 
+        # autohint is used within a hint, to auto link as a last resort to the lead(s) where the hint is assigned
+        hintLeadList = self.buildHintLeadListForTag(behalfLead, block)          
+        if (len(hintLeadList)==0):
+            resultText = 'There are no more hints available for this item.\n'
+        else:
+            amount = int(args['amount']) if ('amount' in args) else 3
+            markType = 'demerit'
+            self.updateMarkBoxTracker(markType, amount, behalfLead)
+            markText = self.calcMarkInstructions(markType, amount)
+            #
+            if (len(hintLeadList)==1):
+                resultText = '%solo.VerticalSpace%\n---\nAs a last resort, if you cannot figure out how to find it, ' + markText + ', then visit ' + hintLeadList[0] + '\n'
+            else:
+                resultText = '%solo.VerticalSpace%\n---\nAs a last resort, if you cannot figure out how to find it, ' + markText + ', then visit one more more of the following:\n'
+                for line in hintLeadList:
+                    resultText += ' * ' + line + '\n'
+            # for link
+            context['lastTest'] = {'block': block, 'text': 'autohint'}
+        return [resultText, None]
 
-        elif (funcName == 'ifcond'):
-            conditionVal = True
-            condition = args['condition']
-            if (condition=='clocked'):
-                conditionVal = self.getOptionClockMode()
-            codeResult['action'] = 'conditioned'
-            codeResult['args'] = {'conditionVal': conditionVal}
 
-        elif (funcName == 'include'):
-            filePath = args['file']
-            resultText = self.includeUserFile(filePath)
+    def evaluateCodeFuncDeadlineInfo(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # this assume we are in a hint lead, and we want to 
+        return self.doDeadlineInfo(args)
 
 
-        elif (funcName in ['begin', 'end']):
-            # these do nothing and are only used for inlining
-            resultText = ''
+    def evaluateCodeFuncIfCond(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        conditionVal = True
+        condition = args['condition']
+        if (condition=='clocked'):
+            conditionVal = self.getOptionClockMode()
+        codeResult['action'] = 'conditioned'
+        codeResult['args'] = {'conditionVal': conditionVal}
+        return ['', None]
 
 
-        else:
-            # debug
-            dbgObj = {'funcName': funcName, 'args': args, 'pos': pos}
-            text = json.dumps(dbgObj)
-            resultText = text
-            msg = 'Syntax error; code function not understood: {}'.format(text)
-            if (True):
-                self.raiseBlockException(block, 0, msg)
-            else:
-                self.addWarning('WARNING: ' + msg)
+    def evaluateCodeFuncInclude(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        filePath = args['file']
+        return [self.includeUserFile(filePath), None]
 
-        # store results
-        codeResult['text'] = resultText
-        if (reportText is None):
-            reportText = resultText
-        codeResult['reportText'] = reportText
 
-        return codeResult
+    def evaluateCodeFuncBeginEnd(self, funcName, args, block, sourceLead, behalfLead, textPositionStyle, evaluationOptions, context, codeResult):
+        # these do nothing and are only used for inlining
+        return ['', None]
 # ---------------------------------------------------------------------------
 
 
@@ -3315,7 +4479,7 @@ class HlParser:
 # ---------------------------------------------------------------------------
 
 # ---------------------------------------------------------------------------
-    def calcTimeAdvanceInstructions(self, amount, lead, unitsFlag):
+    def calcTimeAdvanceInstructions(self, amount, sourceLead, lead, unitsFlag):
         if (amount==0):
             text = '%Symbol.Clock%  Time does not advance'
             return text
@@ -3323,7 +4487,7 @@ class HlParser:
         if (not isClockModeEnabled):
             # overtime marks
             markType = 'overtime'
-            self.updateMarkBoxTracker(markType, amount, lead)
+            self.doLeadEffect('markBox', sourceLead, lead, [markType, amount])
             text = self.calcMarkInstructions(markType, amount)
             return text
         # clock mode!
@@ -3348,11 +4512,11 @@ class HlParser:
 
 
     def getOptionClockMode(self):
-        return self.getOptionValThrowException('clockMode')
+        return self.getOptionsSnapshot().getThrowException('clockMode')
     def getOptionClockTimeStep(self):
-        return self.getOptionValThrowException('clockTimeStep')
+        return self.getOptionsSnapshot().getNumberThrowException('clockTimeStep')
     def getOptionClockTimeDefaultLead(self):
-        return self.getOptionValThrowException('clockTimeDefaultLead')
+        return self.getOptionsSnapshot().getNumberThrowException('clockTimeDefaultLead')
 # ---------------------------------------------------------------------------
 
 
@@ -3482,7 +4646,7 @@ class HlParser:
         countAllLeads = 0
         for lead in self.leads:
             countAllLeads += 1
-            leadProprties = lead['properties']
+            leadProprties = lead.properties
             #
             leadId = leadProprties['id']
             #
@@ -3624,7 +4788,7 @@ class HlParser:
         optionMakeNeighborHoodLinks = False
 
         if (optionMakeNeighborHoodLinks):
-            existingLeadRow = lead['existingLeadRow']
+            existingLeadRow = lead.existingLeadRow
             if (existingLeadRow is not None):
                 jregion = existingLeadRow['properties']['jregion']
                 jregionMindMapNode = self.createMindMapJregionNodeIfNeeded(jregion)
@@ -3663,16 +4827,16 @@ class HlParser:
         # find the node
         mindMapLeadNode = self.findMindMapNodeByLead(lead)
         if (mindMapLeadNode is None):
-            self.raiseBlockException(lead['block'], 0, 'Failed to find mindmap node for lead.')
+            self.raiseBlockException(lead.block, 0, 'Failed to find mindmap node for lead.')
         return self.mindMap.annotateNode(mindMapLeadNode, attributes)
 # ---------------------------------------------------------------------------
 
 
 # ---------------------------------------------------------------------------
     def createMindMapLeadNode(self, lead, mapStyle):
-        leadProperties = lead['properties']
+        leadProperties = lead.properties
         # add mindmap node
-        id = lead['id']
+        id = lead.id
         nprops = {}
         nprops['renderId'] = leadProperties['renderId']
         nprops['label'] = self.calcNiceLeadMindmapLabel(lead)
@@ -3709,21 +4873,28 @@ class HlParser:
     # creating links with code
 
     def createMindMapLinkLeadGoesToLead(self, curBlock, fromLead, toLead, context, mindMapLinkLabel, flagInline):
+        label = self.calcMindMapLinkLabelGoesToLead(curBlock, context, mindMapLinkLabel, flagInline)
+        self.createMindMapLinkLeadToLead(fromLead, toLead, label, flagInline)
+
+
+    def calcMindMapLinkLabelGoesToLead(self, curBlock, context, mindMapLinkLabel, flagInline):
+        defaultLabel = 'inlines' if (flagInline) else 'goesto'
+        if (mindMapLinkLabel is not None):
+            return mindMapLinkLabel
+        return self.getRecentTestFromContextOrBlank(curBlock, context, defaultLabel)
+
+
+    def createMindMapLinkLeadToLead(self, fromLead, toLead, label, flagInline):
         fromNode = self.findMindMapNodeByLead(fromLead)
         toNode = self.findMindMapNodeByLead(toLead)
         #
-        defaultLabel = 'inlines' if (flagInline) else 'goesto'
-        if (mindMapLinkLabel is not None):
-            label = mindMapLinkLabel
-        else:
-            label = self.getRecentTestFromContextOrBlank(curBlock, context, defaultLabel)
         linkProps = {'mtype': 'goto', 'inline': flagInline, 'label': label}
         link = self.mindMap.createLink(fromNode, toNode, linkProps)
         self.mindMap.addLink(link)
 
 
     def findMindMapNodeByLead(self, lead):
-        id = lead['id']
+        id = lead.id
         return self.mindMap.findNodeById(id)
 
 
@@ -3807,7 +4978,7 @@ class HlParser:
     def createMindMapNode(self, idstr, creationMtype, creationLabel, flagThrowExceptionIfExists, fromLead):
         node = self.mindMap.findNodeById(idstr)
         if (node is None):
-            node = self.mindMap.findNodeById(self.canonicalLeadId(idstr))
+            node = self.mindMap.findNodeById(LeadId.get(idstr).canonical)
         if (node is not None):
             if (flagThrowExceptionIfExists):
                 raise Exception('Trying to create mind map node by id {} but it already exists.')
@@ -3822,7 +4993,7 @@ class HlParser:
     def findCreateMapMapNodeOrIdeaByNameFlexibly(self, idstr, creationMtype, creationLabel, flagCreate, sourceLead):
         node = self.mindMap.findNodeById(idstr)
         if (node is None):
-            node = self.mindMap.findNodeById(self.canonicalLeadId(idstr))
+            node = self.mindMap.findNodeById(LeadId.get(idstr).canonical)
         if (node is None):
             node = self.mindMap.findNodeById(idstr)
         if (node is None):
@@ -3935,8 +5106,8 @@ class HlParser:
 # ---------------------------------------------------------------------------
     def calcNiceLeadMindmapLabel(self, lead):
         flagShortenContd = True
-        id = lead['id']
-        leadProperties = lead['properties']
+        id = lead.id
+        leadProperties = lead.properties
         label = leadProperties['label']
         if (label is None) or (label==''):
             retLabel = id
@@ -3996,6 +5167,103 @@ class HlParser:
 
 
 
+# ---------------------------------------------------------------------------
+    def testTokenizerDifferential(self):
+        # run the legacy and fast story tokenizers over every story file (plus some edge case snippets) and diff the resulting block trees and parse errors
+        # the fast tokenizer is also checked when fed the text in small chunks, and on the story files when streamed from disk
+        jrprint('Tokenizer differential test..')
+        storyDirectoriesList = self.getOptionValThrowException("storyDirectories")
+        for storyDir in storyDirectoriesList:
+            self.findStoryFilesFromDir(storyDir)
+        encoding = self.getOptionValThrowException('storyFileEncoding')
+        #
+        corpus = []
+        for storyFilePath in self.storyFileList:
+            fileText = jrfuncs.loadTxtFromFile(storyFilePath, True, encoding)
+            corpus.append(['FILE "{}"'.format(storyFilePath), '# comments\n' + fileText, storyFilePath])
+        for index, snippet in enumerate(tokenizerTestSnippets):
+            corpus.append(['SNIPPET #{}'.format(index+1), snippet, None])
+        #
+        failCount = 0
+        for [sourceLabel, text, storyFilePath] in corpus:
+            difference = self.calcTokenizerDifference(text, sourceLabel, storyFilePath)
+            if (difference is None):
+                jrprint('  OK: {}.'.format(sourceLabel))
+            else:
+                failCount += 1
+                jrprint('  MISMATCH: {}: {}'.format(sourceLabel, difference))
+        #
+        jrprint('Tokenizer differential test finished: {} of {} sources differ.'.format(failCount, len(corpus)))
+        return (failCount==0)
+
+
+    def calcTokenizerDifference(self, text, sourceLabel, storyFilePath=None):
+        # return a description of the first difference between the legacy and fast tokenizers on text (whole, in small chunks, and streamed from storyFilePath if given), or None if they agree
+        parseCacheEnabled = self.parseCacheEnabled
+        self.parseCacheEnabled = False
+        try:
+            resultLegacy = self.calcTokenizerResultForTest(self.tokenizeStoryTextLegacy, text, sourceLabel)
+            resultFast = self.calcTokenizerResultForTest(self.tokenizeStoryText, text, sourceLabel)
+            difference = self.calcFirstDifference(resultLegacy, resultFast, '')
+            if (difference is None):
+                resultChunked = self.calcTokenizerResultForTest(self.tokenizeStoryTextInSmallChunks, text, sourceLabel)
+                difference = self.calcFirstDifference(resultFast, resultChunked, 'chunked')
+            if (difference is None) and (storyFilePath is not None):
+                resultStreamed = self.calcTokenizerResultForTest(lambda text, sourceLabel: self.loadStoryFileBlocksStreaming(storyFilePath), text, sourceLabel)
+                difference = self.calcFirstDifference(resultFast, resultStreamed, 'streamed')
+        finally:
+            self.parseCacheEnabled = parseCacheEnabled
+        return difference
+
+
+    def tokenizeStoryTextInSmallChunks(self, text, sourceLabel):
+        # exercise the chunked path used by loadStoryFileBlocksStreaming with chunks small enough to split every kind of token
+        textChunks = [text[pos:pos+7] for pos in range(0, len(text), 7)]
+        return self.tokenizeStoryTextChunks(self.iteratePreparedStoryTextChunks(textChunks, sourceLabel), sourceLabel)
+
+
+    def calcTokenizerResultForTest(self, tokenizerFunc, text, sourceLabel):
+        try:
+            headBlocks = tokenizerFunc(text, sourceLabel)
+        except Exception as e:
+            return {'error': str(e)}
+        return {'blocks': headBlocks}
+
+
+    def calcFirstDifference(self, a, b, path):
+        # return a description of the first place two json-like structures differ, or None if they are the same
+        if (isinstance(a, hlblocks.DictCompatRecord)) and (isinstance(b, hlblocks.DictCompatRecord)) and (type(a) == type(b)):
+            [a, b] = [a.toDict(), b.toDict()]
+        if (type(a) != type(b)):
+            return '{}: type {} vs {}'.format(path, type(a).__name__, type(b).__name__)
+        if (isinstance(a, dict)):
+            for key in a:
+                if (key not in b):
+                    return '{}.{}: missing in second'.format(path, key)
+                difference = self.calcFirstDifference(a[key], b[key], '{}.{}'.format(path, key))
+                if (difference is not None):
+                    return difference
+            for key in b:
+                if (key not in a):
+                    return '{}.{}: missing in first'.format(path, key)
+            return None
+        if (isinstance(a, list)):
+            for index in range(min(len(a), len(b))):
+                difference = self.calcFirstDifference(a[index], b[index], '{}[{}]'.format(path, index))
+                if (difference is not None):
+                    return difference
+            if (len(a) != len(b)):
+                return '{}: length {} vs {}'.format(path, len(a), len(b))
+            return None
+        if (a != b):
+            return '{}: {} vs {}'.format(path, repr(a)[0:80], repr(b)[0:80])
+        return None
+# ---------------------------------------------------------------------------
+
+
+
+
+
 # ---------------------------------------------------------------------------
     def testMakeReferenceGuide(self):
         title = 'ResearchGuide'
@@ -4148,7 +5416,7 @@ class HlParser:
         newHeadBlock = self.makeBlockHeader(leadId, sourceLabel, 0, 'lead')
         self.addHeadBlock(newHeadBlock)
 
-        properties = newHeadBlock['properties']
+        properties = newHeadBlock.properties
         properties['renderId'] = leadId
         properties['sectionName'] = self.makeSectionNameForHeadBlock(newHeadBlock, leadId, leadId)
         properties['autoid'] = False
@@ -4159,12 +5427,12 @@ class HlParser:
         properties['time'] = 'none'
 
         # ok ADD the new lead by copying values from block
-        lead = {'id': self.canonicalLeadId(leadId), 'block': newHeadBlock, 'properties': properties, 'text': '', 'sourceLabel': newHeadBlock['sourceLabel'], 'lineNumber': newHeadBlock['lineNumber']}
+        lead = self.makeLead(leadId, newHeadBlock, properties, '')
         self.addLead(lead)
 
         # add text
         curTextBlock = self.makeBlockText(sourceLabel, 0)
-        curTextBlock['text'] = text
+        curTextBlock.text = text
         self.addChildBlock(newHeadBlock, curTextBlock)
 # ---------------------------------------------------------------------------
 
@@ -4290,11 +5558,57 @@ class HlParser:
         renderOptions = self.getOptionValThrowException('renderOptions')
         self.renderLeads({'suffix':'', 'mode': 'normal'})
         if (jrfuncs.getDictValueOrDefault(renderOptions, 'renderReport', False)):
+            if (not self.reportTextEnabled):
+                self.buildDeferredReportTexts()
             self.renderLeads({'suffix':'Report', 'mode': 'report', 'format': 'latex'})
         if (jrfuncs.getDictValueOrDefault(renderOptions, 'renderSummary', False)):
             self.renderLeads({'suffix':'Summary', 'mode': 'normal', 'leadList': ['summary|cover']})
 
 
+    def calcIsReportTextNeeded(self):
+        # report text is used by the Report variant of renderLeadsDual, and is saved with each lead in leadsout.json unless the saveLeadReportText option is turned off
+        if (self.reportTextForced):
+            return True
+        if (self.getOptionVal('saveLeadReportText', True)):
+            return True
+        renderOptions = self.getOptionValThrowException('renderOptions')
+        return jrfuncs.getDictValueOrDefault(renderOptions, 'renderReport', False)
+
+
+    def buildDeferredReportTexts(self):
+        # report rendering was turned on (by story code) after leads were evaluated without report text, so we build it now
+        # evaluation has side effects (tags, mark boxes, mindmap links, dynamic lead ids) that must not happen twice, so rather than re-evaluating our own leads
+        # we evaluate the story again in a fresh parser with report text on, starting from the same random state, and take the report text of each lead from it
+        jrprint('Building report text for {} leads (report rendering was turned on after leads were evaluated)..'.format(len(self.leads)))
+        reportParser = HlParser(self.optionsDirPath, self.overrideOptions)
+        reportParser.mergeOverrideOptions(self.commandlineOverrideOptions)
+        reportParser.storyParseJobCount = self.storyParseJobCount
+        reportParser.leadEvaluationJobCount = self.leadEvaluationJobCount
+        reportParser.parseCacheEnabled = self.parseCacheEnabled
+        reportParser.reportTextForced = True
+        randomState = random.getstate()
+        if (self.randomStateAtRunStart is not None):
+            random.setstate(self.randomStateAtRunStart)
+        # its log would just repeat ours
+        jrfuncs.jrprintCaptureStart()
+        try:
+            reportParser.loadStoryFilesIntoBlocks()
+            reportParser.processHeadBlocks()
+            reportParser.addZeroLeadWarning()
+            reportParser.createCommonMindMapNodes()
+            reportParser.processLeads()
+        finally:
+            jrfuncs.jrprintCaptureEnd()
+            random.setstate(randomState)
+        #
+        if ([lead.id for lead in reportParser.leads] != [lead.id for lead in self.leads]):
+            raise Exception('Leads evaluated for report text do not match the leads of this build.')
+        for [lead, reportLead] in zip(self.leads, reportParser.leads):
+            lead.reportText = reportLead.reportText
+        self.reportTextEnabled = True
+        self.addReportLogicLinks()
+
+
     def renderLeads(self, leadOutputOptions):
         # options
         renderOptions = self.getOptionValThrowException('renderOptions')
@@ -4488,7 +5802,7 @@ class HlParser:
 
         # iterate leads
         for leadid, lead in leads.items():
-            leadProperties = lead['properties']
+            leadProperties = lead.properties
             flagRender = leadProperties['render'] if ('render' in leadProperties) else True
             if (flagRender=='false') or (flagRender==False):
                 continue
@@ -4562,7 +5876,7 @@ class HlParser:
         cleanPageOption = jrfuncs.getDictValueOrDefault(section, 'cleanPage', False)
         #
         if (True):
-            leadProperties = lead['properties']
+            leadProperties = lead.properties
             id = leadProperties['id']
             renderId = leadProperties['renderId']
             leadTagType = jrfuncs.getDictValueOrDefault(leadProperties, 'leadTagType','')
@@ -4598,9 +5912,9 @@ class HlParser:
 
             # what content are we outputting, normal text or report text (annotated for author)?
             if (outMode=='normal'):
-                leadText += lead['text']
+                leadText += lead.text
             elif (outMode=='report'):
-                leadText += lead['reportText']
+                leadText += lead.reportText
             else:
                 raise Exception('Unknown lead output mode, should be normal|report')
 
@@ -4612,7 +5926,7 @@ class HlParser:
             hasExplicitLeadTime = (leadTime is not None) and (leadTime != 'none')
             explicitNoLeadTime = (leadTime == 'none')
             sectionTimed = jrfuncs.getDictValueOrDefault(section, 'timed', False)
-            defaultTime = jrfuncs.getDictValueOrDefault(lead['properties'], 'defaultTime', True)
+            defaultTime = jrfuncs.getDictValueOrDefault(lead.properties, 'defaultTime', True)
             shouldDefaultTime = defaultTime and (not self.getText('timeAdvances').lower() in leadText.lower()) and (not leadTagType in ['hint','doc']) and (sectionTimed)
             #
             if (isClockModeEnabled) and (not explicitNoLeadTime) and ((hasExplicitLeadTime) or shouldDefaultTime):
@@ -4624,7 +5938,7 @@ class HlParser:
                     leadTime = int(float(leadTime) * self.getOptionClockTimeStep())
                 if (leadTime>=0) or True:
                     # ok add default lead time
-                    text = self.calcTimeAdvanceInstructions(leadTime, lead, False)
+                    text = self.calcTimeAdvanceInstructions(leadTime, lead, lead, False)
                     text = self.modifyTextToSuitTextPositionStyle(text, 'linestart', '', True, True, True)
                     #leadText += '\n---\n' + text + '\n'
                     leadText += '\n' + text + '\n'
@@ -4648,7 +5962,7 @@ class HlParser:
 
             # post render format text
             if (renderFormat=='html'):
-                leadStartHtml = '<div id="{}" class="lead">\n'.format(self.safeMarkdownId(renderId))
+                leadStartHtml = '<div id="{}" class="lead">\n'.format(LeadId.get(renderId).markdownId)
                 leadStartHtml += '<div class="leadtext">\n'
                 leadTextRendered = leadStartHtml + leadTextRendered
                 leadTextRendered += '\n'
@@ -4731,7 +6045,19 @@ class HlParser:
     
 
     def renderMarkdown(self, text, renderFormat, flagSnippetVsWholeDocument):
-        return self.hlMarkdown.renderMarkdown(text, renderFormat, flagSnippetVsWholeDocument)
+        if (self.renderCache is None):
+            return self.hlMarkdown.renderMarkdown(text, renderFormat, flagSnippetVsWholeDocument)
+        # watch mode remembers renders between rebuilds, so only leads whose text changed get rendered again
+        key = (text, renderFormat, flagSnippetVsWholeDocument)
+        self.renderCacheUsedKeys.add(key)
+        if (key in self.renderCache):
+            self.renderCacheStats['hits'] += 1
+            [outText, extras] = self.renderCache[key]
+            return [outText, dict(extras)]
+        self.renderCacheStats['misses'] += 1
+        [outText, extras] = self.hlMarkdown.renderMarkdown(text, renderFormat, flagSnippetVsWholeDocument)
+        self.renderCache[key] = [outText, dict(extras)]
+        return [outText, extras]
 # ---------------------------------------------------------------------------
 
 
@@ -4855,11 +6181,11 @@ class HlParser:
         mtext += '\n\n\n'
 
         # tags
-        mtext += '## {} Tags\n\n'.format(len(self.tagMap))
-        if (len(self.tagMap)==0):
+        mtext += '## {} Tags\n\n'.format(self.tagRegistry.getCount())
+        if (self.tagRegistry.getCount()==0):
             mtext += ' * No tags.\n'
         else:
-            for index, tagDict in self.tagMap.items():
+            for tagDict in self.tagRegistry.getTags():
                 id = tagDict['id']
                 label = tagDict['label']
                 tagType = tagDict['tagType']
@@ -4893,7 +6219,7 @@ class HlParser:
         #leadCount = 0
         for i in range(0, leadCount):
             lead = self.leads[i]
-            properties = lead['properties']
+            properties = lead.properties
             leadLabel = properties['label']
             if (properties['label'] is not None):
                 leadStr = '{}:{}'.format(self.makeTextLinkToLead(lead, None, False, True), leadLabel)
@@ -5150,17 +6476,6 @@ class HlParser:
 
 
 
-# ---------------------------------------------------------------------------
-    def isLeadStandardNumeric(self, leadId):
-        if (len(leadId)==0):
-            return False
-        c = leadId[0]
-        matches = re.match(r'^\d\-\d*$',leadId)
-        if (matches is not None):
-            return True
-        return False
-# ---------------------------------------------------------------------------
-
 # ---------------------------------------------------------------------------
     def createCommonMindMapNodes(self):
         if (False):
@@ -5591,6 +6906,8 @@ class HlParser:
 # ---------------------------------------------------------------------------
     def addReportLogicLinks(self):
         # add debug info to report texts for leads based on any logic links between leads
+        if (not self.reportTextEnabled):
+            return
         leadAddedDebugList = []
         nodes = self.mindMap.getNodes()
         for nodeName, node in nodes.items():
@@ -5629,21 +6946,21 @@ class HlParser:
                 nodeReportTextFrom = '\n**DEBUG:** This lead "{}" {}\n'.format(linkLabel, toLink)
                 nodeReportTextTo = '\n**DEBUG:** {} "{}" this lead.\n'.format(fromLink, linkLabel)
                 if (fromLead is not None):
-                    if (fromLead['reportText'] is None):
-                        fromLead['reportText'] = ''
-                    leadId = fromLead['id']
+                    if (fromLead.reportText is None):
+                        fromLead.reportText = ''
+                    leadId = fromLead.id
                     if (leadId not in leadAddedDebugList):
                         leadAddedDebugList.append(leadId)
-                        fromLead['reportText'] += '\n---\n'
-                    fromLead['reportText'] += nodeReportTextFrom
+                        fromLead.reportText += '\n---\n'
+                    fromLead.reportText += nodeReportTextFrom
                 if (toLead is not None):
-                    if (toLead['reportText'] is None):
-                        toLead['reportText'] = ''
-                    leadId = toLead['id']
+                    if (toLead.reportText is None):
+                        toLead.reportText = ''
+                    leadId = toLead.id
                     if (leadId not in leadAddedDebugList):
                         leadAddedDebugList.append(leadId)
-                        toLead['reportText'] += '\n---\n'
-                    toLead['reportText'] += nodeReportTextTo
+                        toLead.reportText += '\n---\n'
+                    toLead.reportText += nodeReportTextTo
         pass
 # ---------------------------------------------------------------------------
 
@@ -5680,21 +6997,38 @@ class HlParser:
 
 
 # ---------------------------------------------------------------------------
-    def databaseDebugLead(self, lead):
-        # this function is designed to identify problems where a lead # is used but it doesnt match the directory database
-        hlapi = self.getHlApi()
-        hlapiPrev = self.getHlApiPrev()
-        #
+    def isDatabaseDebugLeadExpected(self, lead):
+        # True if the lead is expected to match a row in the hl data (not an autoid lead, and a standard numbered lead id that is not a placeholder)
         manualLeadIgnoreList = ['0-0000', '9-9999']
-        leadProprties = lead['properties']
-        #
-        leadId = lead['id']
+        leadProprties = lead.properties
+        autoid = leadProprties['autoid'] if ('autoid' in leadProprties) else False
+        if (autoid):
+            return False
+        return (LeadId.get(lead.id).isStandardNumeric) and (lead.id not in manualLeadIgnoreList)
+
+
+    def calcDatabaseDebugLabel(self, lead):
+        # label for display
+        leadProprties = lead.properties
         label = leadProprties['label'] if ('label' in leadProprties) else None
+        if (label is None) or (label == '.') or (label=="blank"):
+            # shorthand for make blank
+            label = 'n/a'
+        return label
+
+
+    def databaseDebugLead(self, lead, lookupResult, lookupResultPrev):
+        # this function is designed to identify problems where a lead # is used but it doesnt match the directory database
+        # lookupResult and lookupResultPrev are what HlApi.findLeadRowsForLeads found for this lead in the main and previous version hl data (lookupResultPrev is None if there is no previous version)
+        leadProprties = lead.properties
+        #
+        leadId = lead.id
         autoid = leadProprties['autoid'] if ('autoid' in leadProprties) else False
         map = leadProprties['map'] if ('map' in leadProprties) else False
         #
-        # lookup database row in main dbs
-        [existingLeadRow, existingRowSourceKey] = hlapi.findLeadRowByLeadId(leadId)
+        # database row in main dbs
+        existingLeadRow = lookupResult['row']
+        existingRowSourceKey = lookupResult['sourceKey']
         if (existingLeadRow is not None):
             existingLeadRowLabel = existingLeadRow['properties']['dName']
             existingLeadRowAddress = existingLeadRow['properties']['address']
@@ -5710,8 +7044,8 @@ class HlParser:
         existingLeadRowLabelPrev = ''
         existingLeadRowAddressPrev = ''
         existingLeadRowSmartLabelPrev = ''
-        if (hlapiPrev is not None):
-            [existingLeadRowPrev, existingRowSourceKeyPrev] = hlapiPrev.findLeadRowByLeadId(leadId)
+        if (lookupResultPrev is not None):
+            existingLeadRowPrev = lookupResultPrev['row']
             if (existingLeadRowPrev is not None):
                 existingLeadRowLabelPrev = existingLeadRowPrev['properties']['dName']
                 existingLeadRowAddressPrev = existingLeadRowPrev['properties']['address']
@@ -5727,9 +7061,7 @@ class HlParser:
 
 
         # label for display
-        if (label is None) or (label == '.') or (label=="blank"):
-            # shorthand for make blank
-            label = 'n/a'
+        label = self.calcDatabaseDebugLabel(lead)
 
         # we will build debug messages here
         debugMsgs = []
@@ -5745,7 +7077,7 @@ class HlParser:
                 needsCompare = True
         else:
             # not an autoid so we expect to match it
-            if (not self.isLeadStandardNumeric(leadId)) or (leadId in manualLeadIgnoreList):
+            if (not self.isDatabaseDebugLeadExpected(lead)):
                 # it doesnt start with a number so we dont expect it to match
                 if (existingLeadRow is not None):
                     msg = '! WARNING: A lead starting with a letter should not match an existing lead in the database, but it does: {} at {} from {}.'.format(existingLeadRow['properties']['dName'], existingLeadRow['properties']['address'], existingRowSourceKey)
@@ -5772,13 +7104,10 @@ class HlParser:
                 else:
                     labelCompareStr = '[{}]'.format(label)
                 if (needsCompare):
-                    searchFor = label if (label!='') else leadId
-                    [guessLead, guessSource] = hlapi.findLeadRowByNameOrAddress(searchFor)
-                    if (guessLead is None):
-                        # let's try a SLOWER metric search
-                        [guessLead, guessSource, dist] = hlapi.findLeadRowSimilarByNameOrAddress(searchFor)
-                    else:
-                        dist = 0
+                    # the guess by label (exact, or else the most similar row) was looked up along with the lead id
+                    guessLead = lookupResult['guessRow']
+                    guessSource = lookupResult['guessSourceKey']
+                    dist = lookupResult['guessDist']
                     #
                     if (guessLead is None):
                         msg = '! Could not find a similar lead in primary database.'
@@ -5810,7 +7139,7 @@ class HlParser:
                 debugMsgs.append(msg)
         else:
             # no hit in previous
-            if (hlapiPrev is not None):
+            if (lookupResultPrev is not None):
                 # we have a prev db
                 if (existingLeadRow is not None):
                     # we matched in primary db, so throw up a warning
@@ -5820,7 +7149,7 @@ class HlParser:
         # display
         if (len(debugMsgs)>0):
             jrprint('')
-        debugLine = 'Debugging {:.<30}... {}     | from {} at line #{}'.format(leadId, label, lead['sourceLabel'], lead['lineNumber'])
+        debugLine = 'Debugging {:.<30}... {}     | from {} at line #{}'.format(leadId, label, lead.sourceLabel, lead.lineNumber)
         jrprint(debugLine)
         for msg in debugMsgs:
             jrprint(' {}'.format(msg))
@@ -5829,9 +7158,9 @@ class HlParser:
 
         # store info
         debugInfo = '; '.join(debugMsgs)
-        lead['debugInfo'] = debugInfo
+        lead.debugInfo = debugInfo
         # lets store the existing lead row in hl data
-        lead['existingLeadRow'] = existingLeadRow
+        lead.existingLeadRow = existingLeadRow
 
 
     def isDbValNoneOrBlank(self, val):
@@ -5895,7 +7224,7 @@ class HlParser:
 
 
 # ---------------------------------------------------------------------------
-    def doGainTag(self, args, lead, block, leadInfoText, leadInfoMText, textPositionStyle):
+    def doGainTag(self, args, sourceLead, lead, block, textPositionStyle):
         # we now use generic tags that can be used for DOCUMENTS or CONDITIONS or other things
         tagId = args['id']
         isDefine = jrfuncs.getDictValueFromTrueFalse(args,'define',False)
@@ -5903,10 +7232,8 @@ class HlParser:
 
         # track use
         if (lead is not None):
-            tagDict['useCount'] += 1
             msg = 'Gained {}'.format(tagDict['tagType'])
-            self.appendUseNoteToTagDict(tagDict, msg, leadInfoText, leadInfoMText, block)
-            tagDict['gainLeads'].append(lead)
+            self.doLeadEffect('gainTag', sourceLead, lead, [tagDict, msg, block])
 
         tagType = tagDict['tagType']
         if (tagType == 'task') and (self.getOptionDisableTaskTags()):
@@ -5914,7 +7241,6 @@ class HlParser:
         else:
             # use it
             resultText = tagDict['gainTextPlayer']
-            reportText = tagDict['gainTextReport']
             #
             if (tagDict['tagType']=='doc'):
                 symbolName = 'Symbol.Doc'
@@ -5922,13 +7248,15 @@ class HlParser:
                 symbolName = 'Symbol.Mark'
             #
             resultText = self.getText(symbolName) + resultText
-            reportText = self.getText(symbolName) + reportText
-            #         
             resultText = self.modifyTextToSuitTextPositionStyle(resultText, textPositionStyle, '', True, True, False)
-            reportText = self.modifyTextToSuitTextPositionStyle(reportText, textPositionStyle, '', True, True, False)
+            if (self.reportTextEnabled):
+                reportText = self.getText(symbolName) + tagDict['gainTextReport']
+                reportText = self.modifyTextToSuitTextPositionStyle(reportText, textPositionStyle, '', True, True, False)
+            else:
+                reportText = None
 
             # mindmap
-            self.createMindMapLinkLeadProvidesTag(lead, tagDict)
+            self.doLeadEffect('providesTag', sourceLead, lead, [tagDict])
             return [resultText, reportText]
 # ---------------------------------------------------------------------------
 
@@ -5940,7 +7268,7 @@ class HlParser:
 
 
 # ---------------------------------------------------------------------------
-    def doUseTag(self, args, behalfLead, funcName, codeResult, context, block, leadInfoText, leadInfoMText, textPositionStyle):
+    def doUseTag(self, args, sourceLead, behalfLead, funcName, codeResult, context, block, textPositionStyle):
         # this is an AND for all tags
         tagIdAll = args['id']
         tagIds = tagIdAll.split(',')
@@ -5965,9 +7293,8 @@ class HlParser:
             tagDict = self.findTag(tagId, behalfLead, block, True, False)
             # track use
             if (behalfLead is not None):
-                tagDict['useCount'] += 1
                 msg = 'Checking user {}'.format(funcName)
-                self.appendUseNoteToTagDict(tagDict, msg, leadInfoText, leadInfoMText, block)
+                self.doLeadEffect('useTag', sourceLead, behalfLead, [tagDict, msg, block])
             # tagLabelTyped
             if (addGainedText):
                 tagLabelTyped = tagDict['labelTyped']
@@ -5979,7 +7306,7 @@ class HlParser:
             tagLabels.append(tagLabelTyped)
             tagLabelsReport.append(tagLabelTypedReport)
             # mindmap
-            self.createMindMapLinkLeadChecksTag(behalfLead, tagDict)
+            self.doLeadEffect('checksTag', sourceLead, behalfLead, [tagDict])
         #
         if (funcName in ['hasanytag', 'requireanytags','missinganytags']):
             comboWord = 'or'
@@ -6004,7 +7331,7 @@ class HlParser:
             if (markType is None):
                 extraInstructions = ''
             else:
-                self.updateMarkBoxTracker(markType, amount, behalfLead)
+                self.doLeadEffect('markBox', sourceLead, behalfLead, [markType, amount])
                 extraInstructions = ' In addition, {} now.'.format(self.calcMarkInstructions(markType, amount))
             baseText = 'If you have *NOT* {},  stop reading now, and return here when you have.' + extraInstructions + '\n * Otherwise, '
             codeResult['action'] = 'inline'
@@ -6054,8 +7381,8 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def findTag(self, tagIdExtended, lead, block, flagMustExist, flagDefineIfNew):
-        if (tagIdExtended in self.tagMap):
-            tagDict = self.tagMap[tagIdExtended]
+        tagDict = self.tagRegistry.findById(tagIdExtended)
+        if (tagDict is not None):
             return tagDict
         # not found
         if (flagDefineIfNew):
@@ -6068,54 +7395,14 @@ class HlParser:
         return None
 
 
-# ---------------------------------------------------------------------------
-    def moveTagToEnd(self, tagIdExtended):
-        if (tagIdExtended not in self.tagMap):
-            return None
-        tagDict = self.tagMap[tagIdExtended]
-        del self.tagMap[tagIdExtended]
-        self.tagMap[tagIdExtended] = tagDict
-        return tagDict
-# ---------------------------------------------------------------------------
-
-
-
 # ---------------------------------------------------------------------------
     def makeTagLabelForCondition(self, tagId, flagConverToLetterIfEnabled):
         #
         conditionTagsAsLetters = self.getConditionTagsAsLetters()
 
-        # use random letters as tags
+        # use letters as tags
         if (conditionTagsAsLetters) and (flagConverToLetterIfEnabled):
-            # initialize list if empty
-            if (len(self.tagConditionLabelsAvailable)==0):
-                # refresh it
-                self.tagConditionLabelStage += 1
-                if (self.tagConditionLabelStage == 1):
-                    suffix = ''
-                else:
-                    suffix = str(self.tagConditionLabelStage)
-                #self.tagConditionLabelsAvailable = list([chr(item)+suffix for item in range(ord("A"), ord("Z") + 1)])
-                self.tagConditionLabelsAvailable = list([item+suffix for item in 'ABCDEFGHJKLMNOPQRSTUVWXYZ'])
-                # no more randomizing
-                #random.shuffle(self.tagConditionLabelsAvailable)
-            # try to use first letter of tag
-            firstLetter = tagId[0].upper()
-            if (firstLetter in self.tagConditionLabelsAvailable):
-                chosenLetter = firstLetter
-            else:
-                # find nearest one HIGHER than it (wrapping around if needed)
-                chosenLetter = None
-                for c in self.tagConditionLabelsAvailable:
-                    if (c>firstLetter):
-                        # got it
-                        chosenLetter = c
-                        break
-                if (chosenLetter is None):
-                    # we warp around
-                    chosenLetter = self.tagConditionLabelsAvailable[0]
-            self.tagConditionLabelsAvailable.remove(chosenLetter)
-            label = chosenLetter
+            label = self.tagRegistry.allocateConditionLetter(tagId)
         else:
             label = tagId
         #
@@ -6124,10 +7411,10 @@ class HlParser:
 
 
     def getConditionTagsAsLetters(self):
-        return self.getOptionVal('conditionTagsAsLetters', False)
+        return self.getOptionsSnapshot().conditionTagsAsLetters
 
     def getOptionDisableTaskTags(self):
-        return self.getOptionVal('disableTaskTags', False)      
+        return self.getOptionsSnapshot().disableTaskTags      
 # ---------------------------------------------------------------------------
 
 
@@ -6138,9 +7425,9 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def doCreateOrFindTagForLead(self, lead, tagType):
-        leadId = lead['id']
-        block = lead['block']
-        lead['properties']['leadTagType'] = tagType
+        leadId = lead.id
+        block = lead.block
+        lead.properties['leadTagType'] = tagType
         tagIdExtended = leadId
         tagDict = self.findTag(tagIdExtended, lead, block, False, False)
         tagLead = None
@@ -6158,7 +7445,7 @@ class HlParser:
                 # drop down
         if (tagLead is None):
             # create
-            args = lead['properties']
+            args = lead.properties
             tagDict  = self.doDefineTag('', args, lead, None, block)
             tagLead = lead
         else:
@@ -6170,10 +7457,10 @@ class HlParser:
 
     def doCreateTagForHintLead(self, lead):
         # this is called on a NEW hint lead being processed
-        leadId = lead['id']
-        block = lead['block']
-        hintProperties = lead['properties']
-        lead['properties']['leadTagType'] = 'hint'
+        leadId = lead.id
+        block = lead.block
+        hintProperties = lead.properties
+        lead.properties['leadTagType'] = 'hint'
         # the lead will be called hint.cond.name or hint.doc.name etc.
         matches = re.match('^hint\.([^.]*)\.(.*)$', leadId)
         if (matches is None):
@@ -6185,8 +7472,8 @@ class HlParser:
         if (tagDict is not None):
             # the underlying tag has already been defined, so dont create a new one
             # this would be common for a DOC which is defined by its OWN lead
-            # now as a kludge for hint order we REMOVE it and reinsert it
-            tagDict = self.moveTagToEnd(tagIdExtended)
+            # now as a kludge for hint order we move it to the end
+            tagDict = self.tagRegistry.moveToEnd(tagIdExtended)
             tagLead = tagDict['lead']
             # drop down
         else:
@@ -6198,11 +7485,11 @@ class HlParser:
 
         # any other hint properties that should add to existing tag?
         targetHintLabel = tagDict['labelFull']
-        hintProperties['renderId'] = 'Hint for ' + targetHintLabel
+        self.leadRegistry.setRenderId(lead, 'Hint for ' + targetHintLabel)
         hintProperties['reportExtra'] = tagIdExtended
         if ('deadline' in hintProperties):
-            tagDict['deadline'] = hintProperties['deadline']
-        tagDict['hintLead'] = lead
+            self.tagRegistry.setDeadline(tagDict, hintProperties['deadline'])
+        self.tagRegistry.setHintLead(tagDict, lead)
 
         # make a link from the TAG to the HINT
         self.createMindMapLinkBetweenTagAndHint(tagDict, lead)
@@ -6316,13 +7603,13 @@ class HlParser:
             #
             # lead info
             if (tagLead is not None):
-                tagLeadProps = tagLead['properties']
+                tagLeadProps = tagLead.properties
                 # force render id to be the label
-                tagLeadProps['renderId'] = '{} ['.format(jrfuncs.uppercaseFirstLetter(self.getText('condition'))) + label + ']'
+                self.leadRegistry.setRenderId(tagLead, '{} ['.format(jrfuncs.uppercaseFirstLetter(self.getText('condition'))) + label + ']')
 
             #
             if (lead is not None):
-                mainLeadProps = lead['properties']
+                mainLeadProps = lead.properties
                 if ('deadline' in mainLeadProps):
                     # kludge to add deadline to label if we are in a hint for a check lead
                     tagDict['mindMapLabel'] += '\n(deadline day {})'.format(mainLeadProps['deadline'])
@@ -6340,15 +7627,14 @@ class HlParser:
             #
             tagDict['lead'] = tagLead
             # generate a label which is the document unique NUMBER (documents are referred to by #)
-            docIndex = self.tagDocumentIndex
+            docIndex = self.tagRegistry.allocateDocumentIndex()
             tagDict['docIndex'] = docIndex
-            self.tagDocumentIndex += 1
             label = 'Document {}'.format(docIndex+1)
             labelNoInfo = '**' + label + '**'
             tagDict['label'] = label
             tagDict['labelFullReport'] = tagIdExtended
             #
-            tagLeadProps = tagLead['properties']
+            tagLeadProps = tagLead.properties
             # add info to label
             leadLabel = jrfuncs.getDictValueOrDefault(tagLeadProps, 'label', '')
 
@@ -6364,7 +7650,7 @@ class HlParser:
             tagDict['labelFull'] = 'Document {}'.format(docIndex+1)
 
             # important -- force the renderId of the lead; this is important because it is used as target of link generated below
-            tagLeadProps['renderId'] = tagDict['label']
+            self.leadRegistry.setRenderId(tagLead, tagDict['label'])
             tagLeadProps['reportExtra'] = tagIdExtended
 
             # label for mindmap; it's important that this matches the lead label as that is what is used for mindmap node creation in other places
@@ -6392,7 +7678,7 @@ class HlParser:
 
 
         # store it
-        self.tagMap[tagIdExtended] = tagDict
+        self.tagRegistry.add(tagDict)
 
         # mindmap
         if (True):
@@ -6440,19 +7726,16 @@ class HlParser:
 
         # build up a list of things they must find before the end of the passed day
         lines = []
-        for tagId, tagDict in self.tagMap.items():
-            if ('deadline' in tagDict):
-                deadline = tagDict['deadline']
-                if (deadline == day):
-                    line = ' * {}'.format(tagDict['labelExtended'])
-                    hintLead = jrfuncs.getDictValueOrDefault(tagDict,'hintLead',None)
-                    if (hintLead is not None):
-                        # add link to hint lead
-                        if (flagShowHint):
-                            hintLinkText = self.makeTextLinkToLead(hintLead, 'hint', False, '+onpagelink')
-                            line += ' ({})\n'.format(hintLinkText)
-                    # add line to lines list
-                    lines.append(line)
+        for tagDict in self.tagRegistry.getTagsWithDeadline(day):
+            line = ' * {}'.format(tagDict['labelExtended'])
+            hintLead = jrfuncs.getDictValueOrDefault(tagDict,'hintLead',None)
+            if (hintLead is not None):
+                # add link to hint lead
+                if (flagShowHint):
+                    hintLinkText = self.makeTextLinkToLead(hintLead, 'hint', False, '+onpagelink')
+                    line += ' ({})\n'.format(hintLinkText)
+            # add line to lines list
+            lines.append(line)
 
         requiredItemCount = len(lines)
 
@@ -6584,15 +7867,9 @@ class HlParser:
 
 # ---------------------------------------------------------------------------
     def buildHintLeadListForTag(self, lead, block):
-        leadId = lead['id']
         lines = []
         # we want to find all leads where the player can GAIN the tag specified in the hint
-        matches = re.match(r'^hint\.(.*)$', leadId)
-        if (matches is None):
-            # not found
-            return lines
-        tagIdExtended = matches.group(1)
-        tagDict = self.findTag(tagIdExtended, lead, block, False, False)
+        tagDict = self.tagRegistry.findByHintLead(lead)
         if (tagDict is None):
             # not found
             return lines
@@ -6618,3 +7895,70 @@ class HlParser:
         text = jrfuncs.loadTxtFromFile(filePath, True, encoding)
         return text
 # ---------------------------------------------------------------------------
+
+
+
+
+
+
+
+
+
+
+# ---------------------------------------------------------------------------
+# story file parsing in worker processes (see HlParser.loadStoryFilesIntoBlocksParallel)
+storyParseWorkerParser = None
+
+def initStoryParseWorker(optionsDirPath, overrideOptions, commandlineOverrideOptions):
+    # build a parser with the same options as the parent, including command line (-w) overrides
+    global storyParseWorkerParser
+    storyParseWorkerParser = HlParser(optionsDirPath, overrideOptions)
+    storyParseWorkerParser.mergeOverrideOptions(commandlineOverrideOptions)
+
+def tokenizeStoryTextInWorker(fileText, sourceLabel):
+    return storyParseWorkerParser.tokenizeStoryText(fileText, sourceLabel)
+
+def tokenizeStoryFileStreamingInWorker(filePath, sourceLabel, encoding):
+    return storyParseWorkerParser.tokenizeStoryFileStreaming(filePath, sourceLabel, encoding)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# lead evaluation in (forked) worker processes (see HlParser.evaluateLeadsParallel)
+leadEvaluationWorkerParser = None
+
+def evaluateLeadsInWorker(leadIndices):
+    return leadEvaluationWorkerParser.evaluateLeadsForWorker(leadIndices)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# story load benchmark worker (see HlParser.runStoryLoadBenchmark)
+def runStoryLoadBenchmarkInWorker(optionsDirPath, overrideOptions, commandlineOverrideOptions, filePath, loadMethod):
+    parser = HlParser(optionsDirPath, overrideOptions)
+    parser.mergeOverrideOptions(commandlineOverrideOptions)
+    parser.parseCacheEnabled = False
+    # peak resident memory where we can get it, otherwise peak memory allocated by python
+    if (resource is None):
+        tracemalloc.start()
+    peakMegabytesBefore = calcPeakMemoryMegabytes()
+    startTime = time.time()
+    if (loadMethod=='streaming'):
+        headBlocks = parser.loadStoryFileBlocksStreaming(filePath)
+    else:
+        headBlocks = parser.loadStoryFileBlocks(filePath)
+    elapsedSecs = time.time() - startTime
+    peakMegabytesAfter = calcPeakMemoryMegabytes()
+    digest = hashlib.sha256(json.dumps(headBlocks, default=hlblocks.jsonDefault).encode('utf-8')).hexdigest()
+    memoryLabel = 'rss' if (resource is not None) else 'python heap'
+    return {'elapsedSecs': elapsedSecs, 'headBlockCount': len(headBlocks), 'memoryLabel': memoryLabel, 'peakMegabytesBefore': peakMegabytesBefore, 'peakMegabytesAfter': peakMegabytesAfter, 'digest': digest}
+
+def calcPeakMemoryMegabytes():
+    if (resource is None):
+        return tracemalloc.get_traced_memory()[1] / (1024*1024)
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if (sys.platform=='darwin'):
+        # bytes on mac, kilobytes elsewhere
+        return peakRss / (1024*1024)
+    return peakRss / 1024
+# ---------------------------------------------------------------------------
@@ -0,0 +1,199 @@
+# python imports
+import sys
+
+
+
+
+# ---------------------------------------------------------------------------
+class DictCompatRecord:
+    # base class for compact (__slots__) records that replace what used to be plain dicts
+    # supports dict style access (record['text'], 'blocks' in record, get(), keys(), items()) as a compatibility layer so older code keeps working while it is migrated to attribute access
+    # a field that has never been set is treated like a missing dict key
+    __slots__ = ()
+    # ordered list of all fields (including those of base classes); used for iteration and serialization, so it must match the key order of the dicts we replaced
+    fieldNames = ()
+    fieldNameSet = frozenset()
+
+    def __getitem__(self, key):
+        if (key in self.fieldNameSet):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, val):
+        if (key not in self.fieldNameSet):
+            raise KeyError('Unknown field "{}" for {}.'.format(key, type(self).__name__))
+        setattr(self, key, val)
+
+    def __delitem__(self, key):
+        if (key not in self):
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __contains__(self, key):
+        return (key in self.fieldNameSet) and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if (type(self) is not type(other)):
+            return False
+        return self.toDict() == other.toDict()
+
+    # records are mutable, like the dicts they replace
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.toDict())
+
+    def get(self, key, defaultVal=None):
+        if (key in self.fieldNameSet):
+            return getattr(self, key, defaultVal)
+        return defaultVal
+
+    def keys(self):
+        return [key for key in self.fieldNames if hasattr(self, key)]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def toDict(self):
+        # shallow; nested records stay records
+        return {key: getattr(self, key) for key in self.keys()}
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class Block(DictCompatRecord):
+    # a chunk of a story file (text, code, eof); the header that starts a lead is a HeadBlock
+    # compiledCode is the [handler, funcName, args] a code block is compiled to; it is not a field, so it is never serialized
+    __slots__ = ('sourceLabel', 'lineNumber', 'type', 'text', 'properties', 'compiledCode')
+    fieldNames = ('sourceLabel', 'lineNumber', 'type', 'text', 'properties')
+    fieldNameSet = frozenset(fieldNames)
+
+    def __init__(self, sourceLabel, lineNumber, blockType, text='', properties=None):
+        self.sourceLabel = sourceLabel
+        self.lineNumber = lineNumber
+        self.type = blockType
+        self.text = text
+        self.properties = {} if (properties is None) else properties
+        self.compiledCode = None
+
+
+class HeadBlock(Block):
+    # header block; child blocks are added to blocks (which is not set until the first child is added), and movedBlocks lists indices of children moved to inline leads
+    # blockSpans caches the spans of child blocks covered by inline and conditional code blocks (see HlParser.getBlockSpan); like compiledCode it is not a field
+    __slots__ = ('blocks', 'movedBlocks', 'blockSpans')
+    fieldNames = Block.fieldNames + ('blocks', 'movedBlocks')
+    fieldNameSet = frozenset(fieldNames)
+
+    def __init__(self, sourceLabel, lineNumber, blockType, text='', properties=None):
+        super().__init__(sourceLabel, lineNumber, blockType, text, properties)
+        self.blockSpans = None
+
+
+class Lead(DictCompatRecord):
+    # a lead, made from a HeadBlock; leadIndex, reportText, debugInfo and existingLeadRow are filled in as the lead is processed
+    # linkTextCache holds link texts made for this lead (see HlParser.makeTextLinkToLead); it is not a field, so it is never serialized
+    __slots__ = ('id', 'block', 'properties', 'text', 'sourceLabel', 'lineNumber', 'leadIndex', 'reportText', 'debugInfo', 'existingLeadRow', 'linkTextCache')
+    fieldNames = ('id', 'block', 'properties', 'text', 'sourceLabel', 'lineNumber', 'leadIndex', 'reportText', 'debugInfo', 'existingLeadRow')
+    fieldNameSet = frozenset(fieldNames)
+
+    def __init__(self, leadId, block, properties, text, sourceLabel, lineNumber):
+        self.id = leadId
+        self.block = block
+        self.properties = properties
+        self.text = text
+        self.sourceLabel = sourceLabel
+        self.lineNumber = lineNumber
+        self.linkTextCache = {}
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class LeadRegistry:
+    # the list of leads in the order they were added, along with hash indexes by (canonical) id and by render id
+    # lookups give the same result as the old linear scan of the list (first lead whose id, or optionally render id, matches)
+    # leads must be added with add(), and once added their render id must only be changed with setRenderId(), or the index goes stale
+    def __init__(self):
+        self.leads = []
+        self.leadsById = {}
+        # renderId -> list of leads with that render id, in leadIndex order
+        self.leadsByRenderId = {}
+        # number of times the render id of an added lead has changed; lets callers tell when text with links to leads may be stale
+        self.renderIdChangeCount = 0
+
+    def add(self, lead):
+        leadIndex = len(self.leads)
+        lead.leadIndex = leadIndex
+        self.leads.append(lead)
+        if (lead.id not in self.leadsById):
+            self.leadsById[lead.id] = lead
+        # leads are added in index order so we can just append
+        renderId = lead.properties.get('renderId')
+        if (renderId not in self.leadsByRenderId):
+            self.leadsByRenderId[renderId] = []
+        self.leadsByRenderId[renderId].append(lead)
+        return leadIndex
+
+    def findById(self, leadId, flagCheckRenderId):
+        # leadId should already be canonical
+        lead = self.leadsById.get(leadId)
+        if (flagCheckRenderId):
+            renderIdLeads = self.leadsByRenderId.get(leadId)
+            if (renderIdLeads) and ((lead is None) or (renderIdLeads[0].leadIndex < lead.leadIndex)):
+                lead = renderIdLeads[0]
+        return lead
+
+    def setRenderId(self, lead, renderId):
+        properties = lead.properties
+        oldRenderId = properties.get('renderId')
+        properties['renderId'] = renderId
+        if ('leadIndex' not in lead) or (oldRenderId == renderId):
+            # not registered yet (add will index it)
+            return
+        self.renderIdChangeCount += 1
+        # note we compare by identity since records compare by value
+        renderIdLeads = [renderIdLead for renderIdLead in self.leadsByRenderId[oldRenderId] if (renderIdLead is not lead)]
+        if (len(renderIdLeads)>0):
+            self.leadsByRenderId[oldRenderId] = renderIdLeads
+        else:
+            del self.leadsByRenderId[oldRenderId]
+        renderIdLeads = self.leadsByRenderId.get(renderId, [])
+        insertIndex = len(renderIdLeads)
+        while (insertIndex>0) and (renderIdLeads[insertIndex-1].leadIndex > lead.leadIndex):
+            insertIndex -= 1
+        renderIdLeads.insert(insertIndex, lead)
+        self.leadsByRenderId[renderId] = renderIdLeads
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+def jsonDefault(obj):
+    # pass as default= to json.dump(s) so that records are written exactly as the dicts they replaced
+    if (isinstance(obj, DictCompatRecord)):
+        return obj.toDict()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def blockFromDict(blockDict):
+    # rebuild a block (and its children) from its json form; source labels are interned so that all blocks from a file share one string
+    if (blockDict['type']=='header'):
+        block = HeadBlock(sys.intern(blockDict['sourceLabel']), blockDict['lineNumber'], blockDict['type'], blockDict['text'], blockDict['properties'])
+        if ('blocks' in blockDict):
+            block.blocks = [blockFromDict(childBlockDict) for childBlockDict in blockDict['blocks']]
+        if ('movedBlocks' in blockDict):
+            block.movedBlocks = blockDict['movedBlocks']
+    else:
+        block = Block(sys.intern(blockDict['sourceLabel']), blockDict['lineNumber'], blockDict['type'], blockDict['text'], blockDict['properties'])
+    return block
+# ---------------------------------------------------------------------------
@@ -0,0 +1,112 @@
+# python imports
+import heapq
+from difflib import SequenceMatcher
+
+
+
+
+# ---------------------------------------------------------------------------
+class FuzzyNameAddressIndex:
+    # fuzzy search over entries that each have a name and an address (the dName and address of hl api lead rows)
+    # a character trigram inverted index picks candidate entries, and only those are scored exactly (see calcMatchScore)
+    # entries are identified by the index they were added at, and ties in score go to the earlier entry, as with a scan in add order
+    # candidates are picked by trigram overlap, so an entry sharing few trigrams with the query may be missed even if it would score well; raise candidateCount to trade speed for recall
+    def __init__(self, candidateCount=64):
+        self.candidateCount = candidateCount
+        self.names = []
+        self.addresses = []
+        # trigram -> list of entry indices, one list per field
+        self.nameTrigramPostings = {}
+        self.addressTrigramPostings = {}
+        # number of distinct trigrams in each field of each entry
+        self.nameTrigramCounts = []
+        self.addressTrigramCounts = []
+        # upper cased name prefix -> list of entry indices; these entries get the startswith bonus (see calcMatchScore) so are always candidates when it applies
+        self.namePrefixEntries = {}
+        self.namePrefixLengths = set()
+
+    def add(self, name, address):
+        entryIndex = len(self.names)
+        self.names.append(name)
+        self.addresses.append(address)
+        self.nameTrigramCounts.append(self.addToPostings(self.nameTrigramPostings, name, entryIndex))
+        self.addressTrigramCounts.append(self.addToPostings(self.addressTrigramPostings, address, entryIndex))
+        namePrefix = name[0:namePrefixLength].upper()
+        if (namePrefix not in self.namePrefixEntries):
+            self.namePrefixEntries[namePrefix] = []
+            self.namePrefixLengths.add(len(namePrefix))
+        self.namePrefixEntries[namePrefix].append(entryIndex)
+        return entryIndex
+
+    def addToPostings(self, postings, text, entryIndex):
+        trigrams = calcTrigrams(text)
+        for trigram in trigrams:
+            if (trigram not in postings):
+                postings[trigram] = []
+            postings[trigram].append(entryIndex)
+        return len(trigrams)
+
+    def getCount(self):
+        return len(self.names)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def search(self, txt, maxCount):
+        # return up to maxCount [entryIndex, score] pairs, best first
+        if (maxCount<=0) or (len(self.names)==0):
+            return []
+        candidates = self.findCandidates(txt)
+        txtUpper = txt.upper()
+        scoredCandidates = []
+        for entryIndex in candidates:
+            score = self.calcMatchScore(txt, txtUpper, entryIndex)
+            # a score of 0 is no match at all
+            if (score > 0):
+                scoredCandidates.append([-score, entryIndex])
+        return [[entryIndex, -negativeScore] for [negativeScore, entryIndex] in heapq.nsmallest(maxCount, scoredCandidates)]
+
+
+    def findCandidates(self, txt):
+        # the entries sharing the most trigrams with txt (by dice coefficient, in either field), plus all entries that get the name prefix bonus
+        queryTrigrams = calcTrigrams(txt)
+        queryTrigramCount = len(queryTrigrams)
+        overlapScores = {}
+        for [postings, trigramCounts] in [[self.nameTrigramPostings, self.nameTrigramCounts], [self.addressTrigramPostings, self.addressTrigramCounts]]:
+            sharedCounts = {}
+            for trigram in queryTrigrams:
+                for entryIndex in postings.get(trigram, ()):
+                    sharedCounts[entryIndex] = sharedCounts.get(entryIndex, 0) + 1
+            for entryIndex, sharedCount in sharedCounts.items():
+                overlapScore = 2.0 * sharedCount / (queryTrigramCount + trigramCounts[entryIndex])
+                if (overlapScore > overlapScores.get(entryIndex, 0.0)):
+                    overlapScores[entryIndex] = overlapScore
+        candidates = set(heapq.nlargest(self.candidateCount, overlapScores, key=lambda entryIndex: (overlapScores[entryIndex], -entryIndex)))
+        #
+        txtUpper = txt.upper()
+        for prefixLength in self.namePrefixLengths:
+            candidates.update(self.namePrefixEntries.get(txtUpper[0:prefixLength], ()))
+        return candidates
+
+
+    def calcMatchScore(self, txt, txtUpper, entryIndex):
+        # the best of the name and address similarity ratios, with a bonus for the name when txt starts with the start of it
+        name = self.names[entryIndex]
+        distName = SequenceMatcher(None, txt, name).ratio()
+        distAddr = SequenceMatcher(None, txt, self.addresses[entryIndex]).ratio()
+        # kludge for startswith
+        if (txtUpper.startswith(name[0:namePrefixLength].upper())):
+            distName += 0.5
+        return max(distName, distAddr)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+# length of name prefix for the startswith bonus
+namePrefixLength = 5
+
+def calcTrigrams(text):
+    # set of character trigrams of text, case folded and padded so that short texts and word starts get trigrams too
+    paddedText = '  ' + text.lower() + ' '
+    return set([paddedText[i:i+3] for i in range(len(paddedText)-2)])
+# ---------------------------------------------------------------------------
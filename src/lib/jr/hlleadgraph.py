@@ -0,0 +1,115 @@
+# python imports
+import heapq
+
+
+
+
+# ---------------------------------------------------------------------------
+class LeadGraph:
+    # dependency graph between leads (by leadIndex), built once before leads are evaluated
+    # an edge from lead A to lead B says that the output of A depends on B; the kind of edge says how:
+    #   inherits: A is a blank (alias) lead that takes its content from B
+    #   inserts: the code of A does an $insertlead() of B
+    #   labelcontd: the label of A is made from the label of B
+    #   inline: A is an inline lead made from blocks evaluated on behalf of B
+    # used to order evaluation and to report dependency cycles, and exposed (as HlParser.leadGraph) so that a rebuild can find the leads affected by a change
+    def __init__(self):
+        # leadIndex -> list of [targetIndex, kind], in the order added
+        self.dependencies = {}
+        # targetIndex -> list of [leadIndex, kind]
+        self.dependents = {}
+
+    def addLead(self, leadIndex):
+        if (leadIndex not in self.dependencies):
+            self.dependencies[leadIndex] = []
+            self.dependents[leadIndex] = []
+
+    def hasLead(self, leadIndex):
+        return (leadIndex in self.dependencies)
+
+    def addEdge(self, leadIndex, targetIndex, kind):
+        self.addLead(leadIndex)
+        self.addLead(targetIndex)
+        edge = [targetIndex, kind]
+        if (edge in self.dependencies[leadIndex]):
+            return
+        self.dependencies[leadIndex].append(edge)
+        self.dependents[targetIndex].append([leadIndex, kind])
+
+    def getDependencies(self, leadIndex, kind=None):
+        # list of leads that leadIndex depends on (optionally only by edges of one kind)
+        return [targetIndex for [targetIndex, edgeKind] in self.dependencies.get(leadIndex, []) if (kind is None) or (edgeKind==kind)]
+
+    def getDependents(self, leadIndex, kind=None):
+        # list of leads that depend on leadIndex
+        return [dependentIndex for [dependentIndex, edgeKind] in self.dependents.get(leadIndex, []) if (kind is None) or (edgeKind==kind)]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def calcAffectedLeads(self, leadIndices, kinds=None):
+        # return sorted list of the given leads and all leads whose output depends on them, directly or indirectly (optionally only through edges of the given kinds)
+        affected = set(leadIndices)
+        pending = list(leadIndices)
+        while (len(pending)>0):
+            leadIndex = pending.pop()
+            for [dependentIndex, edgeKind] in self.dependents.get(leadIndex, []):
+                if (kinds is not None) and (edgeKind not in kinds):
+                    continue
+                if (dependentIndex not in affected):
+                    affected.add(dependentIndex)
+                    pending.append(dependentIndex)
+        return sorted(affected)
+
+
+    def findCycle(self, kinds):
+        # return a list of lead indices [a, b, ..., a] forming a cycle through edges of the given kinds, or None if there are none
+        # iterative depth first search, so long chains do not hit the recursion limit
+        visitState = {}
+        for startIndex in sorted(self.dependencies):
+            if (startIndex in visitState):
+                continue
+            visitState[startIndex] = 'active'
+            path = [startIndex]
+            stack = [iter(self.getDependenciesOfKinds(startIndex, kinds))]
+            while (len(stack)>0):
+                targetIndex = next(stack[-1], None)
+                if (targetIndex is None):
+                    visitState[path.pop()] = 'done'
+                    stack.pop()
+                    continue
+                targetState = visitState.get(targetIndex)
+                if (targetState=='active'):
+                    return path[path.index(targetIndex):] + [targetIndex]
+                if (targetState is None):
+                    visitState[targetIndex] = 'active'
+                    path.append(targetIndex)
+                    stack.append(iter(self.getDependenciesOfKinds(targetIndex, kinds)))
+        return None
+
+
+    def calcEvaluationOrder(self, leadIndices, kinds):
+        # return leadIndices ordered so that each lead comes after the leads it depends on through edges of the given kinds
+        # ties are broken by leadIndex, so with no such edges (or only edges to earlier leads) this is just file order
+        # assumes there are no cycles among these edges (see findCycle); leads in a cycle would be left out
+        leadIndexSet = set(leadIndices)
+        waitingCounts = {}
+        for leadIndex in leadIndices:
+            waitingCounts[leadIndex] = len([targetIndex for targetIndex in self.getDependenciesOfKinds(leadIndex, kinds) if (targetIndex in leadIndexSet)])
+        readyHeap = [leadIndex for leadIndex in leadIndices if (waitingCounts[leadIndex]==0)]
+        heapq.heapify(readyHeap)
+        order = []
+        while (len(readyHeap)>0):
+            leadIndex = heapq.heappop(readyHeap)
+            order.append(leadIndex)
+            for [dependentIndex, edgeKind] in self.dependents.get(leadIndex, []):
+                if (edgeKind in kinds) and (dependentIndex in leadIndexSet):
+                    waitingCounts[dependentIndex] -= 1
+                    if (waitingCounts[dependentIndex]==0):
+                        heapq.heappush(readyHeap, dependentIndex)
+        return order
+
+
+    def getDependenciesOfKinds(self, leadIndex, kinds):
+        return [targetIndex for [targetIndex, edgeKind] in self.dependencies.get(leadIndex, []) if (edgeKind in kinds)]
+# ---------------------------------------------------------------------------
@@ -0,0 +1,71 @@
+# imports
+from lib.jr import jrfuncs
+
+# python imports
+import re
+
+
+
+
+# ---------------------------------------------------------------------------
+class LeadId:
+    # a lead id string parsed once, with everything we derive from it cached (canonical form, section, sort key, classification, markdown anchor)
+    # use LeadId.get(idStr) rather than creating these directly; instances are interned so each distinct id string is only ever parsed once
+    # the intern table lives as long as the process, so a parser clears it at the start of each run (see clearInternTable) so ids of leads that are gone do not pile up in watch mode
+    __slots__ = ('idStr', 'canonical', 'idStyle', 'section', 'sortKey', 'isStandardNumeric', 'linkPrefix', 'markdownId')
+    internTable = {}
+    #
+    sortKeyDigits = 6
+    hlDotRegex = re.compile(r'^([A-Za-z0-9][A-Za-z0-9\.]+)\.(.*)$')
+    hlDashRegex = re.compile(r'^([A-Za-z0-9\.]+)\s*\-\s*(.*)$')
+    shcdRegex = re.compile(r'^([A-Za-z]+)\s*\-?\s*([0-9]+)$')
+    shcdReverseRegex = re.compile(r'^([0-9]+)\s*\-?\s*([A-Za-z]+)$')
+    standardNumericRegex = re.compile(r'^\d\-\d*$')
+
+    @classmethod
+    def get(cls, idStr):
+        if (isinstance(idStr, LeadId)):
+            return idStr
+        leadId = cls.internTable.get(idStr)
+        if (leadId is None):
+            leadId = LeadId(idStr)
+            cls.internTable[idStr] = leadId
+        return leadId
+
+    @classmethod
+    def clearInternTable(cls):
+        # LeadId objects already handed out stay valid; they are just no longer shared with later lookups
+        cls.internTable.clear()
+
+    def __init__(self, idStr):
+        self.idStr = idStr
+        # no spaces
+        # (we used to add a space between letters and numbers (SHCD stye) but this caused problems; instead do this on display)
+        self.canonical = idStr.replace(' ','')
+        # style of id and the section it sorts into
+        [self.idStyle, self.section] = self.calcStyleAndSection(idStr)
+        self.sortKey = jrfuncs.zeroPadNumbersAnywhereInStringAll(idStr, self.sortKeyDigits)
+        self.isStandardNumeric = (self.standardNumericRegex.match(idStr) is not None)
+        # numeric ids are shown with a # in front
+        self.linkPrefix = '#' if (idStr[0:1].isdigit()) else ''
+        self.markdownId = idStr.replace(' ','_')
+
+    def __repr__(self):
+        return 'LeadId({})'.format(repr(self.idStr))
+
+    def calcStyleAndSection(self, idStr):
+        # return [idStyle, section]; idStyle is one of 'hl', 'shcd', 'shcdReverse' or '' if unknown
+        matches = self.hlDotRegex.match(idStr)
+        if (matches is not None):
+            return ['hl', matches[1].upper()]
+        matches = self.hlDashRegex.match(idStr)
+        if (matches is not None):
+            return ['hl', matches[1].upper()]
+        matches = self.shcdRegex.match(idStr)
+        if (matches is not None):
+            return ['shcd', matches[1].upper()]
+        matches = self.shcdReverseRegex.match(idStr)
+        if (matches is not None):
+            return ['shcdReverse', matches[2].upper()]
+        return ['', '']
+# ---------------------------------------------------------------------------
@@ -0,0 +1,87 @@
+# python imports
+import types
+
+
+
+
+# ---------------------------------------------------------------------------
+class OptionsSnapshot:
+    # the resolved top level options of a parser (working dir options falling back to base options), built once and then read without walking the JrOptions layers
+    # the values are copied and frozen (see freezeOptionValue), so a snapshot never changes, and editing JrOptions data in place does not change it either
+    # the parser builds a new one whenever options are merged (see HlParser.invalidateOptionsSnapshot)
+    # typed values (like the clock numbers) are checked where they are first asked for, so a bad value only fails the lookups of that option
+    def __init__(self, baseOptions, workingOptions):
+        # working dir options override base options unless they are None
+        values = dict(baseOptions)
+        for keyName, val in workingOptions.items():
+            if (val is not None):
+                values[keyName] = val
+        self.values = freezeOptionValue(values)
+        # template vars always come from the base options
+        self.workingDir = baseOptions.get('workingdir', '')
+        self.baseDir = baseOptions.get('basedir', '')
+        if (self.workingDir is None):
+            self.workingDir = ''
+        if (self.baseDir is None):
+            self.baseDir = ''
+        #
+        self.conditionTagsAsLetters = self.get('conditionTagsAsLetters', False)
+        self.disableTaskTags = self.get('disableTaskTags', False)
+        # keyName -> value, for typed values that have been checked
+        self.checkedValues = {}
+
+    def get(self, keyName, defaultVal):
+        val = self.values.get(keyName)
+        if (val is None):
+            return defaultVal
+        return val
+
+    def getThrowException(self, keyName):
+        val = self.values.get(keyName)
+        if (val is None):
+            raise Exception('Key "{}" not found in options.'.format(keyName))
+        return val
+
+    def getNumberThrowException(self, keyName):
+        if (keyName not in self.checkedValues):
+            val = self.getThrowException(keyName)
+            if (not isinstance(val, (int, float))) or isinstance(val, bool):
+                raise Exception('Option "{}" should be a number, not "{}".'.format(keyName, val))
+            self.checkedValues[keyName] = val
+        return self.checkedValues[keyName]
+
+    def getRenderTextSyntax(self):
+        if ('renderTextSyntax' not in self.checkedValues):
+            renderOptions = self.getThrowException('renderOptions')
+            if (not isinstance(renderOptions, types.MappingProxyType)):
+                raise Exception('Option "renderOptions" should be a dictionary, not "{}".'.format(renderOptions))
+            if (renderOptions.get('textSyntax') is None):
+                raise Exception('Key "textSyntax" not found in renderOptions.')
+            self.checkedValues['renderTextSyntax'] = renderOptions['textSyntax']
+        return self.checkedValues['renderTextSyntax']
+
+    def resolveTemplateVars(self, text):
+        text = text.replace('$workingdir', self.workingDir)
+        text = text.replace('$basedir', self.baseDir)
+        return text
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+def freezeOptionValue(val):
+    # return a read only copy of an option value: dictionaries become (read only) mapping proxies and lists become tuples
+    if (isinstance(val, (dict, types.MappingProxyType))):
+        return types.MappingProxyType({keyName: freezeOptionValue(itemVal) for keyName, itemVal in val.items()})
+    if (isinstance(val, (list, tuple))):
+        return tuple([freezeOptionValue(itemVal) for itemVal in val])
+    return val
+
+
+def thawOptionValue(val):
+    # return a plain (changeable) copy of a frozen option value, for callers that build on it
+    if (isinstance(val, types.MappingProxyType)):
+        return {keyName: thawOptionValue(itemVal) for keyName, itemVal in val.items()}
+    if (isinstance(val, tuple)):
+        return [thawOptionValue(itemVal) for itemVal in val]
+    return val
+# ---------------------------------------------------------------------------
@@ -0,0 +1,147 @@
+# python imports
+import bisect
+
+
+
+
+# ---------------------------------------------------------------------------
+class TagRegistry:
+    # all tags (tagDicts) by extended id (TYPE.ID), along with secondary indexes by type, deadline, hint lead and the leads that gain them
+    # tags are kept in an explicit order (the order they were added, except that moveToEnd moves a tag to the end, which is used to order hints)
+    # deadlines, hint leads and gaining leads must be set with setDeadline(), setHintLead() and addGainLead() so that the indexes stay current
+    def __init__(self):
+        self.tagsById = {}
+        # idExtended -> order key; getTags() returns tags sorted by this
+        self.orderKeys = {}
+        self.nextOrderKey = 0
+        self.orderedTags = None
+        # secondary indexes; each maps to a dictionary idExtended -> tagDict, which we sort by order key when asked
+        self.tagsByType = {}
+        self.tagsByDeadline = {}
+        self.tagsByGainLeadId = {}
+        # hint lead id -> tagDict
+        self.tagsByHintLeadId = {}
+        # condition letter allocator (see allocateConditionLetter)
+        self.conditionLettersAvailable = []
+        self.conditionLetterStage = 0
+        # document numbers
+        self.documentCount = 0
+
+    def add(self, tagDict):
+        tagIdExtended = tagDict['idExtended']
+        self.tagsById[tagIdExtended] = tagDict
+        self.assignOrderKey(tagIdExtended)
+        self.addToIndex(self.tagsByType, tagDict['tagType'], tagDict)
+        if ('deadline' in tagDict):
+            self.addToIndex(self.tagsByDeadline, tagDict['deadline'], tagDict)
+        if ('hintLead' in tagDict):
+            self.tagsByHintLeadId[tagDict['hintLead'].id] = tagDict
+        for gainLead in tagDict['gainLeads']:
+            self.addToIndex(self.tagsByGainLeadId, gainLead.id, tagDict)
+
+    def findById(self, tagIdExtended):
+        return self.tagsById.get(tagIdExtended)
+
+    def getCount(self):
+        return len(self.tagsById)
+
+    def moveToEnd(self, tagIdExtended):
+        # give the tag an order key after all others; return it, or None if not found
+        tagDict = self.tagsById.get(tagIdExtended)
+        if (tagDict is not None):
+            self.assignOrderKey(tagIdExtended)
+        return tagDict
+
+    def assignOrderKey(self, tagIdExtended):
+        self.orderKeys[tagIdExtended] = self.nextOrderKey
+        self.nextOrderKey += 1
+        self.orderedTags = None
+
+    def getTags(self):
+        # list of all tags in order
+        if (self.orderedTags is None):
+            self.orderedTags = self.sortTags(self.tagsById)
+        return self.orderedTags
+
+    def sortTags(self, tagDictsById):
+        orderKeys = self.orderKeys
+        return [tagDictsById[tagIdExtended] for tagIdExtended in sorted(tagDictsById, key=lambda tagIdExtended: orderKeys[tagIdExtended])]
+
+    def addToIndex(self, index, key, tagDict):
+        if (key not in index):
+            index[key] = {}
+        index[key][tagDict['idExtended']] = tagDict
+
+    def removeFromIndex(self, index, key, tagDict):
+        tagDictsById = index.get(key)
+        if (tagDictsById is not None) and (tagDict['idExtended'] in tagDictsById):
+            del tagDictsById[tagDict['idExtended']]
+            if (len(tagDictsById)==0):
+                del index[key]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def setDeadline(self, tagDict, deadline):
+        if ('deadline' in tagDict):
+            self.removeFromIndex(self.tagsByDeadline, tagDict['deadline'], tagDict)
+        tagDict['deadline'] = deadline
+        self.addToIndex(self.tagsByDeadline, deadline, tagDict)
+
+    def setHintLead(self, tagDict, hintLead):
+        if ('hintLead' in tagDict) and (self.tagsByHintLeadId.get(tagDict['hintLead'].id) is tagDict):
+            del self.tagsByHintLeadId[tagDict['hintLead'].id]
+        tagDict['hintLead'] = hintLead
+        self.tagsByHintLeadId[hintLead.id] = tagDict
+
+    def addGainLead(self, tagDict, gainLead):
+        tagDict['gainLeads'].append(gainLead)
+        self.addToIndex(self.tagsByGainLeadId, gainLead.id, tagDict)
+
+    def getTagsOfType(self, tagType):
+        return self.sortTags(self.tagsByType.get(tagType, {}))
+
+    def getTagsWithDeadline(self, deadline):
+        # tags that must be found by the deadline (day), in order
+        return self.sortTags(self.tagsByDeadline.get(deadline, {}))
+
+    def getTagsGainedByLead(self, lead):
+        return self.sortTags(self.tagsByGainLeadId.get(lead.id, {}))
+
+    def findByHintLead(self, hintLead):
+        # the tag that hintLead is the hint for, or None
+        return self.tagsByHintLeadId.get(hintLead.id)
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def allocateConditionLetter(self, tagId):
+        # condition tags are labeled by letters; we try to use the first letter of the tag id, otherwise the next available letter after it (wrapping around)
+        # when all letters are used we start over with a numeric suffix (A2, B2, ...)
+        if (len(self.conditionLettersAvailable)==0):
+            # refresh it
+            self.conditionLetterStage += 1
+            if (self.conditionLetterStage == 1):
+                suffix = ''
+            else:
+                suffix = str(self.conditionLetterStage)
+            # kept sorted so we can bisect
+            self.conditionLettersAvailable = [item+suffix for item in 'ABCDEFGHJKLMNOPQRSTUVWXYZ']
+        # try to use first letter of tag
+        firstLetter = tagId[0].upper()
+        letterIndex = bisect.bisect_left(self.conditionLettersAvailable, firstLetter)
+        if (letterIndex<len(self.conditionLettersAvailable)) and (self.conditionLettersAvailable[letterIndex]==firstLetter):
+            pass
+        else:
+            # nearest one HIGHER than it (wrapping around if needed)
+            letterIndex = bisect.bisect_right(self.conditionLettersAvailable, firstLetter)
+            if (letterIndex==len(self.conditionLettersAvailable)):
+                letterIndex = 0
+        return self.conditionLettersAvailable.pop(letterIndex)
+
+    def allocateDocumentIndex(self):
+        # documents are numbered in the order they are defined
+        docIndex = self.documentCount
+        self.documentCount += 1
+        return docIndex
+# ---------------------------------------------------------------------------
@@ -0,0 +1,65 @@
+# ---------------------------------------------------------------------------
+class LeadTextBuilder:
+    # builds the normal text and (optionally) the report text of a lead from fragments
+    # fragments are collected in lists and joined once at the end, and the text position style at the end of the normal text (see calcTrailingTextPositionStyle) is kept up to date as fragments are added, so we never rescan what has been built
+    def __init__(self, flagReportText):
+        self.textParts = []
+        self.reportTextParts = [] if (flagReportText) else None
+        self.textPositionStyle = 'linestart'
+
+    def add(self, text, reportText=None):
+        # add to both texts; reportText defaults to the same as text
+        self.addText(text)
+        self.addReportText(text if (reportText is None) else reportText)
+
+    def addText(self, text):
+        if (len(text)==0):
+            return
+        self.textParts.append(text)
+        # a fragment of only spaces and quotes does not change the style
+        textPositionStyle = calcTrailingTextPositionStyle(text)
+        if (textPositionStyle is not None):
+            self.textPositionStyle = textPositionStyle
+
+    def addReportText(self, reportText):
+        if (self.reportTextParts is not None):
+            self.reportTextParts.append(reportText)
+
+    def getTextPositionStyle(self):
+        # one of: ['linestart', 'sentence', 'midsentence'] for the text built so far
+        return self.textPositionStyle
+
+    def calcTexts(self):
+        # return [text, reportText], trimmed; reportText is None if we are not building it
+        text = ''.join(self.textParts).strip()
+        if (self.reportTextParts is None):
+            return [text, None]
+        return [text, ''.join(self.reportTextParts).strip()]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+spaceCharacters = frozenset([' '])
+sentenceCharacters = frozenset([':', '.', '@', '$', '&', '*', '%'])
+linestartCharacters = frozenset(['\n', '\t'])
+quoteCharacters = frozenset(['"', "'"])
+
+def calcTrailingTextPositionStyle(text):
+    # return one of: ['linestart', 'sentence', 'midsentence'] based on the last character of text that is not a space or quote, or None if there is no such character
+    # linestart: next text starts a line
+    # sentence: next text starts a sentence (could be after a : for example
+    # midstentence: should start with lowercase
+    pos = len(text)-1
+    while (pos>=0):
+        c = text[pos]
+        pos -= 1
+        if (c in spaceCharacters) or (c in quoteCharacters):
+            continue
+        if (c in sentenceCharacters):
+            return 'sentence'
+        if (c in linestartCharacters):
+            return 'linestart'
+        # something else
+        return 'midsentence'
+    return None
+# ---------------------------------------------------------------------------
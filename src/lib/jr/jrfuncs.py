@@ -9,6 +9,7 @@ import copy
 import time
 import html
 import io
+import sys
 import datetime
 
 from functools import reduce
@@ -633,12 +634,19 @@ def formatLocLabel(locLabel):
 # ---------------------------------------------------------------------------
 moduleLogFile = None
 moduleErrorPrintCount = 0
+# when not None, jrprint appends the text it would print to this list instead (see jrprintCaptureStart)
+moduleCapturedTexts = None
 #
 def jrprint(*args, **kwargs):
     # replacement for print function that will allow logging
     global moduleLogFile
     global moduleErrorPrintCount
 
+    # capturing?
+    if (moduleCapturedTexts is not None):
+        moduleCapturedTexts.append(jrSprintf(*args, **kwargs))
+        return
+
     # create log file
     if (moduleLogFile is None):
         filePath = 'logs/log_' + time.strftime('%Y%m%d_%H%M%S') + '.txt'
@@ -665,6 +673,27 @@ def jrprint(*args, **kwargs):
     return print(*args, **kwargs)
 
 
+def jrprintCaptureStart():
+    # collect jrprint output instead of printing it (for worker processes whose output is printed by the parent, with jrprint(text, end=''))
+    global moduleCapturedTexts
+    moduleCapturedTexts = []
+
+
+def jrprintCaptureEnd():
+    # stop collecting and return list of captured texts
+    global moduleCapturedTexts
+    capturedTexts = moduleCapturedTexts
+    moduleCapturedTexts = None
+    return capturedTexts
+
+
+def jrprintFlush():
+    # flush pending output (for example before forking worker processes, so buffered output is not duplicated)
+    if (moduleLogFile is not None):
+        moduleLogFile.flush()
+    sys.stdout.flush()
+
+
 def jrlog(*args, **kwargs):
     # replacement for print function that will allow logging
     global moduleLogFile
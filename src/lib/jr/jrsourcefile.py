@@ -0,0 +1,87 @@
+# python imports
+import bisect
+
+
+
+
+# ---------------------------------------------------------------------------
+class JrSourceFile:
+    # text of a source file along with a table of line start offsets, so that we can map positions to lines with a bisect instead of rescanning
+    def __init__(self, text, sourceLabel=None):
+        self.text = text
+        self.sourceLabel = sourceLabel
+        #
+        self.lineStarts = [0]
+        pos = text.find('\n')
+        while (pos!=-1):
+            self.lineStarts.append(pos+1)
+            pos = text.find('\n', pos+1)
+        #
+        self.headerSpans = None
+
+
+    def getLineCount(self):
+        return len(self.lineStarts)
+
+    def calcLineNumberAtPos(self, pos):
+        # 0-based line number containing pos (same as number of newlines before pos)
+        return bisect.bisect_right(self.lineStarts, pos) - 1
+
+    def calcLineAndPosAtPos(self, pos):
+        # return [lineNumber, posOnLine]
+        lineNumber = self.calcLineNumberAtPos(pos)
+        return [lineNumber, pos - self.lineStarts[lineNumber]]
+
+    def getLineStart(self, lineNumber):
+        return self.lineStarts[lineNumber]
+
+    def getLineSpan(self, lineNumber):
+        # return [start, end] of line, not including the newline
+        start = self.lineStarts[lineNumber]
+        if (lineNumber+1 < len(self.lineStarts)):
+            end = self.lineStarts[lineNumber+1] - 1
+        else:
+            end = len(self.text)
+        return [start, end]
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+    def getHeaderSpans(self):
+        # spans [start, end] of every line that starts with "# "; computed once
+        if (self.headerSpans is None):
+            self.headerSpans = self.findLineSpansStartingWith('# ')
+        return self.headerSpans
+
+
+    def findLineSpansStartingWith(self, prefix):
+        spans = []
+        text = self.text
+        if (text.startswith(prefix)):
+            pos = 0
+        else:
+            pos = text.find('\n' + prefix)
+            if (pos!=-1):
+                pos += 1
+        while (pos!=-1):
+            end = text.find('\n', pos)
+            if (end==-1):
+                end = len(text)
+            spans.append([pos, end])
+            pos = text.find('\n' + prefix, end)
+            if (pos!=-1):
+                pos += 1
+        return spans
+
+
+    def spliceSpans(self, replacements):
+        # replacements is a list of [start, end, newText] sorted by start and not overlapping; return the new text
+        parts = []
+        pos = 0
+        for [start, end, newText] in replacements:
+            parts.append(self.text[pos:start])
+            parts.append(newText)
+            pos = end
+        parts.append(self.text[pos:])
+        return ''.join(parts)
+# ---------------------------------------------------------------------------
@@ -0,0 +1,15 @@
+# imports
+import os
+import sys
+import pytest
+
+
+# the modules import each other relative to src, and jrfuncs writes its log to logs/ under the current directory
+srcDirPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if (srcDirPath not in sys.path):
+    sys.path.insert(0, srcDirPath)
+
+
+@pytest.fixture(autouse=True)
+def chdirToSrc(monkeypatch):
+    monkeypatch.chdir(srcDirPath)
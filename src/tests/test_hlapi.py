@@ -0,0 +1,60 @@
+# imports
+import json
+import pytest
+
+import hlapi
+
+
+
+
+# ---------------------------------------------------------------------------
+def makeFeature(leadId, dName, address):
+    return {"type": "Feature", "properties": {"dName": dName, "address": address, "lead": leadId}, "geometry": {"type": "Point", "coordinates": [987654.5, 201234.25]}}
+
+
+def writeLeadFile(dataDirPath, fileName, features, newline, ensureAscii):
+    # written the way the hl data files are: one feature per line
+    lines = ['{', '"type": "FeatureCollection",', '"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:EPSG::2263" } },', '"features": [']
+    lines.append(',\n'.join([json.dumps(feature, ensure_ascii=ensureAscii) for feature in features]))
+    lines += [']', '}', '']
+    leadsDirPath = dataDirPath / 'leads'
+    leadsDirPath.mkdir(exist_ok=True)
+    filePath = leadsDirPath / fileName
+    filePath.write_bytes('\n'.join(lines).replace('\n', newline).encode('utf-8'))
+    return filePath
+
+
+testFeatures = [
+    makeFeature('1-1001', 'Holmes, Sherlock', '221b Baker St'),
+    makeFeature('1-1002', 'Café Ñandú', '12 Rüe de la Paix'),
+    makeFeature('1-1003', '日本 Restaurant', '1 Mott St'),
+    makeFeature('1-1004', 'Watson, John', '221b Baker St, apt. 2'),
+]
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+@pytest.mark.parametrize('ensureAscii', [True, False])
+def test_leadRowsMatchJsonLoad(tmp_path, newline, ensureAscii):
+    # rows read back lazily by byte offset must be exactly what json.load gives, for crlf files and for non ascii files
+    filePath = writeLeadFile(tmp_path, 'places_test.json', testFeatures, newline, ensureAscii)
+    with open(filePath, 'r', encoding='utf-8') as jsonFile:
+        expectedFeatures = json.load(jsonFile)['features']
+    api = hlapi.HlApi(str(tmp_path), {'disableLeadCache': True})
+    for expectedFeature in reversed(expectedFeatures):
+        [row, sourceKey] = api.findLeadRowByLeadId(expectedFeature['properties']['lead'])
+        assert (row == expectedFeature)
+        assert (sourceKey == 'places_test')
+        [row, sourceKey] = api.findLeadRowByNameOrAddress(expectedFeature['properties']['dName'])
+        assert (row == expectedFeature)
+
+
+def test_leadRowsFromCompiledCache(tmp_path):
+    writeLeadFile(tmp_path, 'places_test.json', testFeatures, '\r\n', False)
+    hlapi.HlApi(str(tmp_path), {}).loadLeads()
+    api = hlapi.HlApi(str(tmp_path), {})
+    for feature in testFeatures:
+        [row, sourceKey] = api.findLeadRowByLeadId(feature['properties']['lead'])
+        assert (row == feature)
+    # rows are memoized, so the same row is the same dict
+    assert (api.findLeadRowByLeadId('1-1002')[0] is api.findLeadRowByLeadId('#1-1002')[0])
+# ---------------------------------------------------------------------------
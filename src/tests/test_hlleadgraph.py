@@ -0,0 +1,48 @@
+# imports
+import pytest
+
+from lib.jr.hlleadgraph import LeadGraph
+
+
+
+
+# ---------------------------------------------------------------------------
+def makeGraph():
+    # 1 inherits from 2, 3 inserts 1, 4 takes its label from 3, 5 is an inline lead of 2, 6 stands alone
+    graph = LeadGraph()
+    for leadIndex in range(7):
+        graph.addLead(leadIndex)
+    graph.addEdge(1, 2, 'inherits')
+    graph.addEdge(3, 1, 'inserts')
+    graph.addEdge(4, 3, 'labelcontd')
+    graph.addEdge(5, 2, 'inline')
+    return graph
+
+
+def test_dependentsAndDependencies():
+    graph = makeGraph()
+    assert graph.getDependents(2) == [1, 5]
+    assert graph.getDependents(2, 'inline') == [5]
+    assert graph.getDependencies(3) == [1]
+    assert graph.getDependents(6) == []
+
+
+@pytest.mark.parametrize('changedIndices, kinds, expectedIndices', [
+    ([2], None, [1, 2, 3, 4, 5]),
+    ([1], None, [1, 3, 4]),
+    ([4], None, [4]),
+    ([6], None, [6]),
+    ([0, 6], None, [0, 6]),
+    ([2], ['inherits', 'inserts'], [1, 2, 3]),
+    ([], None, []),
+])
+def test_calcAffectedLeads(changedIndices, kinds, expectedIndices):
+    assert makeGraph().calcAffectedLeads(changedIndices, kinds) == expectedIndices
+
+
+def test_calcAffectedLeadsHandlesCycles():
+    graph = makeGraph()
+    graph.addEdge(2, 4, 'inserts')
+    assert graph.calcAffectedLeads([3]) == [1, 2, 3, 4, 5]
+    assert graph.findCycle(['inherits', 'inserts', 'labelcontd']) is not None
+# ---------------------------------------------------------------------------
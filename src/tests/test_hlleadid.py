@@ -0,0 +1,24 @@
+# imports
+from lib.jr.hlleadid import LeadId
+
+
+
+
+# ---------------------------------------------------------------------------
+def test_idsAreParsedOnceAndInterned():
+    leadId = LeadId.get('1-2345')
+    assert LeadId.get('1-2345') is leadId
+    assert LeadId.get(leadId) is leadId
+    assert [leadId.canonical, leadId.section, leadId.isStandardNumeric, leadId.linkPrefix] == ['1-2345', '1', True, '#']
+
+
+def test_clearInternTable():
+    leadId = LeadId.get('Main.clue two')
+    LeadId.clearInternTable()
+    assert len(LeadId.internTable) == 0
+    # ids handed out before keep working, and a later lookup parses the id again
+    assert leadId.markdownId == 'Main.clue_two'
+    leadIdAgain = LeadId.get('Main.clue two')
+    assert leadIdAgain is not leadId
+    assert [leadIdAgain.canonical, leadIdAgain.section, leadIdAgain.sortKey] == [leadId.canonical, leadId.section, leadId.sortKey]
+# ---------------------------------------------------------------------------
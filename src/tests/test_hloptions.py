@@ -0,0 +1,58 @@
+# imports
+import pytest
+
+from lib.jr.hloptions import OptionsSnapshot, thawOptionValue
+
+
+
+
+# ---------------------------------------------------------------------------
+def makeBaseOptions():
+    return {'workingdir': 'cases/test', 'basedir': '/base', 'storyDirectories': ['$workingdir/leads'], 'renderOptions': {'textSyntax': 'markdown', 'markdown': {'forceLinebreaks': True}}, 'clockTimeStep': 10}
+
+
+def test_workingOptionsOverrideBaseOptions():
+    snapshot = OptionsSnapshot(makeBaseOptions(), {'clockTimeStep': 5, 'style': None})
+    assert snapshot.getNumberThrowException('clockTimeStep') == 5
+    assert snapshot.get('style', 'twocolumn') == 'twocolumn'
+    assert snapshot.resolveTemplateVars('$basedir/$workingdir') == '/base/cases/test'
+
+
+def test_snapshotIsFrozen():
+    snapshot = OptionsSnapshot(makeBaseOptions(), {})
+    with pytest.raises(TypeError):
+        snapshot.values['clockTimeStep'] = 20
+    with pytest.raises(TypeError):
+        snapshot.getThrowException('renderOptions')['textSyntax'] = 'html'
+    with pytest.raises(TypeError):
+        snapshot.getThrowException('renderOptions')['markdown']['forceLinebreaks'] = False
+    with pytest.raises(AttributeError):
+        snapshot.getThrowException('storyDirectories').append('more')
+
+
+def test_snapshotDoesNotShareOptionData():
+    baseOptions = makeBaseOptions()
+    snapshot = OptionsSnapshot(baseOptions, {})
+    baseOptions['renderOptions']['textSyntax'] = 'html'
+    baseOptions['storyDirectories'].append('more')
+    assert snapshot.getRenderTextSyntax() == 'markdown'
+    assert snapshot.getThrowException('storyDirectories') == ('$workingdir/leads',)
+
+
+def test_badValueOnlyFailsItsOwnLookups():
+    snapshot = OptionsSnapshot(makeBaseOptions(), {'clockTimeDefaultLead': 'soon', 'renderOptions': 'none'})
+    assert snapshot.getNumberThrowException('clockTimeStep') == 10
+    assert snapshot.get('storyDirectories', None) == ('$workingdir/leads',)
+    with pytest.raises(Exception, match='clockTimeDefaultLead'):
+        snapshot.getNumberThrowException('clockTimeDefaultLead')
+    with pytest.raises(Exception, match='renderOptions'):
+        snapshot.getRenderTextSyntax()
+
+
+def test_thawGivesChangeableCopy():
+    snapshot = OptionsSnapshot(makeBaseOptions(), {})
+    renderOptions = thawOptionValue(snapshot.getThrowException('renderOptions'))
+    assert renderOptions == makeBaseOptions()['renderOptions']
+    renderOptions['markdown']['forceLinebreaks'] = False
+    assert snapshot.getThrowException('renderOptions')['markdown']['forceLinebreaks'] is True
+# ---------------------------------------------------------------------------
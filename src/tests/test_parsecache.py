@@ -0,0 +1,72 @@
+# imports
+import os
+import pytest
+
+import hlparser
+from hlparser import HlParser
+
+
+
+
+# ---------------------------------------------------------------------------
+srcDirPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+storyText = '# lead\nsome text $golead(other)\n# other\nmore text\n'
+sourceLabel = 'FILE "test.txt"'
+
+
+@pytest.fixture
+def parser(tmp_path):
+    overrideOptions = {'basedir': srcDirPath, 'savedir': str(tmp_path), 'workingdir': srcDirPath + '/cases/wrongBook'}
+    parser = HlParser(srcDirPath + '/options', overrideOptions)
+    parser.parseCacheEnabled = True
+    return parser
+
+
+def test_roundTrip(parser):
+    cacheKey = parser.calcParseCacheKey(storyText, sourceLabel)
+    headBlocks = parser.tokenizeStoryText(storyText, sourceLabel)
+    assert parser.loadCachedStoryBlocks(cacheKey, sourceLabel) is None
+    parser.saveCachedStoryBlocks(cacheKey, sourceLabel, headBlocks)
+    assert parser.loadCachedStoryBlocks(cacheKey, sourceLabel) == headBlocks
+    assert [parser.parseCacheStats['hits'], parser.parseCacheStats['misses']] == [1, 1]
+    # no temp files left behind
+    assert os.listdir(os.path.dirname(parser.calcParseCacheFilePath(cacheKey))) == [cacheKey + '.json']
+
+
+@pytest.mark.parametrize('cacheText', ['', '{"buildVersion": "3.0', '{}', '[1, 2]', '{"buildVersion": "BUILD", "parseCacheVersion": "VERSION", "sourceLabel": "LABEL"}', b'\xff\xfe{'])
+def test_unreadableCacheFileIsMiss(parser, cacheText):
+    # truncated, corrupt or incomplete cache files count as misses, and saving again replaces them
+    cacheKey = parser.calcParseCacheKey(storyText, sourceLabel)
+    filePath = parser.calcParseCacheFilePath(cacheKey)
+    os.makedirs(os.path.dirname(filePath))
+    if (isinstance(cacheText, str)):
+        cacheText = cacheText.replace('BUILD', hlparser.buildVersion).replace('"VERSION"', str(hlparser.parseCacheVersion)).replace('LABEL', sourceLabel.replace('"', '\\"')).encode('utf-8')
+    with open(filePath, 'wb') as cacheFile:
+        cacheFile.write(cacheText)
+    assert parser.loadCachedStoryBlocks(cacheKey, sourceLabel) is None
+    assert [parser.parseCacheStats['hits'], parser.parseCacheStats['misses']] == [0, 1]
+    #
+    headBlocks = parser.tokenizeStoryText(storyText, sourceLabel)
+    parser.saveCachedStoryBlocks(cacheKey, sourceLabel, headBlocks)
+    assert parser.loadCachedStoryBlocks(cacheKey, sourceLabel) == headBlocks
+
+
+def test_interruptedSaveKeepsOldFile(parser, monkeypatch):
+    cacheKey = parser.calcParseCacheKey(storyText, sourceLabel)
+    headBlocks = parser.tokenizeStoryText(storyText, sourceLabel)
+    parser.saveCachedStoryBlocks(cacheKey, sourceLabel, headBlocks)
+    filePath = parser.calcParseCacheFilePath(cacheKey)
+    with open(filePath, 'rb') as cacheFile:
+        savedBytes = cacheFile.read()
+    #
+    def interruptReplace(sourcePath, targetPath):
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(hlparser.os, 'replace', interruptReplace)
+    with pytest.raises(KeyboardInterrupt):
+        parser.saveCachedStoryBlocks(cacheKey, sourceLabel, [])
+    monkeypatch.undo()
+    with open(filePath, 'rb') as cacheFile:
+        assert cacheFile.read() == savedBytes
+    assert os.listdir(os.path.dirname(filePath)) == [cacheKey + '.json']
+    assert parser.loadCachedStoryBlocks(cacheKey, sourceLabel) == headBlocks
+# ---------------------------------------------------------------------------
@@ -0,0 +1,54 @@
+# imports
+import glob
+import os
+import pathlib
+import pytest
+
+import hlparser
+from hlparser import HlParser
+
+
+
+
+# ---------------------------------------------------------------------------
+srcDirPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+storyFilePaths = sorted(glob.glob(srcDirPath + '/cases/*/leads/*.txt'))
+
+
+@pytest.fixture(scope='module')
+def parser(tmp_path_factory):
+    overrideOptions = {'basedir': srcDirPath, 'savedir': str(tmp_path_factory.mktemp('output')), 'workingdir': srcDirPath + '/cases/wrongBook'}
+    return HlParser(srcDirPath + '/options', overrideOptions)
+
+
+def test_storyFilesFound():
+    assert len(storyFilePaths) > 0
+
+
+@pytest.mark.parametrize('storyFilePath', storyFilePaths, ids=os.path.basename)
+def test_storyFileTokensMatchLegacy(parser, storyFilePath, tmp_path):
+    # whole, chunked and streamed from disk
+    # some case files were saved as windows-1252, which the story loader only reads on machines where that is the default encoding, so we stream a utf-8 copy
+    fileBytes = pathlib.Path(storyFilePath).read_bytes()
+    try:
+        fileText = fileBytes.decode('utf-8')
+    except UnicodeDecodeError:
+        fileText = fileBytes.decode('cp1252')
+    copyFilePath = tmp_path / os.path.basename(storyFilePath)
+    copyFilePath.write_text(fileText, encoding='utf-8', newline='')
+    sourceLabel = 'FILE "{}"'.format(copyFilePath)
+    assert parser.calcTokenizerDifference('# comments\n' + fileText, sourceLabel, str(copyFilePath)) is None
+
+
+@pytest.mark.parametrize('snippet', hlparser.tokenizerTestSnippets)
+def test_snippetTokensMatchLegacy(parser, snippet):
+    # escapes, nested delimiters, unterminated blocks and other error paths
+    assert parser.calcTokenizerDifference(snippet, 'SNIPPET') is None
+
+
+def test_differenceIsReported(parser):
+    # the comparison itself must notice a changed block tree
+    resultA = parser.calcTokenizerResultForTest(parser.tokenizeStoryTextLegacy, '# lead\nsome text', 'SNIPPET')
+    resultB = parser.calcTokenizerResultForTest(parser.tokenizeStoryTextLegacy, '# lead\nother text', 'SNIPPET')
+    assert parser.calcFirstDifference(resultA, resultB, '') is not None
+# ---------------------------------------------------------------------------